@@ -0,0 +1,307 @@
+"""ドラッグ中に、手玉の進む道筋を予測して表示するためのモジュール
+
+手玉を突く力 (simulator.force_from_drag と同じ計算) から初速を求め、摩擦で止まるまでの直線を
+  - 止まっている的球との接触 (手玉の中心を通る半直線と、半径の和の円との交差)
+  - 壁との接触 (半直線と、壁を球の半径だけ内側にずらした直線との交差)
+  - ポケットへの落下 (半直線とポケットの円との交差)
+のうち最も近いもので区切っていく。接触した点での速度の変化は、Simulator と同じ
+compute_impact_force_between_points と compute_impact_force_by_fixture で求める。
+最初に当たった的球の進む向きも同じように求めるが、それより後の球どうしの衝突と回転の影響は考えない。
+
+的球は、盤面が変わったとき (table_key の球の番号と位置が変わったとき) だけ StaticBallIndex の格子に入れ直す。
+球が止まっていても tick は進むので、tick は key に使わない。
+マウスが reuse_pixels より少ししか動いていなければ前の予測をそのまま返し、
+1回の予測は budget 秒で打ち切るので、描画のフレームを落とさない。
+
+使い方 (既定の配置でいくつかのドラッグについて予測し、時間を表示する):
+    python aimguide.py
+"""
+import collections
+import math
+import time
+
+import pygame
+
+import billiard
+
+PgVector = pygame.math.Vector2
+
+# path: 手玉の中心が通る点 (ピクセル) のタプル。contact: 最初に的球に当たるときの手玉の中心 (無ければ None)
+# target: 当たる的球の番号。object_path: その的球の中心が通る点のタプル。complete: budget 内に最後まで求めたか
+AimPrediction = collections.namedtuple("AimPrediction", ["path", "contact", "target", "object_path", "complete"])
+
+
+def table_key(sprites):
+    """AimGuide.set_table に渡す盤面の key (球の番号と描画の位置のタプル)"""
+    return tuple((s.number, s.x, s.y) for s in sprites)
+
+
+class Probe:
+    """compute_impact_force_* に渡すための、球の位置と速度だけを持つクラス"""
+    __slots__ = ("pos_draw", "vel_real", "radius_for_draw", "restitution", "mass")
+
+    def __init__(self, pos_draw, vel_real, radius_for_draw, restitution, mass):
+        self.pos_draw = PgVector(pos_draw)
+        self.vel_real = PgVector(vel_real)
+        self.radius_for_draw = radius_for_draw
+        self.restitution = restitution
+        self.mass = mass
+
+
+def ray_circle(ox, oy, dx, dy, cx, cy, radius):
+    """(ox, oy) から単位ベクトル (dx, dy) の向きに進む点が、中心 (cx, cy) 半径 radius の円に入るまでの距離
+
+    入らない場合と、すでに円の中にいる場合は None を返す。
+    """
+    fx, fy = ox - cx, oy - cy
+    b = fx * dx + fy * dy
+    c = fx * fx + fy * fy - radius * radius
+    if c < 0 or b > 0:
+        return None
+    discriminant = b * b - c
+    if discriminant < 0:
+        return None
+    return -b - math.sqrt(discriminant)
+
+
+def ray_boundary(ox, oy, dx, dy, boundary, radius):
+    """球の中心が (ox, oy) から (dx, dy) の向きに進むとき、壁に接するまでの距離 (壁から離れる向きなら None)
+
+    compute_impact_force_by_fixture と同じく、normal・(pos - point_included) + radius が 0 になる点を求める。
+    """
+    normal, point = boundary.normal, boundary.point_included
+    approach = normal.x * dx + normal.y * dy
+    if approach <= 0:
+        return None
+    invasion = normal.x * (ox - point.x) + normal.y * (oy - point.y) + radius
+    return max(-invasion / approach, 0.0)
+
+
+class StaticBallIndex:
+    """止まっている球を格子に入れておき、半直線が最初に当たる球を求めるクラス
+
+    球は、手玉の半径を足した円が重なるマスすべてに入れておくので、半直線が通るマスを
+    順にたどり (Amanatides-Woo の方法)、そのマスの球だけと交差を調べればよい。
+    """
+    def __init__(self, sprites, probe_radius, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.balls = []
+        for s in sprites:
+            reach = s.radius + probe_radius
+            self.balls.append((s.number, s.x, s.y, reach))
+            for column in range(int((s.x - reach) // cell_size), int((s.x + reach) // cell_size) + 1):
+                for row in range(int((s.y - reach) // cell_size), int((s.y + reach) // cell_size) + 1):
+                    self.cells.setdefault((column, row), []).append(self.balls[-1])
+
+    def first_hit(self, ox, oy, dx, dy, max_distance):
+        """(ox, oy) から (dx, dy) の向きに max_distance まで進む間に最初に当たる球の (距離, 番号, x, y)"""
+        if not self.balls:
+            return None
+        cell_size = self.cell_size
+        column, row = int(ox // cell_size), int(oy // cell_size)
+        step_x = 1 if dx > 0 else -1
+        step_y = 1 if dy > 0 else -1
+        # 次のマスの境界までの距離と、1マス進むのにかかる距離
+        if dx != 0:
+            boundary_x = (column + (step_x > 0)) * cell_size
+            t_max_x, t_delta_x = (boundary_x - ox) / dx, cell_size / abs(dx)
+        else:
+            t_max_x = t_delta_x = math.inf
+        if dy != 0:
+            boundary_y = (row + (step_y > 0)) * cell_size
+            t_max_y, t_delta_y = (boundary_y - oy) / dy, cell_size / abs(dy)
+        else:
+            t_max_y = t_delta_y = math.inf
+
+        best = None
+        t_cell = 0.0
+        while t_cell <= max_distance:
+            for number, cx, cy, reach in self.cells.get((column, row), ()):
+                t = ray_circle(ox, oy, dx, dy, cx, cy, reach)
+                if t is not None and t <= max_distance and (best is None or t < best[0]):
+                    best = (t, number, cx, cy)
+            # 当たった点がこのマスの中にあれば、それより先のマスの球はもっと遠い
+            if best is not None and best[0] <= min(t_max_x, t_max_y):
+                return best
+            if t_max_x < t_max_y:
+                t_cell = t_max_x
+                t_max_x += t_delta_x
+                column += step_x
+            else:
+                t_cell = t_max_y
+                t_max_y += t_delta_y
+                row += step_y
+        return best
+
+
+class AimGuide:
+    """ドラッグの向きと長さから、手玉の道筋・最初に当たる的球・その的球の向きを予測するクラス
+
+    world・boundaries・pockets は Simulator と同じものを渡す。mass・restitution・radius は手玉の値
+    (的球も同じ値とする。radius は radius_for_draw と同じピクセル単位)。
+    """
+    def __init__(self, world, boundaries, pockets, mass=0.17, restitution=0.9, radius=14, cell_size=64,
+                 max_bounces=3, reuse_pixels=3, budget=0.002, clock=time.perf_counter):
+        self.world = world
+        self.boundaries = [b for b in boundaries if not b.skip]
+        self.pockets = [(p.centerpos.x, p.centerpos.y, p.radius) for p in pockets]
+        self.mass = mass
+        self.restitution = restitution
+        self.radius = radius
+        self.cell_size = cell_size
+        self.max_bounces = max_bounces
+        self.reuse_pixels = reuse_pixels
+        self.budget = budget
+        self.clock = clock
+        self.deceleration = world.friction * PgVector(world.grav_acc).magnitude()  # 摩擦による減速 (m/s^2)
+
+        self.table_key = None
+        self.index = None
+        self.last = None  # (table_key, 手玉の位置, ドラッグのベクトル, AimPrediction)
+        self.computed = 0
+        self.reused = 0
+
+    def set_table(self, key, sprites):
+        """盤面を設定するメソッド。key (球の番号と位置など) が前と同じなら格子を作り直さない
+
+        sprites の最初の球を手玉とし、それ以外を的球として格子に入れる。
+        """
+        if key == self.table_key and self.index is not None:
+            return
+        self.table_key = key
+        self.index = StaticBallIndex(sprites[1:], self.radius, self.cell_size)
+        self.last = None
+
+    def predict(self, cue_pos, drag):
+        """手玉の位置 cue_pos から、ドラッグのベクトル drag (終点 - 始点、ピクセル) で突いた場合の予測を返すメソッド
+
+        前の予測と盤面が同じで、手玉の位置とドラッグのずれが reuse_pixels 未満なら前の予測を返す。
+        """
+        drag = PgVector(drag)
+        if drag.length() == 0:
+            return None
+        last = self.last
+        if (last is not None and last[0] == self.table_key and last[1].distance_to(cue_pos) < self.reuse_pixels
+                and last[2].distance_to(drag) < self.reuse_pixels):
+            self.reused += 1
+            return last[3]
+        prediction = self.compute(PgVector(cue_pos), drag)
+        self.computed += 1
+        if prediction.complete:
+            self.last = (self.table_key, PgVector(cue_pos), drag, prediction)
+        return prediction
+
+    def compute(self, cue_pos, drag):
+        deadline = self.clock() + self.budget
+        # force_from_drag の力が1tickの間だけ加わったときの速度 (Numbermass.move と同じ)
+        force_magnitude = 50 + drag.length() / 7.5
+        velocity = -drag.normalize() * (force_magnitude / self.mass * self.world.dt)
+
+        path, contact, velocity, complete = self.trace(cue_pos, velocity, self.index, deadline)
+        if contact is None:
+            return AimPrediction(tuple(path), None, None, (), complete)
+
+        number, ghost, ball_pos = contact
+        cue = Probe(ghost, velocity, self.radius, self.restitution, self.mass)
+        target = Probe(ball_pos, (0, 0), self.radius, self.restitution, self.mass)
+        # 接している点ではわずかに離れていることがあるので、半径の和より少しだけ近づけて力を求める
+        cue.pos_draw += (target.pos_draw - cue.pos_draw) * 1e-6
+        f1 = billiard.compute_impact_force_between_points(cue, target, self.world.dt)
+        if f1 is None:
+            return AimPrediction(tuple(path), tuple(ghost), number, (), complete)
+        dt = self.world.dt
+        cue_velocity = velocity + f1 / self.mass * dt
+        object_velocity = -f1 / self.mass * dt
+        cue_rest, _, _, cue_complete = self.trace(PgVector(ghost), cue_velocity, None, deadline, 1)
+        object_path, _, _, object_complete = self.trace(PgVector(ball_pos), object_velocity, None, deadline)
+        return AimPrediction(tuple(path) + tuple(cue_rest[1:]), tuple(ghost), number, tuple(object_path),
+                             complete and cue_complete and object_complete)
+
+    def trace(self, pos, velocity, index, deadline, max_bounces=None):
+        """pos (ピクセル) から velocity (m/s) で進む球の道筋を、止まるか的球に当たるまで求めるメソッド
+
+        戻り値は (通る点のリスト, (番号, 当たったときの位置, 的球の位置) または None, 最後の速度, 最後まで求めたか)。
+        """
+        if max_bounces is None:
+            max_bounces = self.max_bounces
+        points = [(pos.x, pos.y)]
+        radius, dt = self.radius, self.world.dt
+        bounces = 0
+        while True:
+            speed = velocity.length()
+            if speed < 1e-2:
+                return points, None, velocity, True
+            if self.clock() > deadline:
+                return points, None, velocity, False
+            dx, dy = velocity.x / speed, velocity.y / speed
+            reach = speed * speed / (2 * self.deceleration) * self.world.scale  # 止まるまでに進む距離 (ピクセル)
+
+            t, event = reach, None
+            if index is not None:
+                hit = index.first_hit(pos.x, pos.y, dx, dy, t)
+                if hit is not None:
+                    t, event = hit[0], ("ball", hit)
+            for boundary in self.boundaries:
+                t_boundary = ray_boundary(pos.x, pos.y, dx, dy, boundary, radius)
+                if t_boundary is not None and t_boundary < t:
+                    t, event = t_boundary, ("cushion", boundary)
+            for cx, cy, pocket_radius in self.pockets:
+                t_pocket = ray_circle(pos.x, pos.y, dx, dy, cx, cy, pocket_radius)
+                if t_pocket is not None and t_pocket < t:
+                    t, event = t_pocket, ("pocket", None)
+
+            pos = PgVector(pos.x + dx * t, pos.y + dy * t)
+            points.append((pos.x, pos.y))
+            if event is None or event[0] == "pocket":
+                return points, None, velocity, True
+            # 摩擦で減った速さ (等加速度運動)
+            speed = math.sqrt(max(speed * speed - 2 * self.deceleration * t / self.world.scale, 0.0))
+            velocity = PgVector(dx * speed, dy * speed)
+            if event[0] == "ball":
+                _, number, cx, cy = event[1]
+                return points, (number, (pos.x, pos.y), (cx, cy)), velocity, True
+
+            if bounces >= max_bounces:
+                return points, None, velocity, True
+            bounces += 1
+            boundary = event[1]
+            # 接した点から壁の側へわずかに進めた位置で、壁の力を求める
+            probe = Probe(pos + boundary.normal * 1e-6, velocity, radius, self.restitution, self.mass)
+            f = billiard.compute_impact_force_by_fixture(probe, boundary.normal, boundary.point_included, dt)
+            if f is None:
+                return points, None, velocity, True
+            velocity = velocity + f / self.mass * dt
+
+
+def main():
+    import simulator
+    import renderer
+
+    sim = simulator.Simulator()
+    boundaries = [b for a in sim.actor_list if isinstance(a, billiard.ContactPhase) for b in a.boundaries]
+    guide = AimGuide(sim.world, boundaries, sim.pockets)
+    cue_pos = sim.balls()[0].pos_draw
+    # マウスを1フレームに1ピクセルずつ動かしたドラッグ (reuse_pixels 未満の動きは前の予測を使う)
+    # AppMain.aim_prediction と同じく、フレームごとに盤面の key を求め、変わったときだけ set_table を呼ぶ
+    drags = [PgVector(-200, 0).rotate(angle * 0.3) for angle in range(1200)]
+    rebuilt = 0
+    elapsed = 0.0
+    for drag in drags:
+        sim.step()  # 球は止まっているが tick は進む
+        start = time.perf_counter()
+        sprites = renderer.sprite_states(sim.balls())
+        key = table_key(sprites)
+        if key != guide.table_key:
+            guide.set_table(key, sprites)
+            rebuilt += 1
+        guide.predict(cue_pos, drag)
+        elapsed += time.perf_counter() - start
+    print(f"computed: {guide.computed}, reused: {guide.reused}, index built: {rebuilt}, "
+          f"{elapsed / len(drags) * 1e6:.1f} us/frame")
+    prediction = guide.predict(cue_pos, (-200, 0))
+    print(f"straight shot: target {prediction.target} at {prediction.contact}, path {prediction.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""フォント・文字の画像・画像ファイルを1か所で読み込み、使い回すためのモジュール
+
+pygame.init() は使わないサブシステム (音声やジョイスティックなど) まで初期化するので、init では
+描画に必要な display と font だけを初期化する。フォントは大きさごとに1つだけ作り、
+文字の画像は (文字列, 大きさ, 色) ごとに LRU キャッシュに保持する。画像は最初に使うときに読み込む。
+
+table_atlas は、テーブルの背景 (画面の大きさに合わせて切り出したもの) と、回転させた番号の画像
+(番号 × 量子化した角度) を1枚の画像にまとめ、path に無圧縮で保存する。次からはその1枚を読むだけでよいので、
+PNG の展開と番号の描画・回転を起動時に行わない。元の画像や設定が変わった場合は作り直す。
+
+shared() はプロセスで共有する Assets を返す (Numbermass.draw や Point_selectmode など、
+AppMain を参照しない描画で使う)。
+"""
+import collections
+import hashlib
+import json
+import os
+import struct
+
+import pygame
+
+IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+ATLAS_MAGIC = b"BATL"
+ATLAS_VERSION = 1
+
+
+def init():
+    """描画に必要なサブシステム (display と font) だけを初期化する関数"""
+    pygame.display.init()
+    pygame.font.init()
+
+
+class Assets:
+    """フォント・文字の画像・画像ファイルのキャッシュ"""
+    def __init__(self, image_dir=IMAGE_DIR, max_texts=256):
+        self.image_dir = image_dir
+        self.max_texts = max_texts
+        self.fonts = {}
+        self.texts = collections.OrderedDict()  # (文字列, 大きさ, 色) -> Surface
+        self.images = {}
+
+    def font(self, size):
+        """既定のフォントの size の大きさのものを返すメソッド (大きさごとに1回だけ作る)"""
+        font = self.fonts.get(size)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self.fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def text(self, text, size, color="Black"):
+        """文字列を描いた画像を返すメソッド。同じ文字列・大きさ・色なら前に作ったものを返す"""
+        key = (text, size, tuple(pygame.Color(color)))
+        surface = self.texts.get(key)
+        if surface is not None:
+            self.texts.move_to_end(key)
+            return surface
+        surface = self.font(size).render(text, True, pygame.Color(color))
+        self.texts[key] = surface
+        if len(self.texts) > self.max_texts:
+            self.texts.popitem(last=False)
+        return surface
+
+    def image(self, name):
+        """image_dir の画像を最初に使うときに読み込んで返すメソッド (画面があれば表示用の形式に変換する)"""
+        surface = self.images.get(name)
+        if surface is None:
+            surface = pygame.image.load(os.path.join(self.image_dir, name))
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert_alpha()
+            self.images[name] = surface
+        return surface
+
+    def atlas_key(self, screen_size, table_image, numbers, angle_step, font_size):
+        """アトラスを作り直す必要があるかを判定するためのキー (元の画像の大きさと更新時刻・設定から作る)"""
+        stat = os.stat(os.path.join(self.image_dir, table_image))
+        source = [ATLAS_VERSION, list(screen_size), table_image, stat.st_size, stat.st_mtime_ns,
+                  list(numbers), angle_step, font_size, pygame.version.ver]
+        return hashlib.blake2b(json.dumps(source).encode("utf-8"), digest_size=16).hexdigest()
+
+    def table_atlas(self, screen_size, table_image="design.png", numbers=range(11), angle_step=6, font_size=30,
+                    path=None):
+        """テーブルの背景と、回転させた番号の画像を返すメソッド
+
+        戻り値は (背景の Surface, {(番号, 角度の番号): Surface})。角度の番号は renderer.LabelCache.bucket と同じ。
+        path を指定すると、そこに保存したアトラスが使えれば読み込み、使えなければ作って保存する。
+        """
+        key = self.atlas_key(screen_size, table_image, numbers, angle_step, font_size)
+        if path is not None:
+            loaded = self.load_atlas(path, key)
+            if loaded is not None:
+                return loaded
+        background, labels = self.render_atlas(screen_size, table_image, numbers, angle_step, font_size)
+        if path is not None:
+            self.save_atlas(path, key, background, labels)
+        return background, labels
+
+    def render_atlas(self, screen_size, table_image, numbers, angle_step, font_size):
+        """背景と番号の画像を、それぞれ描いて作るメソッド (TableRenderer と LabelCache と同じ描き方)"""
+        background = pygame.Surface(screen_size)
+        background.fill((0, 0, 0))
+        image = self.image(table_image)
+        background.blit(image, (screen_size[0] // 2 - image.get_width() // 2,
+                                screen_size[1] // 2 - image.get_height() // 2))
+        labels = {}
+        font = self.font(font_size)
+        for number in numbers:
+            text_surface = font.render(f"{number}", True, pygame.Color("Black"))
+            for bucket in range(int(360 / angle_step)):
+                labels[(number, bucket)] = pygame.transform.rotate(text_surface, bucket * angle_step)
+        return background, labels
+
+    def save_atlas(self, path, key, background, labels):
+        """背景の下に番号の画像を行ごとに並べた1枚の画像を作り、索引と一緒に無圧縮で保存するメソッド"""
+        width = background.get_width()
+        rects = {}
+        x = y = row_height = 0
+        top = background.get_height()
+        for label_key, surface in labels.items():
+            w, h = surface.get_size()
+            if x + w > width:
+                x, y, row_height = 0, y + row_height, 0
+            rects[label_key] = (x, top + y, w, h)
+            x += w
+            row_height = max(row_height, h)
+        sheet = pygame.Surface((width, top + y + row_height), pygame.SRCALPHA)
+        sheet.blit(background, (0, 0))
+        for label_key, surface in labels.items():
+            sheet.blit(surface, rects[label_key][:2])
+        index = json.dumps({
+            "key": key,
+            "size": list(sheet.get_size()),
+            "background": [0, 0, width, top],
+            "labels": [[number, bucket, *rect] for (number, bucket), rect in rects.items()],
+        }).encode("utf-8")
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(ATLAS_MAGIC + struct.pack("<I", len(index)) + index)
+            f.write(pygame.image.tobytes(sheet, "RGBA"))
+        os.replace(temporary, path)
+
+    def load_atlas(self, path, key):
+        """保存したアトラスを読み込むメソッド。無いか、key が違う (作り直しが必要な) 場合は None"""
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if data[:4] != ATLAS_MAGIC:
+            return None
+        index_length, = struct.unpack_from("<I", data, 4)
+        index = json.loads(data[8:8 + index_length])
+        if index["key"] != key:
+            return None
+        sheet = pygame.image.frombuffer(memoryview(data)[8 + index_length:], tuple(index["size"]), "RGBA")
+        if pygame.display.get_surface() is not None:
+            sheet = sheet.convert_alpha()
+        else:
+            sheet = sheet.copy()  # frombuffer の画像は data を参照しているので、コピーしておく
+        background = sheet.subsurface(index["background"])
+        if pygame.display.get_surface() is not None:
+            background = background.convert()
+        labels = {(number, bucket): sheet.subsurface((x, y, w, h)) for number, bucket, x, y, w, h in index["labels"]}
+        return background, labels
+
+
+_shared = None
+
+
+def shared():
+    """プロセスで共有する Assets を返す関数"""
+    global _shared
+    if _shared is None:
+        _shared = Assets()
+    return _shared
@@ -0,0 +1,323 @@
+"""NumPy配列で全ての球の状態を一括して計算するモジュール
+
+Numbermass 1個ごとの Python オブジェクト処理の代わりに、位置・速度・角速度・質量・反発係数を
+連続した配列として保持し、摩擦・積分・2球間の衝突・壁での反射をまとめて計算する。
+1tickの計算順序は AppMain.update (球の更新 → CollisionResolver → Boundary) と同じにしてある。
+pygame の Vector2 はスカラーでの除算を逆数の乗算で行うので、配列でも同じ形で計算し、結果を一致させている。
+"""
+import functools
+
+import numpy as np
+from pygame.math import Vector2 as PgVector
+
+import billiard
+
+
+class BallTable:
+    """全ての球の状態を配列で保持し、1tick分の物理計算をまとめて行うクラス"""
+    def __init__(self, world, balls, boundaries=()):
+        self.is_alive = True
+        self.world = world
+        n = len(balls)
+        self.pos = np.array([[b.pos_real.x, b.pos_real.y] for b in balls], dtype=np.float64).reshape(n, 2)
+        self.vel = np.array([[b.vel_real.x, b.vel_real.y] for b in balls], dtype=np.float64).reshape(n, 2)
+        self.pos_draw = np.array([[b.pos_draw.x, b.pos_draw.y] for b in balls], dtype=np.float64).reshape(n, 2)
+        self.force = np.array([[b.total_force.x, b.total_force.y] for b in balls], dtype=np.float64).reshape(n, 2)
+        self.angle = np.array([b.angle for b in balls], dtype=np.float64)
+        self.angular_velocity = np.array([b.angular_velocity for b in balls], dtype=np.float64)
+        self.angular_acceleration = np.array([b.angular_acceleration for b in balls], dtype=np.float64)
+        self.mass = np.array([b.mass for b in balls], dtype=np.float64)
+        self.radius = np.array([b.radius for b in balls], dtype=np.float64)
+        self.radius_for_draw = np.array([b.radius_for_draw for b in balls], dtype=np.float64)
+        self.restitution = np.array([b.restitution for b in balls], dtype=np.float64)
+        self.moment_of_inertia = np.array([b.moment_of_inertia for b in balls], dtype=np.float64)
+        self.angular_damping = np.array([b.angular_damping for b in balls], dtype=np.float64)
+        self.alive = np.ones(n, dtype=bool)
+
+        # 壁は (法線, 壁上の1点) の組として保持する (Boundary.skip の壁は除く)
+        cushions = [b for b in boundaries if not b.skip]
+        self.cushion_normals = np.array([[b.normal.x, b.normal.y] for b in cushions], dtype=np.float64).reshape(-1, 2)
+        self.cushion_points = np.array([[b.point_included.x, b.point_included.y] for b in cushions], dtype=np.float64).reshape(-1, 2)
+        self.cushion_flags = [b.hit_flag for b in cushions]  # telemetry のイベントに書く壁
+
+        self.views = [BallView(self, i, b) for i, b in enumerate(balls)]
+
+    @classmethod
+    def replace_actors(cls, world, actor_list):
+        """actor_list 内の Numbermass / CollisionResolver / Boundary を BallTable に置き換える
+
+        球は同じ位置に BallView として残すので、Pocket や AppMain.draw はそのまま動作する。
+        ContactPhase がある場合は、その壁の計算も BallTable が行い、ContactPhase はポケットだけを調べる。
+        落ちた球は、全てのポケットの listeners に加えた on_ball_dropped で計算対象から外す。
+        """
+        balls = [a for a in actor_list if billiard.is_number_mass(a)]
+        boundaries = [a for a in actor_list if isinstance(a, billiard.Boundary)]
+        contact_phases = [a for a in actor_list if isinstance(a, billiard.ContactPhase)]
+        for contact_phase in contact_phases:
+            boundaries.extend(contact_phase.boundaries)
+            contact_phase.cushions = False
+        table = cls(world, balls, boundaries)
+        pockets = [a for a in actor_list if isinstance(a, billiard.Pocket)]
+        for contact_phase in contact_phases:
+            contact_phase.live_balls.reset(table.views)
+            pockets.extend(contact_phase.pockets)
+        for pocket in pockets:
+            pocket.listeners.append(table.on_ball_dropped)
+        views = iter(table.views)
+        new_list = []
+        for a in actor_list:
+            if billiard.is_number_mass(a):
+                new_list.append(next(views))
+            elif isinstance(a, billiard.CollisionResolver):
+                new_list.append(table)
+            elif not isinstance(a, billiard.Boundary):
+                new_list.append(a)
+        if table not in new_list:
+            new_list.insert(len(table.views), table)
+        actor_list[:] = new_list
+        return table
+
+    def draw(self, surface):
+        pass
+
+    def update(self):
+        self.move()
+        self.generate_force_points()
+        self.generate_force_by_cushions()
+
+    def on_ball_dropped(self, pocket, actor):
+        """ポケットに落ちた球を計算対象から外す (Pocket.listeners から呼ばれる)"""
+        if isinstance(actor, BallView) and actor.table is self:
+            self.alive[actor.index] = False
+
+    def move(self):
+        """摩擦・積分・角速度の減衰・停止判定をまとめて行う (Numbermass.update に相当)"""
+        dt = self.world.dt
+        idx = np.flatnonzero(self.alive)
+        vel = self.vel[idx]
+        force = self.force[idx]
+        mass = self.mass[idx]
+
+        speed = np.sqrt(vel[:, 0] * vel[:, 0] + vel[:, 1] * vel[:, 1])
+        moving = speed > 0
+        force_magnitude = mass * self.world.grav_acc.magnitude() * self.world.friction
+        direction = -(vel[moving] / speed[moving, None])
+        force[moving] = force[moving] + direction * force_magnitude[moving, None]
+
+        vel = vel + force * (1 / mass)[:, None] * dt
+        pos = self.pos[idx] + vel * dt
+
+        w = self.angular_velocity[idx] + self.angular_acceleration[idx] * dt
+        w = w * self.angular_damping[idx]
+        angle = self.angle[idx] + w * dt * 180 / 3.14
+        angle = np.mod(angle, 360)
+
+        pos_draw = pos * self.world.scale
+        stopped = (np.sqrt(vel[:, 0] * vel[:, 0] + vel[:, 1] * vel[:, 1]) < 1e-2) & (w < 10)
+        vel[stopped] = 0.0
+        w[stopped] = 0.0
+
+        self.pos[idx] = pos
+        self.vel[idx] = vel
+        self.pos_draw[idx] = pos_draw
+        self.angle[idx] = angle
+        self.angular_velocity[idx] = w
+        self.force[:] = 0.0
+        self.angular_acceleration[:] = 0.0
+
+    def generate_force_points(self):
+        """2球間の衝突による力を一括で計算する (CollisionResolver.generate_force_points に相当)"""
+        idx = np.flatnonzero(self.alive)
+        if len(idx) < 2:
+            return
+        dt = self.world.dt
+        ii, jj = np.triu_indices(len(idx), k=1)
+        i, j = idx[ii], idx[jj]
+
+        d = self.pos_draw[j] - self.pos_draw[i]
+        distance = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+        hit = (distance <= self.radius_for_draw[i] + self.radius_for_draw[j]) & (distance != 0)
+        i, j, d, distance = i[hit], j[hit], d[hit], distance[hit]
+        normal = d / distance[:, None]
+        v1 = self.vel[i, 0] * normal[:, 0] + self.vel[i, 1] * normal[:, 1]
+        v2 = self.vel[j, 0] * normal[:, 0] + self.vel[j, 1] * normal[:, 1]
+        hit = ~(v1 < v2)
+        if not hit.any():
+            return
+        i, j, normal, v1, v2 = i[hit], j[hit], normal[hit], v1[hit], v2[hit]
+        telemetry = self.world.telemetry
+        if telemetry is not None:
+            for a, b in zip(i.tolist(), j.tolist()):
+                telemetry.contact(self.views[a], self.views[b])
+
+        e = self.restitution[i] * self.restitution[j]
+        m1, m2 = self.mass[i], self.mass[j]
+        f1 = normal * (-(e + 1) * v1 + (e + 1) * v2)[:, None] * (1 / (1 / m1 + 1 / m2))[:, None] * (1 / dt)
+
+        relative_angular_vel = self.angular_velocity[i] - self.angular_velocity[j]
+        compare_value = np.where(self.angular_velocity[i] > self.angular_velocity[j], 1.0, -1.0)
+        fric1, alpha1 = self._friction_while_moving(i, f1, compare_value, relative_angular_vel)
+        fric2, alpha2 = self._friction_while_moving(j, -f1, compare_value, relative_angular_vel)
+
+        # 衝突ペアの順に p1, p2 の順で足し込み、逐次計算と同じ加算順序にする
+        k = len(i)
+        targets = np.empty((k, 4), dtype=np.intp)
+        targets[:, 0] = targets[:, 1] = i
+        targets[:, 2] = targets[:, 3] = j
+        contributions = np.empty((k, 4, 2), dtype=np.float64)
+        contributions[:, 0] = f1
+        contributions[:, 1] = -fric1
+        contributions[:, 2] = -f1
+        contributions[:, 3] = -fric2
+        np.add.at(self.force, targets.ravel(), contributions.reshape(-1, 2))
+        np.add.at(self.angular_acceleration, np.stack([i, j], axis=1).ravel(), np.stack([alpha1, alpha2], axis=1).ravel())
+
+    def _friction_while_moving(self, index, force, compare_value, relative_angular_vel):
+        """Numbermass.receive_force_while_moving の摩擦力と角加速度を配列で計算する"""
+        mass, radius = self.mass[index], self.radius[index]
+        friction_f_length = 5 * mass * radius * np.abs(relative_angular_vel) / (7 * (1 - self.restitution[index]) * self.world.dt) * (3.14 / 180)
+        torque = -friction_f_length * radius * compare_value
+        alpha = torque / self.moment_of_inertia[index]
+
+        perpendicular = np.stack([-force[:, 1], force[:, 0]], axis=1)
+        length = np.sqrt(perpendicular[:, 0] * perpendicular[:, 0] + perpendicular[:, 1] * perpendicular[:, 1])
+        apply = ~(friction_f_length < 2.5) & (length > 0)
+        fric = np.zeros_like(force)
+        fric[apply] = perpendicular[apply] / length[apply, None] * friction_f_length[apply, None] * compare_value[apply, None]
+        return fric, alpha
+
+    def generate_force_by_cushions(self):
+        """壁と球の衝突による力を一括で計算する (Boundary.generate_force に相当)"""
+        idx = np.flatnonzero(self.alive)
+        dt = self.world.dt
+        pos_draw = self.pos_draw[idx]
+        vel = self.vel[idx]
+        e = self.restitution[idx]
+        m = self.mass[idx]
+        telemetry = self.world.telemetry
+        for normal, point, flag in zip(self.cushion_normals, self.cushion_points, self.cushion_flags):
+            invasion = normal[0] * (pos_draw[:, 0] - point[0]) + normal[1] * (pos_draw[:, 1] - point[1])
+            v = normal[0] * vel[:, 0] + normal[1] * vel[:, 1]
+            hit = (invasion + self.radius_for_draw[idx] > 0) & (v > 0)
+            if not hit.any():
+                continue
+            f = normal[None, :] * (-(e[hit] + 1) * v[hit])[:, None] * m[hit, None] * (1 / dt)
+            self.force[idx[hit]] += f
+            if telemetry is not None:
+                for k in idx[hit].tolist():
+                    telemetry.cushion(self.views[k], flag)
+
+    def receive_force(self, index, force, contact_point=None):
+        self.force[index, 0] += force[0]
+        self.force[index, 1] += force[1]
+        if contact_point:
+            torque = PgVector(force).magnitude() * contact_point[0]
+            self.angular_acceleration[index] += torque / self.moment_of_inertia[index]
+
+
+class RowVector(PgVector):
+    """BallTable の配列の1行 (pos や vel) の値を持つ Vector2
+
+    x・y・添字への代入や update・normalize_ip などのその場での変更を write で配列に書き戻すので、
+    p.pos_real.update(...) のように BallView から取り出したベクトルを書き換えても変更が失われない。
+    演算の結果 (pos_real * scale など) は配列を指さないただの値で、変更しても書き戻さない。
+    """
+    def __init__(self, values, write):
+        super().__init__(values)
+        self.__dict__["write"] = write
+
+    def write_back(self):
+        write = self.__dict__.get("write")
+        if write is not None:
+            write(self)
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        if name in ("x", "y"):
+            self.write_back()
+
+
+def _writing_back(name):
+    method = getattr(PgVector, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.write_back()
+        return result
+    wrapper.__name__ = name
+    return wrapper
+
+
+for _name in ("update", "__setitem__", "__iadd__", "__isub__", "__imul__", "__itruediv__", "__ifloordiv__",
+              "normalize_ip", "scale_to_length", "rotate_ip", "rotate_ip_rad", "rotate_rad_ip", "reflect_ip",
+              "clamp_magnitude_ip", "from_polar"):
+    if hasattr(PgVector, _name):
+        setattr(RowVector, _name, _writing_back(_name))
+
+
+class BallView(billiard.Numbermass):
+    """BallTable の配列の1行を Numbermass として見せるクラス
+
+    物理計算は BallTable.update が一括で行うので、update は何もしない。
+    描画やポケットの判定に必要な属性は配列から読み出す。
+    """
+    def __init__(self, table, index, ball):
+        self.table = table
+        self.index = index
+        self.number = ball.number
+        self.color = ball.color
+        self.radius = ball.radius
+        self.radius_for_draw = ball.radius_for_draw
+        self.mass = ball.mass
+        self.restitution = ball.restitution
+        self.moment_of_inertia = ball.moment_of_inertia
+        self.world = ball.world
+        self.scale = table.world.scale
+        self.text_surface = ball.text_surface
+        self.asleep = False  # 物理計算は BallTable が一括で行うので、球ごとには止めない
+
+    @property
+    def pos_real(self):
+        return RowVector(self.table.pos[self.index].tolist(), functools.partial(BallView.pos_real.fset, self))
+
+    @pos_real.setter
+    def pos_real(self, value):
+        self.table.pos[self.index] = tuple(value)
+        self.table.pos_draw[self.index] = self.table.pos[self.index] * self.table.world.scale
+
+    @property
+    def vel_real(self):
+        return RowVector(self.table.vel[self.index].tolist(), functools.partial(BallView.vel_real.fset, self))
+
+    @vel_real.setter
+    def vel_real(self, value):
+        self.table.vel[self.index] = tuple(value)
+
+    @property
+    def pos_draw(self):
+        return PgVector(self.table.pos_draw[self.index].tolist())
+
+    @property
+    def total_force(self):
+        return PgVector(self.table.force[self.index].tolist())
+
+    @property
+    def angle(self):
+        return float(self.table.angle[self.index])
+
+    @property
+    def angular_velocity(self):
+        return float(self.table.angular_velocity[self.index])
+
+    @property
+    def angular_acceleration(self):
+        return float(self.table.angular_acceleration[self.index])
+
+    def update(self):
+        pass
+
+    def convert_pos(self):
+        pass  # pos_draw は pos_real の setter で求め直している
+
+    def receive_force(self, force, contact_point=None):
+        self.table.receive_force(self.index, force, contact_point)
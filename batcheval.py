@@ -0,0 +1,141 @@
+"""多数のショット候補を全てのCPUコアで並列に評価するモジュール
+
+各ワーカープロセスは、最初に受け取った TableSnapshot (pygame のオブジェクトを含まない盤面) から
+Simulator を作り直してショットを試す。pygame のオブジェクトをプロセス間で受け渡すことはない。
+台の設定は TableSnapshot.table の名前だけを渡し、各ワーカーが最初に1回 tables/ から読み込む。
+
+使い方 (既定の配置で方向と強さを総当たりし、得点の高いショットを表示する):
+    python batcheval.py
+"""
+import collections
+import concurrent.futures
+import math
+import os
+import time
+
+import pygame
+
+import simulator
+import tableconfig
+
+PgVector = pygame.math.Vector2
+
+# direction: 手玉を突く方向 (give_force_by_user の力の向き)
+# magnitude: 力の大きさ (give_force_by_user の 50 + ドラッグ距離/7.5)
+# contact_point: Point_selectmode.give_moment_arm で得られる打撃点
+ShotCandidate = collections.namedtuple("ShotCandidate", ["direction", "magnitude", "contact_point"])
+ShotResult = collections.namedtuple("ShotResult", ["candidate", "pocketed", "pocket_scores", "score",
+                                                   "cue_ball_fell", "final_positions", "ticks"])
+
+
+def candidate_from_drag(start_pos, end_pos, contact_point=(0, 0)):
+    """マウスのドラッグと打撃点から ShotCandidate を作る関数"""
+    force = simulator.force_from_drag(start_pos, end_pos)
+    return ShotCandidate((force.x, force.y), force.magnitude(), tuple(contact_point))
+
+
+def simulate_shot(snapshot, candidate, max_ticks=100000, engine="object"):
+    """1つのショットを、このプロセス内で止まるまでシミュレーションする関数
+
+    engine は Simulator と同じ "object" / "numpy" か、衝突の時刻ごとに進める "event" (eventengine) を指定する。
+    """
+    if engine == "event":
+        import eventengine
+        return eventengine.simulate_shot(snapshot, candidate, max_ticks)
+    sim = simulator.Simulator(snapshot=snapshot, engine=engine)
+    numbers_before = {b.number for b in sim.balls()}
+    scores_before = [p.score for p in sim.pockets]
+
+    force = PgVector(candidate.direction)
+    if force.length() > 0:
+        force.scale_to_length(candidate.magnitude)
+    sim.shoot(force, candidate.contact_point)
+    ticks = sim.run_until_stopped(max_ticks)
+
+    balls = sim.balls()
+    pocketed = tuple(sorted(numbers_before - {b.number for b in balls}))
+    pocket_scores = tuple(p.score - before for p, before in zip(sim.pockets, scores_before))
+    return ShotResult(
+        candidate=candidate,
+        pocketed=pocketed,
+        pocket_scores=pocket_scores,
+        score=sum(pocket_scores),
+        cue_ball_fell=any(p.cue_ball_fell for p in sim.pockets),
+        final_positions=tuple((b.number, b.pos_draw.x, b.pos_draw.y) for b in balls),
+        ticks=ticks,
+    )
+
+
+# ワーカープロセスごとに1回だけ受け取る盤面
+_worker_snapshot = None
+_worker_options = {}
+
+
+def _init_worker(snapshot, options):
+    global _worker_snapshot, _worker_options
+    _worker_snapshot = snapshot
+    _worker_options = options
+    tableconfig.load(snapshot.table)  # 最初のショットの前に台の設定を読んでキャッシュしておく
+
+
+def _evaluate_in_worker(candidate):
+    return simulate_shot(_worker_snapshot, candidate, **_worker_options)
+
+
+def evaluate_shots(snapshot, candidates, max_workers=None, chunksize=None, max_ticks=100000, engine="object",
+                   cache=None):
+    """ショット候補のリストを ProcessPoolExecutor で並列に評価し、同じ順序で ShotResult を返す関数
+
+    盤面はワーカーの起動時に1回だけ渡し、候補は chunksize ごとにまとめて送る。
+    max_workers が 1 の場合は、プロセスを作らずにこのプロセス内で順に評価する。
+    cache (shotcache.ShotCache) を指定すると、キャッシュに無い候補だけを評価して結果を保存する。
+    """
+    candidates = list(candidates)
+    if cache is not None:
+        keys = [cache.key(snapshot, c, max_ticks, engine) for c in candidates]
+        results = [cache.get(key) for key in keys]
+        missing = [k for k, result in enumerate(results) if result is None]
+        computed = evaluate_shots(snapshot, [candidates[k] for k in missing], max_workers, chunksize, max_ticks, engine)
+        for k, result in zip(missing, computed):
+            cache.put(keys[k], result)
+            results[k] = result
+        return [result._replace(candidate=c) for result, c in zip(results, candidates)]
+    options = {"max_ticks": max_ticks, "engine": engine}
+    max_workers = max_workers or os.cpu_count() or 1
+    if max_workers == 1 or len(candidates) <= 1:
+        return [simulate_shot(snapshot, c, **options) for c in candidates]
+    if chunksize is None:
+        chunksize = max(1, len(candidates) // (max_workers * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=_init_worker,
+                                                initargs=(snapshot, options)) as executor:
+        return list(executor.map(_evaluate_in_worker, candidates, chunksize=chunksize))
+
+
+def sweep_candidates(angles=72, magnitudes=(80, 120, 160, 200), contact_points=((0, 0),)):
+    """方向・強さ・打撃点を格子状に並べた候補を作る関数"""
+    candidates = []
+    for k in range(angles):
+        theta = 2 * math.pi * k / angles
+        direction = (math.cos(theta), math.sin(theta))
+        for magnitude in magnitudes:
+            for contact_point in contact_points:
+                candidates.append(ShotCandidate(direction, magnitude, contact_point))
+    return candidates
+
+
+def main():
+    snapshot = simulator.Simulator().snapshot()
+    candidates = sweep_candidates()
+    start = time.perf_counter()
+    results = evaluate_shots(snapshot, candidates)
+    elapsed = time.perf_counter() - start
+    print(f"{len(candidates)} shots in {elapsed:.2f} s ({len(candidates) / elapsed:.0f} shots/s, {os.cpu_count()} cores)")
+    best = sorted(results, key=lambda r: (r.cue_ball_fell, -r.score))[:5]
+    for r in best:
+        angle = math.degrees(math.atan2(r.candidate.direction[1], r.candidate.direction[0]))
+        print(f"angle {angle:6.1f} magnitude {r.candidate.magnitude:5.1f} -> score {r.score} "
+              f"pocketed {list(r.pocketed)} cue fell {r.cue_ball_fell}")
+
+
+if __name__ == "__main__":
+    main()
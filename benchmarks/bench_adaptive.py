@@ -0,0 +1,102 @@
+"""固定の dt と AdaptiveTimestep で、ショットが止まるまでの tick 数と時間を比べるベンチマーク
+
+使い方 (リポジトリの直下で実行する):
+    python benchmarks/bench_adaptive.py
+    python benchmarks/bench_adaptive.py --angles 72 --scenario endgame
+    python benchmarks/bench_adaptive.py --scenario break --rounds 7
+
+scenario
+    break     AppMain と同じ配置 (11球) で、いろいろな向きと強さのショット
+    endgame   台に散らばった4球で、弱めのショット (ゆっくり転がる時間が長い)
+全ての球が止まる (asleep になる) かゲームが終わるまで進め、tick 数・時間・シミュレーション上の時間と、
+固定の dt の場合との最終的な位置の差 (落ちた球が同じショットについて、最も大きくずれた球の距離) を表示する。
+時間は、全てのショットを rounds 回繰り返したうちで最も短い回のもの (他の処理による揺らぎを除くため)。
+
+位置の差について: 球の多い break では、dt が変わると衝突の順序や接する時刻がわずかに変わり、その後の玉突きで
+大きく広がることがある。angles 36 の break では、中央値は数 px だが、最大で 160px ほどずれたショットがある
+(落ちる球まで変わったショットは「same balls pocketed」から除いている)。adaptive は、同じ結果を再現する
+必要がある用途 (determinism・記録の再生) ではなく、ゆっくり転がる時間の長い盤面を速く進めるためのもの。
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import simulator
+
+PgVector = pygame.math.Vector2
+
+ENDGAME_POSITIONS = [(0.9, 0.9), (1.6, 0.6), (2.2, 1.1), (1.5, 1.2)]
+
+
+def scenario_snapshot(name):
+    snapshot = simulator.Simulator().snapshot()
+    if name == "endgame":
+        balls = tuple(b._replace(pos=pos) for b, pos in zip(snapshot.balls, ENDGAME_POSITIONS))
+        return snapshot._replace(balls=balls), (55, 70, 90)
+    return snapshot, (60, 100, 150)
+
+
+def run_shot(snapshot, force, adaptive, max_ticks):
+    """1つのショットを止まるまで進め、(tick 数, 時間, シミュレーション上の時間, 最後の位置) を返す関数"""
+    sim = simulator.Simulator(snapshot=snapshot, adaptive=adaptive)
+    sim.shoot(force, (0.01, 0))
+    start = time.perf_counter()
+    ticks = 0
+    while ticks < max_ticks:
+        sim.step()
+        ticks += 1
+        if sim.game_rule.game_over or all(b.asleep for b in sim.live_balls):
+            break
+    elapsed = time.perf_counter() - start
+    return ticks, elapsed, sim.simulated_time, {b.number: PgVector(b.pos_draw) for b in sim.live_balls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=["break", "endgame"], default="endgame")
+    parser.add_argument("--angles", type=int, default=36)
+    parser.add_argument("--max-ticks", type=int, default=40000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    snapshot, magnitudes = scenario_snapshot(args.scenario)
+    forces = [PgVector(1, 0).rotate(360 * k / args.angles) * magnitude
+              for k in range(args.angles) for magnitude in magnitudes]
+    totals = {}
+    finals = {}
+    for adaptive in (False, True):
+        best = None
+        for _ in range(args.rounds):
+            # どの回も同じ結果になるので、tick 数と位置は最後の回のものを使う
+            ticks = elapsed = simulated = 0
+            finals[adaptive] = []
+            for force in forces:
+                t, e, s, positions = run_shot(snapshot, force, adaptive, args.max_ticks)
+                ticks, elapsed, simulated = ticks + t, elapsed + e, simulated + s
+                finals[adaptive].append(positions)
+            if best is None or elapsed < best:
+                best = elapsed
+        totals[adaptive] = (ticks, best, simulated)
+
+    print(f"{'dt':>9} {'ticks':>8} {'time s':>8} {'us/tick':>8} {'sim time s':>11}")
+    for adaptive, label in ((False, "fixed"), (True, "adaptive")):
+        ticks, elapsed, simulated = totals[adaptive]
+        print(f"{label:>9} {ticks:>8} {elapsed:>8.3f} {elapsed / ticks * 1e6:>8.1f} {simulated:>11.2f}")
+    errors = sorted(max((fixed[n] - adaptive[n]).length() for n in fixed)
+                    for fixed, adaptive in zip(finals[False], finals[True]) if set(fixed) == set(adaptive) and fixed)
+    shots = len(finals[False])
+    print(f"same balls pocketed: {len(errors)}/{shots}")
+    if errors:
+        print(f"final position difference (px): median {errors[len(errors) // 2]:.2f}, "
+              f"p90 {errors[int(len(errors) * 0.9)]:.2f}, max {errors[-1]:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""1tickごとのメモリ確保が増え続けないことを tracemalloc で確かめるチェック
+
+使い方 (リポジトリの直下で実行する。確保が増え続けている場合は終了コード 1 を返す):
+    python benchmarks/bench_allocations.py
+    python benchmarks/bench_allocations.py --ticks 2000 --max-growth 8
+
+ブレイクショットを打ち、球が動いている間の各tickについて
+  - tick の前後での確保済みメモリの増加 (増え続けるとGCの負担になる)
+  - tick の途中で一時的に確保されたメモリの最大量
+を計測する。Simulator.run_until_stopped と同じく、全ての球が止まるかゲームが終わったら計測をやめる
+(止まった後の tick は何もしないので、平均や中央値を薄めてしまう)。
+球が止まったりポケットに落ちたりした tick には、その球の状態を保持する分だけ1回限り増えるので、
+増加の合計では判定しない。増加が --max-growth を超えた tick が --max-growing の割合より多い
+(ほとんどの tick で増え続けている) 場合を失敗とする。
+計測できた tick が --min-ticks より少ない場合も、確かめられなかったものとして失敗とする。
+"""
+import argparse
+import array
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import simulator
+
+
+def measure(ticks, warmup):
+    sim = simulator.Simulator()
+    sim.shoot(simulator.force_from_drag((300, 300), (0, 302)), (0.01, 0))
+    for _ in range(warmup):
+        sim.step()
+
+    """球が動いている間の最大 ticks 回の tick を計測する関数
+
+    (計測した tick 数, 全体の増加, 各 tick の増加のリスト, 一時的な確保の中央値, 最大値) を返す。
+    """
+    # 計測のためのリストが伸びないように先に確保しておく
+    transient = array.array("q", bytes(8 * ticks))
+    growth = array.array("q", bytes(8 * ticks))
+    game_rule = sim.game_rule
+    measured = 0
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    while measured < ticks and not (game_rule.game_over or sim.are_balls_stopped()):
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        sim.step()
+        after, peak = tracemalloc.get_traced_memory()
+        transient[measured] = peak - before
+        growth[measured] = after - before
+        measured += 1
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if measured == 0:
+        return 0, 0, [], 0, 0
+    transient = sorted(transient[:measured])
+    return measured, end - start, growth[:measured].tolist(), transient[measured // 2], transient[-1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--max-growth", type=float, default=4.0, help="1tickあたりの増加の許容量 (バイト)")
+    parser.add_argument("--max-growing", type=float, default=0.2,
+                        help="増加が --max-growth を超えてよい tick の割合")
+    parser.add_argument("--min-ticks", type=int, default=50, help="球が動いている tick をこれだけ計測できなければ失敗にする")
+    args = parser.parse_args()
+
+    measured, total, growth, transient_median, transient_max = measure(args.ticks, args.warmup)
+    print(f"moving ticks measured: {measured}")
+    if measured < args.min_ticks:
+        print(f"FAIL: only {measured} ticks with moving balls (need {args.min_ticks})")
+        return 1
+    growing = sum(1 for g in growth if g > args.max_growth)
+    print(f"net growth: {total} bytes in total, {total / measured:.2f} bytes per tick, "
+          f"{growing}/{measured} ticks grew by more than {args.max_growth:g} bytes")
+    print(f"transient per tick: median {transient_median} bytes, max {transient_max} bytes")
+    if growing > args.max_growing * measured:
+        print(f"FAIL: allocations grow on more than {args.max_growing:.0%} of the ticks")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""ブロードフェーズ (SpatialHashGrid) の有無で CollisionResolver の速度を比べるベンチマーク
+
+使い方 (リポジトリの直下で実行する):
+    python benchmarks/bench_broadphase.py
+    python benchmarks/bench_broadphase.py --counts 10 100 1000 2000 --ticks 50
+
+球を格子状に並べて乱数で初速を与え、球の更新と CollisionResolver の更新を繰り返す。
+総当たりは球が多いと時間がかかりすぎるので、--max-pairwise 個までの場合だけ計測し、
+その場合は最終的な位置がブロードフェーズありの場合と完全に一致することも確認する。
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygame
+
+import billiard
+import broadphase
+
+
+def build_balls(world, count, seed):
+    """count 個の球を間隔 40px の格子状に並べ、乱数で初速を与える"""
+    rng = random.Random(seed)
+    columns = max(1, int(math.ceil(math.sqrt(count))))
+    balls = []
+    for n in range(count):
+        pos = (40 + 40 * (n % columns), 40 + 40 * (n // columns))
+        ball = billiard.Numbermass(n, pygame.Color("white"), 0.028, pos, world)
+        ball.vel_real = pygame.math.Vector2(rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5))
+        balls.append(ball)
+    return balls
+
+
+def run(count, ticks, use_broadphase, seed=0):
+    world = billiard.World((1200, 600), 0.005, 0.2, (9.81, 9.81))
+    actor_list = build_balls(world, count, seed)
+    grid = broadphase.SpatialHashGrid() if use_broadphase else None
+    resolver = billiard.CollisionResolver(world, actor_list, broadphase=grid)
+    actor_list.append(resolver)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for a in actor_list:
+            a.update()
+    elapsed = time.perf_counter() - start
+    positions = [(b.pos_real.x, b.pos_real.y) for b in actor_list if billiard.is_number_mass(b)]
+    return elapsed / ticks, positions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10, 50, 100, 250, 500, 1000, 2000])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--max-pairwise", type=int, default=500)
+    args = parser.parse_args()
+
+    pygame.font.init()
+    print(f"{'balls':>6} {'grid ms/tick':>13} {'us/ball':>8} {'pairwise ms/tick':>17} {'speedup':>8}")
+    for count in args.counts:
+        grid_time, grid_positions = run(count, args.ticks, True)
+        line = f"{count:>6} {grid_time * 1e3:>13.3f} {grid_time / count * 1e6:>8.2f}"
+        if count <= args.max_pairwise:
+            pair_time, pair_positions = run(count, args.ticks, False)
+            if pair_positions != grid_positions:
+                print(f"mismatch between pairwise and grid results for {count} balls")
+                return 1
+            line += f" {pair_time * 1e3:>17.3f} {pair_time / grid_time:>7.1f}x"
+        else:
+            line += f" {'-':>17} {'-':>8}"
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""AppMain を作ってから最初のフレームを描くまでの時間を、新しいプロセスで計測するベンチマーク
+
+使い方 (リポジトリの直下で実行する。画面は使わない):
+    python benchmarks/bench_startup.py
+    python benchmarks/bench_startup.py --runs 10
+
+次の3通りをそれぞれ --runs 回、新しいプロセスで起動して中央値を表示する。
+    default       画像を読み込んで背景を作る (atlas_path なし)
+    atlas cold    アトラスを作って保存する (1回目の起動)
+    atlas warm    保存したアトラスを読み込む (2回目以降の起動)
+process はプロセスの起動から終了まで、import は billiard_main の import、
+init は AppMain の作成、first frame は最初の draw までの時間。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+import billiard_main
+imported = time.perf_counter()
+app = billiard_main.AppMain(atlas_path=sys.argv[1] or None)
+created = time.perf_counter()
+app.draw((0, 0))
+drawn = time.perf_counter()
+print(json.dumps({"import": imported - start, "init": created - imported, "first_frame": drawn - created,
+                  "total": drawn - start}))
+"""
+
+
+def run_child(atlas_path):
+    env = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", CHILD, atlas_path or ""], cwd=REPO_DIR, env=env,
+                            check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        atlas_path = os.path.join(directory, "atlas.bin")
+        results = {"default": [], "atlas cold": [], "atlas warm": []}
+        for _ in range(args.runs):
+            results["default"].append(run_child(None))
+            if os.path.exists(atlas_path):
+                os.remove(atlas_path)
+            results["atlas cold"].append(run_child(atlas_path))
+            results["atlas warm"].append(run_child(atlas_path))
+        atlas_size = os.path.getsize(atlas_path)
+
+    columns = ("process", "import", "init", "first_frame", "total")
+    print(f"{'':>11} " + " ".join(f"{c + ' ms':>14}" for c in columns))
+    for name, runs in results.items():
+        print(f"{name:>11} " + " ".join(f"{statistics.median(r[c] for r in runs) * 1e3:>14.1f}" for c in columns))
+    print(f"atlas: {atlas_size / 1024:.0f} KiB")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""telemetry のイベントを書き出しながらショットを進め、tick の時間が増えないことと、捨てたイベントの数を調べるベンチマーク
+
+使い方 (リポジトリの直下で実行する):
+    python benchmarks/bench_telemetry.py
+    python benchmarks/bench_telemetry.py --angles 36 --capacity 128 --stall 0.5
+
+AppMain と同じ配置で、いろいろな向きの強いショットを止まるまで (ゲームが終わるまで) 進め、次の3つを比べる。
+    off     World.telemetry が None (従来どおり)
+    file    RotatingFileSink に書き出す (max_bytes を小さくして、ファイルを回す処理も含める)
+    stall   書き込みのたびに stall 秒止まる遅い書き出し先と、小さいリングバッファ (capacity)。
+            書き出しが追いつかないので、イベントが捨てられて dropped に数えられる
+それぞれの1tickの平均と最大の時間、イベントの数 (accepted・dropped・written) を表示する。
+最後の盤面が off と違う場合か、stall で1tickの最大の時間が stall 秒を超えた (tick が書き出しを待った) 場合は
+終了コード1を返す。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import simulator
+import telemetry
+
+PgVector = pygame.math.Vector2
+
+
+class StallingSink:
+    """書き込むたびに stall 秒止まり、書いたバイト数だけを数える書き出し先"""
+    def __init__(self, stall):
+        self.stall = stall
+        self.bytes = 0
+
+    def write(self, data):
+        time.sleep(self.stall)
+        self.bytes += len(data)
+
+    def close(self):
+        pass
+
+
+def run_shots(forces, make_telemetry, max_ticks):
+    """forces のショットを順に進め、(tick の時間のリスト, 最後の盤面のリスト, stats) を返す関数"""
+    tick_times = []
+    states = []
+    recorder = make_telemetry()
+    for force in forces:
+        sim = simulator.Simulator()
+        if recorder is not None:
+            recorder.attach(sim)
+        sim.shoot(force, (0.01, 0))
+        for _ in range(max_ticks):
+            start = time.perf_counter()
+            sim.step()
+            tick_times.append(time.perf_counter() - start)
+            if sim.game_rule.game_over or sim.are_balls_stopped():
+                break
+        states.append(sim.snapshot())
+    if recorder is None:
+        return tick_times, states, None
+    recorder.close()
+    return tick_times, states, recorder.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--angles", type=int, default=24)
+    parser.add_argument("--power", type=float, default=400)
+    parser.add_argument("--capacity", type=int, default=64)
+    parser.add_argument("--stall", type=float, default=0.2)
+    parser.add_argument("--max-ticks", type=int, default=20000)
+    args = parser.parse_args()
+
+    forces = [PgVector(args.power, 0).rotate(360 * k / args.angles) for k in range(args.angles)]
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "telemetry.ndjson")
+    modes = {
+        "off": lambda: None,
+        "file": lambda: telemetry.Telemetry(telemetry.RotatingFileSink(path, max_bytes=16 * 1024)),
+        "stall": lambda: telemetry.Telemetry(StallingSink(args.stall), capacity=args.capacity),
+    }
+    print(f"{args.angles} shots, power {args.power:g}")
+    print(f"{'mode':>6} {'ticks':>7} {'mean us':>8} {'max ms':>7} {'accepted':>9} {'dropped':>8} {'written':>8}")
+    failed = False
+    baseline = None
+    for name, make_telemetry in modes.items():
+        tick_times, states, stats = run_shots(forces, make_telemetry, args.max_ticks)
+        if baseline is None:
+            baseline = states
+        elif states != baseline:
+            print(f"{name}: final states differ from telemetry off")
+            failed = True
+        stats = stats or {"accepted": 0, "dropped": 0, "written": 0}
+        print(f"{name:>6} {len(tick_times):>7} {sum(tick_times) / len(tick_times) * 1e6:>8.1f} "
+              f"{max(tick_times) * 1e3:>7.2f} {stats['accepted']:>9} {stats['dropped']:>8} {stats['written']:>8}")
+        if name == "stall" and max(tick_times) >= args.stall:
+            print("stall: a tick waited for the sink")
+            failed = True
+    files = sorted(os.listdir(directory))
+    print(f"file sink: {', '.join(files)} ({sum(os.path.getsize(os.path.join(directory, f)) for f in files)} bytes)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""ショットの強さと dt を大きくしていき、球が壁やポケットの口をすり抜ける (tunneling) かを調べるベンチマーク
+
+使い方 (リポジトリの直下で実行する):
+    python benchmarks/bench_tunneling.py
+    python benchmarks/bench_tunneling.py --powers 100 400 1600 --scales 1 4 8
+
+手玉だけを台に置き、各ポケットの中心の向きから少しずつずらした向きに、いろいろな強さで突く。
+dt を base_dt の scale 倍にして、World.ccd が False (従来の判定) と True (ContactPhase.update_swept) の
+それぞれで time 秒まで (落ちるまで) 進め、次を数える。
+    penetration  tick の終わりに、球が壁にめり込んでいた深さの最大 (ピクセル)
+    missed       壁に当たる前にまっすぐポケットの円に入る向きで、dt を base_dt の 1/8 倍にした細かい計算
+                 (World.ccd は True。1/32 倍にしてもほとんど変わらない) でも
+                 そのポケットに落ちるのに、落ちなかった (口を飛び越えた) ショット
+    differs      細かい計算と落ちたポケットが違うショット (めり込んだ位置で落ちる球や、跳ね返りの位置のずれも含む)
+World.ccd が True で、めり込み (1e-6 ピクセルより深いもの) か missed が1つでもあれば終了コード1を返す。
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import billiard
+import simulator
+
+PgVector = pygame.math.Vector2
+
+START_POSITIONS = [(300, 300), (600, 250), (900, 400)]
+OFFSETS = (-6, -3, 0, 3, 6)  # ポケットの中心の向きからずらす角度 (度)
+REFERENCE_SCALE = 1 / 8
+
+
+def straight_in(sim, start, direction):
+    """start から direction にまっすぐ進む球の中心が、壁に接する前に入るポケットの番号を返す関数 (無ければ None)"""
+    contact_phase = next(actor for actor in sim.actor_list if isinstance(actor, billiard.ContactPhase))
+    reach = 2000.0
+    for boundary in contact_phase.boundaries:
+        normal, point = boundary.normal, boundary.point_included
+        closing = normal.dot(direction)
+        if closing > 0:
+            reach = min(reach, -(normal.dot(PgVector(start) - point) + 14) / closing)
+    end = PgVector(start) + direction * reach
+    pocket = contact_phase.first_pocket_on_segment(start[0], start[1], end.x, end.y)
+    return None if pocket is None else contact_phase.pockets.index(pocket)
+
+
+def cue_only_snapshot():
+    snapshot = simulator.Simulator().snapshot()
+    return snapshot._replace(balls=snapshot.balls[:1])
+
+
+def penetration(sim):
+    """球が壁にめり込んでいる深さの最大 (ピクセル) を返す関数"""
+    deepest = 0.0
+    contact_phase = next(actor for actor in sim.actor_list if isinstance(actor, billiard.ContactPhase))
+    for p in sim.live_balls:
+        for boundary in contact_phase.boundaries:
+            normal, point = boundary.normal, boundary.point_included
+            deepest = max(deepest, normal.dot(p.pos_draw - point) + p.radius_for_draw)
+    return deepest
+
+
+def run_shot(snapshot, start, force, scale, ccd, duration):
+    """1回のショットを進め、(落ちたポケットの番号 (落ちなければ None), めり込みの最大) を返す関数"""
+    balls = (snapshot.balls[0]._replace(pos=(start[0] / 350, start[1] / 350)),)
+    sim = simulator.Simulator(snapshot=snapshot._replace(balls=balls), ccd=ccd)
+    sim.world.dt = sim.world.base_dt * scale
+    sim.shoot(force, (0.0, 0.0))
+    deepest = 0.0
+    while sim.simulated_time < duration:
+        sim.step()
+        if not sim.live_balls:
+            break
+        deepest = max(deepest, penetration(sim))
+    pocketed = [n for n, pocket in enumerate(sim.pockets) if pocket.cue_ball_fell]
+    return (pocketed[0] if pocketed else None), deepest
+
+
+def shots(snapshot, powers):
+    for start in START_POSITIONS:
+        for pocket in snapshot.pockets:
+            direction = (PgVector(pocket.centerpos) - PgVector(start)).normalize()
+            for offset in OFFSETS:
+                for power in powers:
+                    yield start, direction.rotate(offset) * power
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--powers", type=float, nargs="+", default=[100, 200, 400, 800, 1600])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--time", type=float, default=0.5)
+    args = parser.parse_args()
+
+    snapshot = cue_only_snapshot()
+    cases = list(shots(snapshot, args.powers))
+    table = simulator.Simulator(snapshot=snapshot)
+    aimed = [straight_in(table, start, force.normalize()) for start, force in cases]
+    references = [run_shot(snapshot, start, force, REFERENCE_SCALE, True, args.time)[0] for start, force in cases]
+    straight = sum(a is not None and a == r for a, r in zip(aimed, references))
+    print(f"{len(cases)} shots, {sum(r is not None for r in references)} pocketed with dt x {REFERENCE_SCALE:g} "
+          f"({straight} straight in)")
+    print(f"{'dt scale':>8} {'ccd':>5} {'penetration px':>15} {'missed':>7} {'differs':>8}")
+    failed = False
+    for scale in args.scales:
+        for ccd in (False, True):
+            deepest = 0.0
+            missed = differs = 0
+            for (start, force), target, reference in zip(cases, aimed, references):
+                pocket, depth = run_shot(snapshot, start, force, scale, ccd, args.time)
+                deepest = max(deepest, depth)
+                if target is not None and reference == target and pocket != target:
+                    missed += 1
+                if pocket != reference:
+                    differs += 1
+            print(f"{scale:>8g} {str(ccd):>5} {deepest:>15.2f} {missed:>7} {differs:>8}")
+            if ccd and (deepest > 1e-6 or missed):
+                failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,408 @@
+"""シミュレーションの中心部分の速度を計測し、履歴と比べて遅くなっていないかを確かめるベンチマーク
+
+使い方 (リポジトリの直下で実行する。画面は使わない):
+    python benchmarks/suite.py run                       # 全て計測して履歴に追加する
+    python benchmarks/suite.py run --only break_shot scaling_100 --compare
+    python benchmarks/suite.py compare --threshold 0.1   # 履歴の最後の2回を比べる
+    python benchmarks/suite.py list
+
+計測するもの (それぞれ「1tick」で呼ぶ処理の時間だけを測り、準備の処理は測らない)
+    numbermass_update          100個の動いている球の Numbermass.update
+    collision_resolver         ブレイクショット中の CollisionResolver.generate_force_points
+    boundary_generate_force    ブレイクショット中の4つの Boundary.generate_force (以前の形の actor_list)
+    pocket_update              ブレイクショット中の6つの Pocket.update (以前の形の actor_list)
+    contact_phase              ブレイクショット中の ContactPhase.update
+    break_shot                 AppMain と同じ配置でのブレイクショット (Simulator.step)
+    scaling_10/100/1000        格子状に並べて乱数で初速を与えた球の Simulator.step (ブロードフェーズあり)
+
+結果は1回の実行ごとに1行の JSON として履歴のファイル (既定は benchmarks/history.jsonl) に追加する。
+各計測は rounds 回準備からやり直して測り、値は ticks_per_sec (最も速かった回の1秒あたりの tick 数)・
+p50_ms (1tickの時間の中央値)・p99_ms (回ごとの p99 の中央値)・noise / p99_noise (回ごとの ticks_per_sec と p99 の
+ばらつき。最大 / 最小 - 1)・alloc_bytes_per_tick (tick の途中で一時的に確保したメモリの中央値)・
+growth_bytes_per_tick (確保済みメモリの増加)。
+compare は ticks_per_sec の低下・p99_ms の増加・alloc_bytes_per_tick の増加が許容の割合を超えたものを表示し、
+1つでもあれば終了コード 1 を返す。時間の許容は threshold と、比べる2回のばらつき (noise) の大きい方にする
+(同じコードでも回ごとに変わる分は遅くなったとみなさない)。rounds が MIN_NOISE_ROUNDS より少ないと
+ばらつきが分からないので、compare は注意を表示する。
+"""
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import billiard
+import simulator
+
+DEFAULT_HISTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.jsonl")
+ALLOC_NOISE_BYTES = 64  # これより小さい確保量の増加は、割合が大きくても遅くなったとはみなさない
+MIN_NOISE_ROUNDS = 3  # ばらつき (noise) を求めるのに必要な回数
+
+# 名前 -> (準備の関数, tick 数)。準備の関数は (prepare, run) を返す。
+# 1tickごとに prepare() (計測しない) と run() (計測する) をこの順に呼ぶ。
+BENCHMARKS = {}
+
+
+def benchmark(name, ticks):
+    def register(setup):
+        BENCHMARKS[name] = (setup, ticks)
+        return setup
+    return register
+
+
+def nothing():
+    pass
+
+
+def break_shot_simulator():
+    """AppMain と同じ配置でブレイクショットを打った直後の Simulator を作る関数"""
+    sim = simulator.Simulator()
+    sim.shoot(simulator.force_from_drag((300, 300), (0, 302)), (0.01, 0))
+    return sim
+
+
+def legacy_actors():
+    """ContactPhase を使わない以前の形の actor_list (球・CollisionResolver・Boundary・Pocket) を作る関数
+
+    ブレイクショットを打った直後の球を使い、Simulator.step とは別にこの actor_list だけを更新する
+    (ContactPhase と Boundary の両方で壁の力を加えることはない)。CollisionResolver は actor_list を走査するので、
+    Pocket が actor_list から取り除いた球は次の tick から調べない。
+    """
+    sim = break_shot_simulator()
+    actor_list = sim.balls()
+    factory = simulator.ActorFactory(sim.world, actor_list)
+    boundaries = factory.create_boundaries()
+    pockets = factory.create_pockets()
+    actor_list.append(factory.create_collision_resolver())
+    actor_list.extend(boundaries)
+    actor_list.extend(pockets)
+    return actor_list, boundaries, pockets
+
+
+def scaling_snapshot(count, seed=0):
+    """count 個の球を間隔 40px の格子状に並べ、乱数で初速を与えた盤面を作る関数
+
+    台の大きさは球が全て壁の内側に収まるように決め、ポケットは置かない。
+    """
+    rng = random.Random(seed)
+    columns = max(1, int(math.ceil(math.sqrt(2 * count))))
+    rows = int(math.ceil(count / columns))
+    size = (150 + 150 + 40 * (columns + 1), 75 + 80 + 40 * (rows + 1))
+    template = billiard.Numbermass(0, pygame.Color("white"), 0.028, (0, 0), simulator.create_world(size))
+    balls = []
+    for n in range(count):
+        pos_draw = (150 + 40 * (n % columns + 1), 75 + 40 * (n // columns + 1))
+        balls.append(simulator.BallState(
+            n, (255, 255, 255, 255), template.radius, template.mass, template.restitution,
+            (pos_draw[0] / 350, pos_draw[1] / 350), (rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5)),
+            0.0, 0.0, (0.0, 0.0), 0.0))
+    world = template.world
+    return simulator.TableSnapshot(size, world.dt, world.friction, (world.grav_acc.x, world.grav_acc.y), tuple(balls), ())
+
+
+@benchmark("numbermass_update", ticks=300)
+def numbermass_update():
+    sim = simulator.Simulator(snapshot=scaling_snapshot(100))
+    balls = sim.balls()
+
+    def run():
+        for b in balls:
+            b.update()
+    return nothing, run
+
+
+@benchmark("collision_resolver", ticks=120)
+def collision_resolver():
+    sim = break_shot_simulator()
+    resolver = next(a for a in sim.actor_list if isinstance(a, billiard.CollisionResolver))
+    contact_phase = next(a for a in sim.actor_list if isinstance(a, billiard.ContactPhase))
+
+    def prepare():
+        contact_phase.update()
+        sim.live_balls.compact(sim.actor_list)
+        for b in sim.live_balls:
+            b.update()
+    return prepare, resolver.generate_force_points
+
+
+@benchmark("boundary_generate_force", ticks=120)
+def boundary_generate_force():
+    actor_list, boundaries, pockets = legacy_actors()
+
+    def prepare():
+        # 前の tick のポケットから、球・CollisionResolver までを actor_list の順に更新する
+        for pocket in pockets:
+            pocket.update()
+        for a in list(actor_list):
+            if not isinstance(a, (billiard.Boundary, billiard.Pocket)):
+                a.update()
+
+    def run():
+        for boundary in boundaries:
+            boundary.generate_force()
+    return prepare, run
+
+
+@benchmark("pocket_update", ticks=120)
+def pocket_update():
+    actor_list, _, pockets = legacy_actors()
+
+    def prepare():
+        for a in list(actor_list):
+            if not isinstance(a, billiard.Pocket):
+                a.update()
+
+    def run():
+        for pocket in pockets:
+            pocket.update()
+    return prepare, run
+
+
+@benchmark("contact_phase", ticks=120)
+def contact_phase():
+    sim = break_shot_simulator()
+    phase = next(a for a in sim.actor_list if isinstance(a, billiard.ContactPhase))
+    others = [a for a in sim.actor_list if a is not phase]
+
+    def prepare():
+        sim.live_balls.compact(sim.actor_list)
+        for a in others:
+            if a in sim.live_balls or not billiard.is_number_mass(a):
+                a.update()
+    return prepare, phase.update
+
+
+@benchmark("break_shot", ticks=130)
+def break_shot():
+    return nothing, break_shot_simulator().step
+
+
+def scaling(count):
+    def setup():
+        sim = simulator.Simulator(snapshot=scaling_snapshot(count), broadphase=True)
+        return nothing, sim.step
+    return setup
+
+
+benchmark("scaling_10", ticks=300)(scaling(10))
+benchmark("scaling_100", ticks=100)(scaling(100))
+benchmark("scaling_1000", ticks=20)(scaling(1000))
+
+
+def time_ticks(setup, ticks, rounds):
+    """rounds 回準備からやり直し、回ごとに1tickごとの時間 (秒) のリストを返す関数"""
+    rounds_durations = []
+    clock = time.perf_counter
+    for _ in range(rounds):
+        prepare, run = setup()
+        durations = []
+        for _ in range(ticks):
+            prepare()
+            start = clock()
+            run()
+            durations.append(clock() - start)
+        rounds_durations.append(durations)
+    return rounds_durations
+
+
+def measure_allocations(setup, ticks):
+    """1tickの途中で一時的に確保したメモリの中央値と、確保済みメモリの1tickあたりの増加を返す関数"""
+    prepare, run = setup()
+    transient = [0] * ticks  # 計測のためのリストが伸びないように先に確保しておく
+    growth = 0
+    tracemalloc.start()
+    try:
+        for k in range(ticks):
+            prepare()
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            run()
+            after, peak = tracemalloc.get_traced_memory()
+            transient[k] = peak - before
+            growth += after - before
+    finally:
+        tracemalloc.stop()
+    transient.sort()
+    return transient[len(transient) // 2], growth / ticks
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1)
+    return sorted_values[max(index, 0)]
+
+
+def spread(values):
+    """回ごとの値のばらつき (最大 / 最小 - 1) を返す関数"""
+    return max(values) / min(values) - 1 if min(values) > 0 else 0.0
+
+
+def run_benchmark(name, rounds, alloc_ticks):
+    setup, ticks = BENCHMARKS[name]
+    rounds_durations = time_ticks(setup, ticks, rounds)
+    durations = sorted(d for round_durations in rounds_durations for d in round_durations)
+    # 平均ではなく最も速かった回を使う (他のプロセスに邪魔された回の影響を受けにくい)
+    rounds_ticks_per_sec = [len(d) / sum(d) for d in rounds_durations]
+    rounds_p99 = sorted(percentile(sorted(d), 0.99) * 1e3 for d in rounds_durations)
+    alloc_bytes, growth_bytes = measure_allocations(setup, min(ticks, alloc_ticks))
+    return {
+        "ticks": len(durations),
+        "ticks_per_sec": max(rounds_ticks_per_sec),
+        "p50_ms": percentile(durations, 0.50) * 1e3,
+        "p99_ms": rounds_p99[len(rounds_p99) // 2],
+        "noise": spread(rounds_ticks_per_sec),
+        "p99_noise": spread(rounds_p99),
+        "alloc_bytes_per_tick": alloc_bytes,
+        "growth_bytes_per_tick": growth_bytes,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_history(path, entry):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry, sort_keys=True) + "\n")
+
+
+def tolerance(threshold, before, now, key):
+    """threshold と、2回の結果のばらつき (key は "noise" か "p99_noise") の大きい方を返す関数"""
+    return max(threshold, before.get(key, 0.0), now.get(key, 0.0))
+
+
+def compare(baseline, current, threshold):
+    """2回分の結果を比べ、許容 (tolerance) を超えて遅くなった項目の説明のリストを返す関数"""
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            continue
+        allowed = tolerance(threshold, before, now, "noise")
+        if now["ticks_per_sec"] * (1 + allowed) < before["ticks_per_sec"]:
+            regressions.append(f"{name}: ticks/s {before['ticks_per_sec']:.0f} -> {now['ticks_per_sec']:.0f} "
+                               f"(allowed {allowed:.0%})")
+        allowed = tolerance(threshold, before, now, "p99_noise")
+        if now["p99_ms"] > before["p99_ms"] * (1 + allowed):
+            regressions.append(f"{name}: p99 {before['p99_ms']:.3f} ms -> {now['p99_ms']:.3f} ms (allowed {allowed:.0%})")
+        alloc_before, alloc_now = before["alloc_bytes_per_tick"], now["alloc_bytes_per_tick"]
+        if alloc_now > alloc_before * (1 + threshold) and alloc_now - alloc_before > ALLOC_NOISE_BYTES:
+            regressions.append(f"{name}: allocations {alloc_before:.0f} -> {alloc_now:.0f} bytes/tick")
+    return regressions
+
+
+def print_comparison(baseline, current, threshold):
+    print(f"baseline {baseline.get('commit')} ({baseline['timestamp']}) -> current {current.get('commit')} ({current['timestamp']})")
+    if min(baseline.get("rounds", 1), current.get("rounds", 1)) < MIN_NOISE_ROUNDS:
+        print(f"note: fewer than {MIN_NOISE_ROUNDS} rounds, run-to-run noise is unknown and only the threshold is used")
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"  {name:<24} (new)")
+            continue
+        ratio = now["ticks_per_sec"] / before["ticks_per_sec"]
+        print(f"  {name:<24} ticks/s x{ratio:5.2f} (noise {max(before.get('noise', 0.0), now.get('noise', 0.0)):4.0%})  "
+              f"p99 {before['p99_ms']:8.3f} -> {now['p99_ms']:8.3f} ms")
+    regressions = compare(baseline, current, threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    if not regressions:
+        print(f"OK (threshold {threshold:.0%} or the measured noise)")
+    return 1 if regressions else 0
+
+
+def command_run(args):
+    names = args.only or list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"unknown benchmarks: {', '.join(unknown)}")
+        return 2
+    results = {}
+    print(f"{'name':<24} {'ticks/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'alloc B/tick':>13} {'growth B/tick':>14}")
+    for name in names:
+        r = run_benchmark(name, args.rounds, args.alloc_ticks)
+        results[name] = r
+        print(f"{name:<24} {r['ticks_per_sec']:10.0f} {r['p50_ms']:9.3f} {r['p99_ms']:9.3f} "
+              f"{r['alloc_bytes_per_tick']:13.0f} {r['growth_bytes_per_tick']:14.1f}")
+    entry = {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "rounds": args.rounds,
+        "results": results,
+    }
+    previous = load_history(args.history)
+    if not args.no_save:
+        append_history(args.history, entry)
+        print(f"appended to {args.history}")
+    if args.compare and previous:
+        return print_comparison(previous[-1], entry, args.threshold)
+    return 0
+
+
+def command_compare(args):
+    history = load_history(args.history)
+    if len(history) < 2:
+        print(f"need at least 2 runs in {args.history}")
+        return 2
+    return print_comparison(history[args.baseline], history[args.current], args.threshold)
+
+
+def command_list(args):
+    for name, (_, ticks) in BENCHMARKS.items():
+        print(f"{name:<24} {ticks} ticks")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", default=DEFAULT_HISTORY, help="履歴のファイル (JSON Lines)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="計測して履歴に追加する")
+    run_parser.add_argument("--only", nargs="+", help="計測する項目の名前")
+    run_parser.add_argument("--rounds", type=int, default=5, help="準備からやり直す回数 (ばらつきを求めるには3回以上)")
+    run_parser.add_argument("--alloc-ticks", type=int, default=50, help="メモリ確保を計測する tick 数")
+    run_parser.add_argument("--no-save", action="store_true", help="履歴に追加しない")
+    run_parser.add_argument("--compare", action="store_true", help="履歴の最後の結果と比べる")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+    run_parser.set_defaults(handler=command_run)
+
+    compare_parser = subparsers.add_parser("compare", help="履歴の2回分を比べる")
+    compare_parser.add_argument("--baseline", type=int, default=-2, help="履歴の何番目を基準にするか (負の数は後ろから)")
+    compare_parser.add_argument("--current", type=int, default=-1)
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.set_defaults(handler=command_compare)
+
+    list_parser = subparsers.add_parser("list", help="計測する項目を表示する")
+    list_parser.set_defaults(handler=command_list)
+
+    args = parser.parse_args()
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,22 @@
+import math
+
 import pygame
 from pygame.math import Vector2 as PgVector
 
+import assets
+
 class World:
-    def __init__(self, size, dt, friction, grav_acc):
+    def __init__(self, size, dt, friction, grav_acc, time_scale=1.0, scale=350):
         self.size = size
+        self.scale = scale  # 1 m あたりのピクセル数 (pos_draw = pos_real * scale)
         self.dt = dt
+        self.base_dt = dt  # AdaptiveTimestep が dt を変える場合の基準の刻み (角速度の減衰などはこの刻みあたりの値)
         self.friction = friction
         self.grav_acc = PgVector(grav_acc)
+        self.time_scale = time_scale  # 実時間1秒あたりに進めるシミュレーション時間 (画面を使う場合)
+        self.pending_removals = None  # 決定的モードでは、ポケットに落ちた球をここにためて tick の最後に取り除く
+        self.ccd = False  # True の場合、ContactPhase は前の tick からの移動の線分で壁とポケットを調べる
+        self.telemetry = None  # telemetry.Telemetry.attach で設定する。衝突・壁・ポケットのイベントを記録する
 
 class CircleDrawer:
     def __init__(self, color, width, height):
@@ -31,9 +41,35 @@ def compute_friction(friction, grav_acc, mass, vel):
         return direction * force_magnitude
     return PgVector(0, 0)
 
+# Boundary から Numbermass に伝える、壁に当たったことを表すビットフラグ
+FLOOR_HIT = 1
+RIGHT_BOUNDARY_HIT = 2
+LEFT_BOUNDARY_HIT = 4
+TOP_BOUNDARY_HIT = 8
+
+# 壁の外向きの法線と、その壁に当たったことを表すフラグ (それ以外の向きの壁は 0)
+NORMAL_HIT_FLAGS = {(0.0, 1.0): FLOOR_HIT, (1.0, 0.0): RIGHT_BOUNDARY_HIT,
+                    (-1.0, 0.0): LEFT_BOUNDARY_HIT, (0.0, -1.0): TOP_BOUNDARY_HIT}
+
+MESSAGE_FLAGS = {"floor_hit": FLOOR_HIT, "right_boundary_hit": RIGHT_BOUNDARY_HIT,
+                 "left_boundary_hit": LEFT_BOUNDARY_HIT, "top_boundary_hit": TOP_BOUNDARY_HIT}
+
 class Numbermass:
-    """ビリヤードの玉を表すクラス"""
-    def __init__(self, number, color, radius, pos_draw, world, restitution=0.9, mass=0.17, static_friction=0.2, angular_damping=0.98):
+    """ビリヤードの玉を表すクラス
+
+    毎tickの更新ではベクトルを新しく作らず、pos_real・vel_real・total_force などをその場で書き換える。
+    停止判定で速度と角速度を 0 にした球は asleep にし、衝突やキューで力を受けるまで update で何もしない
+    (静止した球の update は状態を変えないので、結果は毎tick更新する場合と同じ)。
+    radius_for_draw と scale は台の設定 (tableconfig.TableSpec) の値を渡す。scale を省略すると World.scale を使う。
+    """
+    __slots__ = ("number", "color", "radius", "pos_draw", "drawer", "total_force", "restitution", "mass",
+                 "static_friction", "dynamic_friction", "world", "text_surface", "radius_for_draw",
+                 "pos_real", "vel_real", "grav_acc", "friction", "cushion_hits", "cushion_x", "cushion_y",
+                 "angle", "angular_velocity", "angular_acceleration", "moment_of_inertia", "angular_damping",
+                 "asleep", "scale")
+
+    def __init__(self, number, color, radius, pos_draw, world, restitution=0.9, mass=0.17, static_friction=0.2, angular_damping=0.98,
+                 radius_for_draw=14, scale=None):
         self.number = number
         self.color = pygame.Color(color)
         self.radius = radius
@@ -45,14 +81,16 @@ class Numbermass:
         self.static_friction = static_friction
         self.dynamic_friction = static_friction - 0.05
         self.world = world
-        self.font = pygame.font.Font(None, 30)
-        self.text_surface = self.font.render(f"{self.number}", True, pygame.Color("Black"))
-        self.radius_for_draw = 14
-        self.pos_real = self.pos_draw / 350
+        self.text_surface = None  # 番号の画像は最初に描画するときに assets から取り出す (ディスプレイやフォントなしでも球を作れるように)
+        self.radius_for_draw = radius_for_draw  # 描画と接触の判定に使う半径 (ピクセル)
+        self.scale = world.scale if scale is None else scale
+        self.pos_real = self.pos_draw / self.scale
         self.vel_real = PgVector((0, 0))
 
         self.total_force = PgVector((0, 0))
-        self.message_list = []
+        self.cushion_hits = 0  # このtickに当たった壁 (FLOOR_HIT などの論理和)
+        self.cushion_x = 0  # 当たった壁の位置 (ピクセル座標)
+        self.cushion_y = 0
         self.grav_acc = self.world.grav_acc
         self.friction = self.world.friction
 
@@ -61,27 +99,34 @@ class Numbermass:
         self.angular_acceleration = 0  # 角加速度
         self.moment_of_inertia = (2 / 5) * self.mass * (self.radius ** 2)  # 慣性モーメント
         self.angular_damping = angular_damping  # 角速度の減衰係数
+        self.asleep = False  # 静止していて、力を受けるまで更新しなくてよいか
 
     def draw(self, screen):
         # 回転を考慮して玉を描画
+        if self.text_surface is None:
+            self.text_surface = assets.shared().text(f"{self.number}", 30, "Black")
         pygame.draw.circle(screen,pygame.Color(self.color),(int(self.pos_draw.x),int(self.pos_draw.y)),self.radius_for_draw,0)
         rotated_text_surface = pygame.transform.rotate(self.text_surface, self.angle)
         text_rect = rotated_text_surface.get_rect(center=(int(self.pos_draw.x), int(self.pos_draw.y)))
         screen.blit(rotated_text_surface, text_rect.topleft)
 
     def update(self):
+        if self.asleep:
+            return
         self.generate_force()
         self.move()
         self.convert_pos()
         if self.vel_real.magnitude() < 1e-2 and self.angular_velocity < 10:  # 球が止まらないと困るので、速度が小さい場合にゼロにする
-            self.vel_real = PgVector(0, 0)
+            self.vel_real.update(0, 0)
             self.angular_velocity = 0
-        self.total_force = PgVector((0, 0))
+            self.asleep = True
+        self.total_force.update(0, 0)
         self.angular_acceleration = 0
-        self.message_list.clear()
+        self.cushion_hits = 0
 
     def receive_force(self, force, contact_point=None):
-        self.total_force += PgVector(force)
+        self.asleep = False
+        self.total_force += force
         if contact_point:
             # 打撃点が与えられた場合、トルクも計算
             torque = force.magnitude() * contact_point[0]
@@ -91,7 +136,8 @@ class Numbermass:
         """
         手玉がキューで突かれてから、全てが停止するまで、衝突の際に用いるメソッド
         """
-        self.total_force += PgVector(force)
+        self.asleep = False
+        self.total_force += force
         friction_f_length = 5*self.mass*self.radius*abs(relative_angular_vel)/(7*(1-self.restitution)*self.world.dt) * (3.14/180)
         #補正で2.5をかけてる
         torque = -friction_f_length * self.radius * compare_value
@@ -100,41 +146,72 @@ class Numbermass:
             perpendicular_impact_force = force.rotate(90)
             unit_vector = perpendicular_impact_force.normalize()
             fric_f = unit_vector * friction_f_length * compare_value
-            self.total_force -= PgVector(fric_f)
+            self.total_force -= fric_f
+
+    def receive_cushion_hit(self, flag, x, y):
+        """壁に当たったことを受け取るメソッド。位置の補正は次の move で行う"""
+        self.cushion_hits |= flag
+        self.cushion_x = x
+        self.cushion_y = y
+        telemetry = self.world.telemetry
+        if telemetry is not None:
+            telemetry.cushion(self, flag)
 
     def receive_message(self, msg):
-        self.message_list.append(msg)
+        """以前の辞書形式のメッセージを受け取るメソッド"""
+        self.receive_cushion_hit(MESSAGE_FLAGS[msg["type"]], msg.get("x", self.cushion_x), msg.get("y", self.cushion_y))
 
     def generate_force(self):
-        force_fric = compute_friction(self.friction, self.grav_acc, self.mass, self.vel_real)
-        self.receive_force(force_fric)
+        # compute_friction と同じ計算を、新しいベクトルを作らずに total_force に加える
+        vel = self.vel_real
+        speed = vel.magnitude()
+        if speed > 0:
+            force_magnitude = self.mass * self.grav_acc.magnitude() * self.friction
+            force = self.total_force
+            force.x += -(vel.x / speed) * force_magnitude
+            force.y += -(vel.y / speed) * force_magnitude
 
     def move(self):
-        self.pos_real, self.vel_real = integrate_symplectic(self.pos_real, self.vel_real, self.total_force, self.mass, self.world.dt)
-        self.angular_velocity += self.angular_acceleration * self.world.dt
-        self.angular_velocity *= self.angular_damping  # 角速度の減衰
-        self.angle += self.angular_velocity * self.world.dt *180/3.14
+        # integrate_symplectic と同じ計算をその場で行う (Vector2 の除算は逆数の乗算なので、それに合わせている)
+        dt = self.world.dt
+        pos, vel, force = self.pos_real, self.vel_real, self.total_force
+        inverse_mass = 1 / self.mass
+        vel.x = vel.x + force.x * inverse_mass * dt
+        vel.y = vel.y + force.y * inverse_mass * dt
+        pos.x = pos.x + vel.x * dt
+        pos.y = pos.y + vel.y * dt
+        self.angular_velocity += self.angular_acceleration * dt
+        damping = self.angular_damping
+        if dt != self.world.base_dt:
+            damping **= dt / self.world.base_dt  # base_dt ごとに angular_damping 倍になるようにする
+        self.angular_velocity *= damping  # 角速度の減衰
+        self.angle += self.angular_velocity * dt *180/3.14
         self.angle %= 360
 
-        for msg in self.message_list:
-            if msg["type"] == "floor_hit" and self.vel_real.y > 0:
-                self.pos_real.y = msg["y"] - self.radius / 350
-                self.vel_real.y *= -self.restitution
-            elif msg["type"] == "right_boundary_hit" and self.vel_real.x > 0:
-                self.pos_real.x = msg["x"] - self.radius / 350
-                self.vel_real.x *= -self.restitution
-            elif msg["type"] == "left_boundary_hit" and self.vel_real.x < 0:
-                self.pos_real.x = msg["x"] + self.radius / 350
-                self.vel_real.x *= -self.restitution
-            elif msg["type"] == "top_boundary_hit" and self.vel_real.y < 0:
-                self.pos_real.y = msg["y"] + self.radius / 350
-                self.vel_real.y *= -self.restitution
+        hits = self.cushion_hits
+        if hits:
+            if hits & FLOOR_HIT and vel.y > 0:
+                pos.y = self.cushion_y - self.radius / self.scale
+                vel.y *= -self.restitution
+            if hits & RIGHT_BOUNDARY_HIT and vel.x > 0:
+                pos.x = self.cushion_x - self.radius / self.scale
+                vel.x *= -self.restitution
+            if hits & LEFT_BOUNDARY_HIT and vel.x < 0:
+                pos.x = self.cushion_x + self.radius / self.scale
+                vel.x *= -self.restitution
+            if hits & TOP_BOUNDARY_HIT and vel.y < 0:
+                pos.y = self.cushion_y + self.radius / self.scale
+                vel.y *= -self.restitution
 
     def convert_pos(self):
-        self.pos_draw = self.pos_real * 350
+        scale = self.scale
+        self.pos_draw.x = self.pos_real.x * scale
+        self.pos_draw.y = self.pos_real.y * scale
 
 def compute_impact_force_between_points(p1, p2, dt):
-    distance = (p1.pos_draw - p2.pos_draw).magnitude()  # ピクセル座標系での距離を計算
+    pos1, pos2 = p1.pos_draw, p2.pos_draw
+    dx, dy = pos1.x - pos2.x, pos1.y - pos2.y
+    distance = math.sqrt(dx * dx + dy * dy)  # ピクセル座標系での距離を計算 (Vector2.magnitude と同じ計算)
     if distance > p1.radius_for_draw + p2.radius_for_draw:
         return None
     if distance == 0:
@@ -150,7 +227,8 @@ def compute_impact_force_between_points(p1, p2, dt):
     return f1
 
 def compute_impact_force_by_fixture(p, normal, point_included, dt):
-    invasion = normal.dot(p.pos_draw - point_included )
+    pos = p.pos_draw
+    invasion = normal.x * (pos.x - point_included.x) + normal.y * (pos.y - point_included.y)
     if invasion + p.radius_for_draw > 0 and normal.dot(p.vel_real) > 0:
         e = p.restitution
         v = normal.dot(p.vel_real)
@@ -163,11 +241,51 @@ def compute_impact_force_by_fixture(p, normal, point_included, dt):
 def is_number_mass(actor):
     return isinstance(actor, Numbermass)
 
+class LiveBalls:
+    """台の上に残っている球の集まり。並びは作成時の順で、取り除くのは O(1)
+
+    取り除いた球は removed にためておき、compact で actor_list からまとめて取り除く。
+    最初の球を手玉とする (actor_list の先頭と同じ)。
+    """
+    def __init__(self, balls=()):
+        self.balls = {}
+        self.removed = []
+        self.cue_ball = None
+        self.reset(balls)
+
+    def reset(self, balls):
+        self.balls = dict.fromkeys(balls)
+        self.cue_ball = next(iter(self.balls), None)
+
+    def __iter__(self):
+        return iter(self.balls)
+
+    def __len__(self):
+        return len(self.balls)
+
+    def __contains__(self, ball):
+        return ball in self.balls
+
+    def remove(self, ball):
+        del self.balls[ball]
+        self.removed.append(ball)
+
+    def compact(self, actor_list):
+        """取り除いた球を actor_list からまとめて取り除くメソッド (tick の最後に呼ぶ)"""
+        if not self.removed:
+            return
+        removed = set(self.removed)
+        actor_list[:] = [a for a in actor_list if a not in removed]
+        self.removed.clear()
+
 class CollisionResolver:
-    def __init__(self, world, actor_list, target_condition=None, drawer=None):
+    def __init__(self, world, actor_list, target_condition=None, drawer=None, broadphase=None, live_balls=None):
         self.is_alive = True
         self.world = world
         self.drawer = drawer or (lambda surface: None)
+        self.broadphase = broadphase  # 近くにある球のペアだけを返すオブジェクト (broadphase.SpatialHashGrid など)
+        self.live_balls = live_balls  # 指定した場合は actor_list を調べずにこの球を使う
+        self.plist = []
 
         self.actor_list = actor_list
         if target_condition is None:
@@ -183,17 +301,44 @@ class CollisionResolver:
 
     def generate_force_points(self):
         """2質点間の衝突による力を与えるメソッド"""
-        plist = [a for a in self.actor_list if self.target_condition(a)]
+        plist = self.plist  # 毎tick同じリストを使い回す
+        plist.clear()
+        if self.live_balls is not None:
+            plist.extend(self.live_balls)
+        else:
+            for a in self.actor_list:
+                if self.target_condition(a):
+                    plist.append(a)
+        # 静止した (asleep の) 球どうしは力を及ぼし合わないので調べない
+        if self.broadphase is not None:
+            # 候補のペアは総当たりと同じ順序で返されるので、結果は総当たりの場合と一致する
+            for i, j in self.broadphase.candidate_pairs(plist):
+                p1, p2 = plist[i], plist[j]
+                if not (p1.asleep and p2.asleep):
+                    self.resolve_pair(p1, p2)
+            return
         n = len(plist)
         for i in range(n):
+            p1 = plist[i]
+            asleep = p1.asleep
             for j in range(i + 1, n):
-                p1, p2 = plist[i], plist[j]
-                f1 = compute_impact_force_between_points(p1, p2, self.world.dt)
-                if f1 is None:
+                p2 = plist[j]
+                if asleep and p2.asleep:
                     continue
-                relative_angular_vel = p1.angular_velocity - p2.angular_velocity
-                p1.receive_force_while_moving(f1,compare_angularvelocity(p1,p2),relative_angular_vel)
-                p2.receive_force_while_moving(-f1,compare_angularvelocity(p1,p2),relative_angular_vel)
+                self.resolve_pair(p1, p2)
+
+    def resolve_pair(self, p1, p2):
+        """2つの球が衝突していれば力を加えるメソッド。力を加えた場合は True を返す"""
+        f1 = compute_impact_force_between_points(p1, p2, self.world.dt)
+        if f1 is None:
+            return False
+        relative_angular_vel = p1.angular_velocity - p2.angular_velocity
+        p1.receive_force_while_moving(f1,compare_angularvelocity(p1,p2),relative_angular_vel)
+        p2.receive_force_while_moving(-f1,compare_angularvelocity(p1,p2),relative_angular_vel)
+        telemetry = self.world.telemetry
+        if telemetry is not None:
+            telemetry.contact(p1, p2)
+        return True
 
 def compare_angularvelocity(p1,p2):
     if p1.angular_velocity > p2.angular_velocity:
@@ -202,8 +347,13 @@ def compare_angularvelocity(p1,p2):
         return -1
 
 class Boundary:
+    """台の壁。法線 normal の向きにめり込んだ球に、跳ね返す力を加える
+
+    hit_flag (当たったことを球に伝えるフラグ) と skip (力を加えない壁) は台の設定 (tableconfig) で決めたものを渡す。
+    hit_flag を省略した場合は法線の向きから NORMAL_HIT_FLAGS で決める。
+    """
     def __init__(self, normal, point_included, world, actor_list,
-                 target_condition=None, drawer=None):
+                 target_condition=None, drawer=None, hit_flag=None, skip=False):
         self.is_alive = True
         self.world = world
         self.drawer = drawer or (lambda surface: None)
@@ -215,42 +365,33 @@ class Boundary:
         else:
             self.target_condition = target_condition
 
+        self.skip = skip
+        if hit_flag is None:
+            hit_flag = NORMAL_HIT_FLAGS.get((self.normal.x, self.normal.y), 0)
+        self.hit_flag = hit_flag
+        self.hit_sign = PgVector(self.normal) if hit_flag else PgVector(0, 0)
+
     def update(self):
         self.generate_force()
 
     def draw(self, surface):
         self.drawer(surface)
 
-    def is_floor(self):
-        return self.normal == PgVector((0, 1))
-
-    def is_right_boundary(self):
-        return self.normal == PgVector((1, 0))
-
-    def is_left_boundary(self):
-        return self.normal == PgVector((-1, 0))
-
-    def is_top(self):
-        return self.normal == PgVector((0, -1))
-
     def generate_force(self):
         """壁と球の衝突による力を計算するメソッド。同時にめり込みが起こらないようにする処理も行う。"""
-        plist = [a for a in self.actor_list if self.target_condition(a)]
-        for p in plist:
-            if 570 <= self.point_included.x <= 630:
+        if self.skip:
+            return
+        normal, point_included, dt = self.normal, self.point_included, self.world.dt
+        flag, sign = self.hit_flag, self.hit_sign
+        for p in self.actor_list:
+            if not self.target_condition(p):
                 continue
-            f = compute_impact_force_by_fixture(p, self.normal, self.point_included, self.world.dt)
+            f = compute_impact_force_by_fixture(p, normal, point_included, dt)
             if f is None:
                 continue
             p.receive_force(f)
-            if self.is_floor() and p.vel_real.y > 0:
-                p.receive_message({"type": "floor_hit", "y": self.point_included.y})
-            elif self.is_right_boundary() and p.vel_real.x > 0:
-                p.receive_message({"type": "right_boundary_hit", "x": self.point_included.x})
-            elif self.is_left_boundary() and p.vel_real.x < 0:
-                p.receive_message({"type": "left_boundary_hit", "x": self.point_included.x})
-            elif self.is_top() and p.vel_real.y <0:
-                p.receive_message({"type": "top_boundary_hit", "y": self.point_included.y})
+            if flag and (p.vel_real.x * sign.x + p.vel_real.y * sign.y) > 0:
+                p.receive_cushion_hit(flag, point_included.x, point_included.y)
 
 class Pocket:
     def __init__(self, world, centerpos, radius, actor_list, target_condition=None, drawer=None):
@@ -267,17 +408,27 @@ class Pocket:
         self.score = 0
         self.cue_ball_fell = False
         self.all_balls_fell_except_cue = False
+        self.listeners = []  # 球が落ちたときに listener(pocket, actor) で呼ばれる (Gamerule など)
 
     def draw(self, surface):
         self.drawer(surface)
 
     def update(self):
-        for actor in self.actor_list[:]:
+        cx, cy = self.centerpos.x, self.centerpos.y
+        dropped = None  # 落ちる球が無いtickではリストを作らない
+        for actor in self.actor_list:
             if self.target_condition(actor):
                 # ピクセル座標系での落下判定
-                distance = (actor.pos_draw - self.centerpos).magnitude()
+                pos = actor.pos_draw
+                dx, dy = pos.x - cx, pos.y - cy
+                distance = math.sqrt(dx * dx + dy * dy)
                 if distance < self.radius:
-                    self.drop_the_ball(actor)
+                    if dropped is None:
+                        dropped = []
+                    dropped.append(actor)
+        if dropped:
+            for actor in dropped:
+                self.drop_the_ball(actor)
 
     def drop_the_ball(self,actor):
         """ボールがポケットに落下するメソッド
@@ -287,16 +438,365 @@ class Pocket:
         elif条件: 全ての球(手玉除く)の落下
         else条件: ゲームは終了しない"""
 
+        pending = self.world.pending_removals
+        if pending is not None:
+            self.defer_drop(actor, pending)
+            return
         index = self.actor_list.index(actor)
-        if index == 0:
+        is_last_ball = index != 0 and is_number_mass(self.actor_list[index +1]) == False and index ==1
+        self.receive_ball(actor, index == 0, is_last_ball)
+        self.actor_list.remove(actor)
+
+    def receive_ball(self, actor, is_cue_ball, is_last_ball):
+        """落ちた球の得点とゲームの終了条件のフラグを更新し、listeners に知らせるメソッド"""
+        if is_cue_ball:
             self.cue_ball_fell = True
-        elif is_number_mass(self.actor_list[index +1]) == False and index ==1 :
-            self.score += actor.number
-            self.all_balls_fell_except_cue = True
         else:
             self.score += actor.number
-        self.actor_list.remove(actor)
+            if is_last_ball:
+                self.all_balls_fell_except_cue = True
+        telemetry = self.world.telemetry
+        if telemetry is not None:
+            telemetry.pocket(self, actor, is_cue_ball)
+        for listener in self.listeners:
+            listener(self, actor)
+
+    def defer_drop(self, actor, pending):
+        """決定的モードでのボールの落下。actor_list からは取り除かず pending に加える
+        同じtickで先に落ちた球 (pending にある球) は、落ちたものとして扱う"""
+        if actor in pending:
+            return
+        is_cue_ball = actor is self.actor_list[0]
+        is_last_ball = not is_cue_ball and not any(
+            is_number_mass(a) and a is not actor and a not in pending for a in self.actor_list[1:])
+        pending.append(actor)
+        self.receive_ball(actor, is_cue_ball, is_last_ball)
 
 def is_pocket(actor):
     """スコア計算に用いるための関数。pocketクラスのみを参照"""
-    return isinstance(actor, Pocket)
\ No newline at end of file
+    return isinstance(actor, Pocket)
+
+
+class ContactPhase:
+    """全ての球について、壁との衝突とポケットへの落下を1回の走査で調べるクラス
+
+    Boundary と Pocket を actor_list に並べる代わりにこれを1つ置く。球は LiveBalls から取り出し、
+    壁ごと・ポケットごとに actor_list を走査することはない。ポケットは、台を格子に分けて
+    各マスに重なるポケットを作成時に求めておき、球のいるマスのポケットだけを調べる
+    (台の中央付近の球はポケットとの距離を計算しない)。
+    落ちた球は LiveBalls から取り除き、Pocket.receive_ball で得点を付けて listeners に知らせる。
+
+    World.ccd が True の場合は、前の tick の終わりの位置から今の位置までの線分 (swept circle) で調べる (update_swept)。
+    """
+    def __init__(self, world, live_balls, boundaries, pockets, cell_size=50, cushions=True):
+        self.is_alive = True
+        self.world = world
+        self.live_balls = live_balls
+        self.boundaries = list(boundaries)
+        self.pockets = list(pockets)
+        self.cushions = cushions  # False の場合は壁の計算を行わない (BallTable が行う場合)
+        self.dropped = []  # 毎tick同じリストを使い回す
+        self.previous = {}  # World.ccd の場合の、前の tick の終わりの球の位置 (球 -> (x, y))
+        self.build_pocket_grid(cell_size)
+
+    def build_pocket_grid(self, cell_size):
+        """各マスに重なるポケットのリストを求めておくメソッド"""
+        self.cell_size = cell_size
+        left = min([0] + [p.centerpos.x - p.radius for p in self.pockets])
+        top = min([0] + [p.centerpos.y - p.radius for p in self.pockets])
+        right = max([self.world.size[0]] + [p.centerpos.x + p.radius for p in self.pockets])
+        bottom = max([self.world.size[1]] + [p.centerpos.y + p.radius for p in self.pockets])
+        self.grid_origin = (left, top)
+        self.grid_columns = int(math.ceil((right - left) / cell_size))
+        self.grid_rows = int(math.ceil((bottom - top) / cell_size))
+        # 各ポケットについて、外接する正方形に入るマスだけを調べる (マスの中のポケットは self.pockets の順)
+        grid = [[[] for _ in range(self.grid_columns)] for _ in range(self.grid_rows)]
+        for p in self.pockets:
+            first_column = max(int((p.centerpos.x - p.radius - left) // cell_size), 0)
+            last_column = min(int((p.centerpos.x + p.radius - left) // cell_size), self.grid_columns - 1)
+            first_row = max(int((p.centerpos.y - p.radius - top) // cell_size), 0)
+            last_row = min(int((p.centerpos.y + p.radius - top) // cell_size), self.grid_rows - 1)
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    x0, y0 = left + column * cell_size, top + row * cell_size
+                    if self.circle_overlaps_cell(p.centerpos, p.radius, x0, y0, cell_size):
+                        grid[row][column].append(p)
+        self.pocket_grid = [[tuple(cell) for cell in cells] for cells in grid]
+
+    @staticmethod
+    def circle_overlaps_cell(center, radius, x0, y0, cell_size):
+        dx = max(x0 - center.x, 0, center.x - (x0 + cell_size))
+        dy = max(y0 - center.y, 0, center.y - (y0 + cell_size))
+        return dx * dx + dy * dy < radius * radius
+
+    def pockets_near(self, pos):
+        column = int((pos.x - self.grid_origin[0]) // self.cell_size)
+        row = int((pos.y - self.grid_origin[1]) // self.cell_size)
+        if 0 <= row < self.grid_rows and 0 <= column < self.grid_columns:
+            return self.pocket_grid[row][column]
+        return ()
+
+    def draw(self, surface):
+        pass
+
+    def update(self):
+        if self.world.ccd:
+            self.update_swept()
+            return
+        dt = self.world.dt
+        boundaries = self.boundaries if self.cushions else ()
+        dropped = self.dropped
+        for p in self.live_balls:
+            if p.asleep:
+                continue  # 静止した球は壁に力を受けず、ポケットの判定も止まる前に済んでいる
+            # 壁: Boundary.generate_force と同じ計算を、actor_list と同じ壁の順に行う
+            for boundary in boundaries:
+                if boundary.skip:
+                    continue
+                point_included = boundary.point_included
+                f = compute_impact_force_by_fixture(p, boundary.normal, point_included, dt)
+                if f is None:
+                    continue
+                p.receive_force(f)
+                sign = boundary.hit_sign
+                if boundary.hit_flag and (p.vel_real.x * sign.x + p.vel_real.y * sign.y) > 0:
+                    p.receive_cushion_hit(boundary.hit_flag, point_included.x, point_included.y)
+            # ポケット: 球のいるマスに重なるポケットだけを調べる (Pocket.update と同じ判定)
+            pos = p.pos_draw
+            for pocket in self.pockets_near(pos):
+                dx, dy = pos.x - pocket.centerpos.x, pos.y - pocket.centerpos.y
+                if math.sqrt(dx * dx + dy * dy) < pocket.radius:
+                    dropped.append((pocket, p))
+                    break
+        if dropped:
+            self.drop_balls(dropped)
+            dropped.clear()
+
+    def update_swept(self):
+        """前の tick の終わりの位置から今の位置までの線分で、壁とポケットを調べるメソッド (World.ccd の場合)
+
+        壁: 力は update と同じく compute_impact_force_by_fixture で加える。この tick の間に壁に接した
+        (tick の初めには接していなかった) 場合は、接した時刻から先の動きを跳ね返した位置に置き直す (swept_path)。
+        ポケット: 跳ね返りを含めた道筋の線分のどれかがポケットの円に入っていれば、最初に入るポケットに落とす。
+        1tickで口を飛び越える球も、壁の向こうまでめり込んだ位置でだけポケットに入る球もない。
+        """
+        dt = self.world.dt
+        scale = self.world.scale
+        boundaries = self.boundaries if self.cushions else ()
+        dropped = self.dropped
+        previous = self.previous
+        current = {}
+        for p in self.live_balls:
+            pos = p.pos_draw
+            if p.asleep:
+                current[p] = (pos.x, pos.y)
+                continue
+            start = previous.get(p)
+            if start is None:  # 最初の tick は、速度から tick の初めの位置を求める (move は新しい速度で進めるので)
+                start = (pos.x - p.vel_real.x * dt * scale, pos.y - p.vel_real.y * dt * scale)
+            pocket, end = self.swept_path(p, start, boundaries)
+            if pocket is not None:
+                dropped.append((pocket, p))
+                continue
+            for boundary in boundaries:
+                if boundary.skip:
+                    continue
+                point_included = boundary.point_included
+                f = compute_impact_force_by_fixture(p, boundary.normal, point_included, dt)
+                if f is None:
+                    continue
+                p.receive_force(f)
+                sign = boundary.hit_sign
+                if boundary.hit_flag and (p.vel_real.x * sign.x + p.vel_real.y * sign.y) > 0:
+                    p.receive_cushion_hit(boundary.hit_flag, point_included.x, point_included.y)
+            if end != (pos.x, pos.y):
+                p.pos_real.update(end[0] / scale, end[1] / scale)
+                p.convert_pos()
+            current[p] = (pos.x, pos.y)
+        self.previous = current
+        if dropped:
+            self.drop_balls(dropped)
+            dropped.clear()
+
+    def swept_path(self, p, start, boundaries):
+        """start から p の今の位置までの動きを、壁に接するたびに跳ね返しながらたどるメソッド
+
+        戻り値は (最初に入るポケット (入らなければ None), 跳ね返した後の tick の終わりの位置)。
+        接した時刻から先にめり込む深さ d は、跳ね返った後の速さ (restitution 倍) で離れる距離 restitution * d に
+        なるので、終わりの位置を法線の向きに (1 + restitution) * d だけ戻す。
+        tick の初めにすでにめり込んでいた壁は update と同じく力だけを加え、位置は変えない。
+        """
+        radius = p.radius_for_draw
+        x0, y0 = start
+        x1, y1 = p.pos_draw.x, p.pos_draw.y
+        hit = []
+        while True:
+            first, first_t = None, 2.0
+            for boundary in boundaries:
+                if boundary.skip or boundary in hit:
+                    continue
+                normal, point = boundary.normal, boundary.point_included
+                start_invasion = normal.x * (x0 - point.x) + normal.y * (y0 - point.y) + radius
+                end_invasion = normal.x * (x1 - point.x) + normal.y * (y1 - point.y) + radius
+                if start_invasion <= 0 < end_invasion:
+                    t = start_invasion / (start_invasion - end_invasion)
+                    if t < first_t:
+                        first, first_t, depth = boundary, t, end_invasion
+            if first is None:
+                return self.first_pocket_on_segment(x0, y0, x1, y1), (x1, y1)
+            cx, cy = x0 + (x1 - x0) * first_t, y0 + (y1 - y0) * first_t
+            pocket = self.first_pocket_on_segment(x0, y0, cx, cy)
+            if pocket is not None:
+                return pocket, (x1, y1)
+            shift = (1 + p.restitution) * depth
+            x0, y0 = cx, cy
+            x1, y1 = x1 - first.normal.x * shift, y1 - first.normal.y * shift
+            hit.append(first)
+
+    def first_pocket_on_segment(self, x0, y0, x1, y1):
+        """(x0, y0) から (x1, y1) まで動く球の中心が、最初に入るポケットを返すメソッド (入らなければ None)
+
+        update と同じく、中心とポケットの中心の距離が半径より小さくなったら入ったとする。
+        """
+        dx, dy = x1 - x0, y1 - y0
+        a = dx * dx + dy * dy
+        first, first_t = None, 2.0
+        for pocket in self.pockets:
+            cx, cy, radius = pocket.centerpos.x, pocket.centerpos.y, pocket.radius
+            fx, fy = x0 - cx, y0 - cy
+            c = fx * fx + fy * fy - radius * radius
+            if c < 0:
+                t = 0.0
+            elif a == 0:
+                continue
+            else:
+                b = fx * dx + fy * dy
+                discriminant = b * b - a * c
+                if b >= 0 or discriminant <= 0:
+                    continue
+                t = (-b - math.sqrt(discriminant)) / a
+                if t > 1:
+                    continue
+            if t < first_t:
+                first, first_t = pocket, t
+        return first
+
+    def drop_balls(self, dropped):
+        live_balls = self.live_balls
+        for pocket, p in dropped:
+            live_balls.remove(p)
+            is_cue_ball = p is live_balls.cue_ball
+            is_last_ball = not is_cue_ball and len(live_balls) == 1 and live_balls.cue_ball in live_balls
+            pocket.receive_ball(p, is_cue_ball, is_last_ball)
+
+class AdaptiveTimestep:
+    """球の速さと、球どうし・球と壁が最も近づく距離から、次の tick の World.dt を決めるクラス
+
+    actor_list では球の後、CollisionResolver の前に置く。この tick の衝突と壁の力は、次の tick の
+    Numbermass.move と同じ dt で計算する必要があるので、球を動かした後・力を計算する前に dt を決める。
+    動いている各球について
+      - 1tickに進む距離が radius_for_draw の travel 倍以下
+      - 近づいている球・壁との隙間が、1tickで radius_for_draw の slop 倍より多くめり込むほどには縮まない
+        (World.ccd の場合、壁は ContactPhase が接した時刻で扱うので調べない)
+      - 摩擦による速さの変化が friction_fraction 以下 (ただし base_dt より小さくはしない。止まる直前は元と同じ刻み)
+    を満たす dt のうち最も小さいものを、base_dt の min_scale 倍から max_scale 倍の範囲に収めて使う。
+    全ての球が静止している (asleep) 場合は base_dt に戻す (キューで突く力は base_dt の1tickで加える前提なので)。
+    """
+    def __init__(self, world, live_balls, boundaries, max_scale=8.0, min_scale=0.25, travel=0.5, slop=0.25,
+                 friction_fraction=0.1):
+        self.is_alive = True
+        self.world = world
+        self.live_balls = live_balls
+        self.boundaries = [b for b in boundaries if not b.skip]
+        # 壁の法線と壁上の1点 (Vector2 の属性を tick ごとに読まないようにタプルにしておく)
+        self.walls = [(b.normal.x, b.normal.y, b.point_included.x, b.point_included.y) for b in self.boundaries]
+        self.max_scale = max_scale
+        self.min_scale = min_scale
+        self.travel = travel
+        self.slop = slop
+        self.friction_fraction = friction_fraction
+
+    def draw(self, surface):
+        pass
+
+    def update(self):
+        self.world.dt = self.next_dt()
+
+    def next_dt(self):
+        world = self.world
+        base_dt = world.base_dt
+        # Vector2 の属性を何度も読まないように、球の状態を1回だけ読んでタプルにしておく (live_balls の順)
+        states = []
+        moving = []  # 動いている球の states での添字
+        for p in self.live_balls:
+            pos, vel = p.pos_draw, p.vel_real
+            if not p.asleep:
+                moving.append(len(states))
+            states.append((pos.x, pos.y, vel.x, vel.y, p.radius_for_draw, p.asleep))
+        if not moving:
+            return base_dt
+        deceleration = world.friction * world.grav_acc.magnitude()
+        dt = base_dt * self.max_scale
+        scale = world.scale
+        for k in moving:
+            _, _, vx, vy, radius, _ = states[k]
+            speed = math.sqrt(vx * vx + vy * vy)
+            if speed == 0:
+                continue
+            limit = self.travel * radius / scale / speed
+            if deceleration > 0:
+                limit = min(limit, max(self.friction_fraction * speed / deceleration, base_dt))
+            if limit < dt:
+                dt = limit
+        dt = min(dt, self.approach_limit(states, moving, dt))
+        return max(dt, base_dt * self.min_scale)
+
+    def approach_limit(self, states, moving, dt):
+        """動いている球が、近づいている球と壁に1tickで slop より深くめり込まない dt (dt より大きければ dt)
+
+        球のペアは、動いている球から見たものだけを1回ずつ調べる (静止した球どうしは近づかない)。
+        各ペアは総当たりと同じ向き (live_balls の前の球, 後の球) で計算するので、総当たりと同じ dt になる。
+        next_dt が先に各球の1tickの移動を radius_for_draw の travel 倍以下にしているので、dt を小さくし得るのは
+        中心の距離が半径の和の (1 + travel) 倍より近いペアだけで、それより遠いペアは平方根を計算せずに除く。
+        """
+        scale = self.world.scale
+        reach = dt * scale  # dt の間に速さ1 m/s で進む距離 (ピクセル)
+        slop = self.slop
+        # World.ccd の場合は ContactPhase が接した時刻で跳ね返すので、壁については dt を小さくしなくてよい
+        if not self.world.ccd:
+            for k in moving:
+                x, y, vx, vy, radius, _ = states[k]
+                for nx, ny, px, py in self.walls:
+                    closing = nx * vx + ny * vy
+                    if closing > 0:
+                        gap = -(nx * (x - px) + ny * (y - py)) - radius
+                        allowed = max(gap, 0.0) + slop * radius
+                        if allowed < reach * closing:
+                            dt = allowed / scale / closing
+                            reach = dt * scale
+        near = (1 + self.travel) ** 2
+        for i in moving:
+            x, y, vx, vy, radius, _ = states[i]
+            for j, (qx, qy, qvx, qvy, q_radius, q_asleep) in enumerate(states):
+                # 動いている球どうしのペアは、添字の小さい方から見たときだけ調べる
+                if j == i or (j < i and not q_asleep):
+                    continue
+                dx, dy = qx - x, qy - y
+                distance2 = dx * dx + dy * dy
+                reach_sum = radius + q_radius
+                if distance2 >= near * reach_sum * reach_sum:
+                    continue
+                # 2球の中心を結ぶ向きに近づく速さ × 距離 (向きを入れ替えても符号は変わらない)
+                closing_distance = (vx - qvx) * dx + (vy - qvy) * dy
+                if closing_distance <= 0:
+                    continue
+                distance = math.sqrt(distance2)
+                closing = closing_distance / distance
+                allowed = (distance - q_radius - radius) if j < i else (distance - radius - q_radius)
+                if allowed < 0:
+                    allowed = 0.0
+                allowed += slop * (radius if radius < q_radius else q_radius)
+                if allowed < reach * closing:
+                    dt = allowed / scale / closing
+                    reach = dt * scale
+        return dt
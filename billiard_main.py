@@ -1,53 +1,41 @@
 import pygame
+import assets
 import billiard
 import selectmode
-import gamerule
-import time
+import simulator
+import renderer
+import scheduler
+import tableconfig
+import physicsthread
+import aimguide
+import functools
 import sys
+import time
 
 PgVector = pygame.math.Vector2
 
-class ActorFactory:
-    def __init__(self, world, actor_list):
-        self.world = world
-        self.actor_list = actor_list
-
-    def create_boundary(self, name):
-        width, height = self.world.size
-        geometry = {"top": ((0, -1), (150, 75)),
-                    "bottom": ((0, 1), (150, height-80)),
-                    "left": ((-1, 0), (150, 75)),
-                    "right": ((1, 0), (width-150, 75))}
-        normal, point_included = geometry[name]
-        return billiard.Boundary(normal, point_included, self.world, self.actor_list)
-    
-    def create_collision_resolver(self):
-        return billiard.CollisionResolver(self.world, self.actor_list)
-    
-    def create_pockets(self):
-        pocket_data = [
-            {"centerpos": (1100, 575), "radius": 100},  # 右下
-            {"centerpos": (100, 575), "radius": 100},   # 左下
-            {"centerpos": (1100, 25), "radius": 100},   # 右上
-            {"centerpos": (100, 25), "radius": 100},    # 左上
-            {"centerpos": (602, 15), "radius": 75},    # 中央上
-            {"centerpos": (602, 585), "radius": 75},   # 中央下
-        ]
-        pockets = []
-        for data in pocket_data:
-            pocket = billiard.Pocket(
-                self.world,
-                data["centerpos"],
-                data["radius"],
-                self.actor_list
-            )
-            pockets.append(pocket)
-        return pockets
-
 class AppMain:
-    def __init__(self):
-        pygame.init()
-        width, height = 1200, 600
+    def __init__(self, engine="object", broadphase=False, render_fps=60, time_scale=0.3, max_substeps=8,
+                 record_path=None, deterministic=False, profile=False, trace_path=None, hints=False, atlas_path=None,
+                 table=None, telemetry_path=None):
+        """render_fps: 描画の頻度。time_scale: 実時間1秒あたりのシミュレーション時間 (0.3 で dt=0.005 を毎秒60回)
+
+        物理は World.dt ごとに、描画とは独立に実時間に合わせて進める。
+        record_path を指定すると、盤面・ショット・tickごとの状態をそのファイルに記録する (shotrecord)。
+        deterministic=True の場合は、決まった順序で更新し tickごとに状態のハッシュを計算する (determinism)。
+        profile=True の場合は、物理と描画の時間を計測して得点の横に表示する (profiler)。
+        trace_path を指定すると、終了時にそのファイルへ trace を書き出す。
+        hints=True の場合は、球が止まるたびに別スレッドでショットを探し、見つかった方向と強さを線で示す (shotsearch)。
+        atlas_path を指定すると、テーブルの背景と番号の画像をまとめた画像をそこに保存し、次からはそれを読み込む (assets)。
+        table: 台の設定 (tables/ の名前。省略すると tableconfig.DEFAULT_TABLE)。画面の大きさ・壁・ポケット・球の並べ方を決める。
+        telemetry_path を指定すると、ショット・衝突・ポケットなどのイベントとショットごとの統計をそこに書き出す
+        (ファイルのパス・tcp://host:port・unix:///path。telemetry)。
+        記録・計測・ヒント・イベントのモジュールは、使う場合だけ読み込む。
+        """
+        assets.init()  # pygame.init() と違い、音声などの使わないサブシステムは初期化しない
+        self.assets = assets.shared()
+        self.table = tableconfig.load(table or tableconfig.DEFAULT_TABLE)
+        width, height = self.table.size
         self.screen = pygame.display.set_mode((width, height))
         self.ball_num = 9
         self.mouse_button_pressed = False
@@ -56,107 +44,205 @@ class AppMain:
         self.can_move_ball = False
         self.total_score = 0
 
-        self.world = billiard.World((width, height), 0.005, 0.2, (9.81, 9.81))
-        self.image = pygame.image.load("images/design.png").convert_alpha()
-        self.actor_list = []
-
-        mainmass = billiard.Numbermass(0, pygame.Color("Black"), 0.028, (300, 300), self.world)
-        self.actor_list.append(mainmass)
-
-        num = 1
-        radius = 0.028
-        for n in range(1, 5):
-            for k in range(1, n + 1):
-                pos = 600 + 20 * n, 320 + 20 * n - 40 * k
-                color = pygame.Color("white")
-                self.actor_list.append(billiard.Numbermass(num, color, radius, pos, self.world))
-                num += 1
-
-        self.factory = ActorFactory(self.world, self.actor_list)
-        self.actor_list.append(self.factory.create_collision_resolver())
-        self.actor_list.append(self.factory.create_boundary("top"))
-        self.actor_list.append(self.factory.create_boundary("bottom"))
-        self.actor_list.append(self.factory.create_boundary("left"))
-        self.actor_list.append(self.factory.create_boundary("right"))
-        pocket_list = self.factory.create_pockets()
-        for n in range(len(pocket_list)):
-            self.actor_list.append(pocket_list[n])
+        self.simulator = simulator.Simulator(simulator.create_world(table=self.table), engine, broadphase,
+                                             deterministic=deterministic, table=self.table)
+        self.world = self.simulator.world
+        self.world.time_scale = time_scale
+        self.render_fps = render_fps
+        self.actor_list = self.simulator.actor_list
+        self.factory = self.simulator.factory
+        self.ball_table = self.simulator.ball_table
 
+        ball_radius = self.table.ball.draw_radius
+        if atlas_path and self.table.image is not None:
+            self.image = None
+            background, labels = self.assets.table_atlas((width, height), self.table.image, path=atlas_path)
+            self.renderer = renderer.TableRenderer(self.screen, background=background, baked_labels=labels,
+                                                   ball_radius=ball_radius)
+        else:
+            if self.table.image is None:
+                self.image = tableconfig.render_table(self.table)  # 画像のない台は壁とポケットの位置から描く
+            else:
+                self.image = self.assets.image(self.table.image)
+            self.renderer = renderer.TableRenderer(self.screen, self.image, ball_radius=ball_radius)
+        self.scheduler = scheduler.FixedStepScheduler(self.world, self.update,
+                                                      lambda: renderer.ball_positions(self.actor_list), max_substeps)
         self.select_mode = selectmode.Point_selectmode(self.screen, 300, 300)
-        self.game_rule = gamerule.Gamerule(pocket_list)
+        self.game_rule = self.simulator.game_rule
         self.contact_point = None
         self.force = PgVector(0, 0)
+        self.recorder = None
+        if record_path:
+            import shotrecord
+            self.recorder = shotrecord.ShotRecorder(record_path, self.simulator)
+        self.profiler = None
+        self.trace_path = trace_path
+        if profile or trace_path:
+            import profiler
+            self.profiler = profiler.Profiler(trace=trace_path is not None)
+            self.profiler.attach(self.simulator)
+        self.telemetry = None
+        if telemetry_path:
+            import telemetry
+            self.telemetry = telemetry.Telemetry(telemetry.open_sink(telemetry_path))
+            self.telemetry.attach(self.simulator)
+        self.frame_count = 0
+        self.hint_worker = None
+        if hints:
+            import shotcache
+            import shotsearch
+            self.hint_worker = shotsearch.HintWorker(cache=shotcache.ShotCache())
+        self.hint_generation = None  # 今の止まった盤面について出したヒントの要求の番号
+        self.shot_tick = -1  # 最後に手玉を突いたときの tick (突いた直後はまだ球が動き出していない)
+        boundaries = [b for a in self.actor_list if isinstance(a, billiard.ContactPhase) for b in a.boundaries]
+        ball = self.table.ball
+        self.aim_guide = aimguide.AimGuide(self.world, boundaries, self.simulator.pockets, ball.mass, ball.restitution,
+                                           ball.draw_radius)
 
     def give_force_by_user(self, start_pos, end_pos):
         """ビリヤードの玉をついたと同じ動作をするメソッド"""
-        force_magnitude = 50 + (PgVector(end_pos)-PgVector(start_pos)).magnitude() /7.5
-        direction = PgVector(end_pos) - PgVector(start_pos)
-        direction = direction.normalize()  # 方向のみを取得
-        self.force = -direction * force_magnitude
+        self.force = simulator.force_from_drag(start_pos, end_pos)
         self.select_mode.is_active = True
 
     def apply_force(self, contact_point):
         """選択モードで取得したコンタクトポイントを使用して力を加える"""
-        vel = selectmode.compute_conservation_of_momentum(self.force, self.actor_list[0].mass, self.world.dt)
-        self.actor_list[0].vel = PgVector(vel[0], vel[1])
-        self.actor_list[0].receive_force(self.force, contact_point)
+        self.simulator.shoot(self.force, contact_point)
+        if self.recorder:
+            self.recorder.record_shot(self.force, contact_point)
 
         self.contact_point = None
         self.force = PgVector(0, 0)
+        self.hint_generation = None
+        self.shot_tick = self.simulator.tick_count
+
+    def request_hint(self):
+        """球が止まっていて、まだこの盤面のヒントを頼んでいなければ頼む"""
+        if (self.hint_worker and self.hint_generation is None and self.simulator.tick_count > self.shot_tick
+                and self.are_balls_stopped()):
+            self.hint_generation = self.hint_worker.request(self.simulator.snapshot())
+
+    def hint_line(self, cue_pos=None):
+        """見つかったショットを、手玉からドラッグと同じ長さの線で表す (まだ見つかっていなければ None)
+
+        cue_pos: 手玉の描画位置 (省略すると actor_list の手玉の位置)
+        """
+        if self.hint_generation is None:
+            return None
+        result = self.hint_worker.latest(self.hint_generation)
+        if result is None or result.best is None:
+            return None
+        candidate = result.best.candidate
+        direction = PgVector(candidate.direction)
+        if direction.length() == 0:
+            return None
+        drag_distance = (candidate.magnitude - 50) * 7.5  # give_force_by_user の強さの逆算
+        cue_pos = PgVector(self.actor_list[0].pos_draw if cue_pos is None else cue_pos)
+        return (cue_pos, cue_pos + direction.normalize() * drag_distance)
 
     def are_balls_stopped(self):
         """すべてのボールが停止しているかを確認するメソッド"""
-        for actor in self.actor_list:
-            if isinstance(actor, billiard.Numbermass) and actor.vel_real.magnitude() > 0.1:
-                return False
-        return True
+        return self.simulator.are_balls_stopped()
     
     def draw_score(self,actor_list):
-        self.total_score = sum(a.score for a in actor_list if billiard.is_pocket(a))
-        font = pygame.font.Font(None, 36)
-        score_text = f"Total Score: {self.total_score}"
-        text_surface = font.render(score_text, True, pygame.Color("White"))
-        self.screen.blit(text_surface, (200, 10))
+        self.total_score = sum(pocket.score for pocket in self.simulator.pockets)
+        self.renderer.set_score(self.total_score)  # 得点が変わったときだけ画像を作り直す
 
     def end_game(self):
         text = self.game_rule.transmit_message()
-        font = pygame.font.Font(None, 60)
         lines = text.split('\n')  # 改行で分割して行リストを作成
+        width, height = self.table.size
         n = 0
         for line in lines: 
-            text_surface = font.render(line, True, pygame.Color("black"))
-            text_rect = text_surface.get_rect(center=(600, 300 + n * 50))
+            text_surface = self.assets.text(line, 60, "black")
+            text_rect = text_surface.get_rect(center=(width // 2, height // 2 + n * 50))
             self.screen.blit(text_surface, text_rect)
             n+= 1
             
     def update(self):
-        self.can_accept_click = self.are_balls_stopped()
-        for a in self.actor_list:
-            a.update()
-        self.game_rule.update()
-        
-    def draw(self, mouse_pos, start_pos=(0, 0)):
-        self.screen.fill((0, 0, 0))
-        image_width, image_height = self.image.get_width(), self.image.get_height()
-        screen_center = (self.screen.get_width() // 2, self.screen.get_height() // 2)
-        image_position = (screen_center[0] - image_width // 2, screen_center[1] - image_height // 2)
-        self.screen.blit(self.image, image_position)
-        self.draw_score(self.actor_list)
-        for a in self.actor_list:
-            a.draw(self.screen)
-        if self.mouse_button_pressed and start_pos:
+        # 物理のスレッドで呼ばれる。can_accept_click は描画のスレッドが Frame から決めるので、ここでは変えない
+        self.simulator.step()
+        if self.recorder:
+            self.recorder.record_tick()
+
+    def draw(self, mouse_pos, start_pos=(0, 0), frame=None):
+        """テーブルの背景はキャッシュしておき、動いた球とキューの線の周りだけを描き直す
+
+        frame (physicsthread.Frame) を渡した場合は、Simulator には触れずに frame の内容だけで描く。
+        """
+        profiler = self.profiler
+        if profiler:
+            profiler.lap_start()
+            self.draw_overlay()
+        if frame is None:
+            self.draw_score(self.actor_list)
+            cue_pos = self.actor_list[0].pos_draw
+        else:
+            self.total_score = frame.score
+            self.renderer.set_score(frame.score)
+            cue_pos = frame.cue_pos and PgVector(frame.cue_pos)
+        if profiler:
+            profiler.lap("draw_score")
+        cue_line = None
+        guide = None
+        if self.mouse_button_pressed and start_pos and cue_pos is not None:
             direction = PgVector(mouse_pos) - PgVector(start_pos)
-            pygame.draw.line(self.screen, pygame.Color("blue"), self.actor_list[0].pos_draw, self.actor_list[0].pos_draw - direction, 3)
-        pygame.display.update()
+            cue_line = (cue_pos, cue_pos - direction)
+            guide = self.aim_prediction(cue_pos, direction, frame)
+            if profiler:
+                profiler.lap("aim_guide")
+        elif self.hint_worker and cue_pos is not None:
+            if frame is None:
+                self.request_hint()  # 別スレッドで物理を進める場合は、物理のスレッドが頼む
+            cue_line = self.hint_line(cue_pos)
+        # 物理の最後の2つの状態の間を補間して描く
+        if frame is None:
+            sprites = renderer.sprite_states(self.actor_list, self.scheduler.previous, self.scheduler.alpha)
+        else:
+            sprites = physicsthread.interpolated_sprites(frame, time.perf_counter(),
+                                                         self.world.dt / self.world.time_scale)
+        if profiler:
+            profiler.lap("sprites")
+        self.renderer.draw(sprites, cue_line, guide)
+        if profiler:
+            profiler.lap("render")
+
+    def aim_prediction(self, cue_pos, drag, frame=None):
+        """ドラッグ中の手玉の道筋の予測を返す (盤面が変わったときだけ的球を格子に入れ直す)
+
+        球が止まっていても tick は毎回進むので、盤面の key には tick ではなく球の番号と位置を使う。
+        """
+        sprites = renderer.sprite_states(self.actor_list) if frame is None else frame.sprites
+        key = aimguide.table_key(sprites)
+        if key != self.aim_guide.table_key:
+            self.aim_guide.set_table(key, sprites)
+        return self.aim_guide.predict(cue_pos, drag)
+
+    def draw_overlay(self):
+        """計測の結果を得点の横に表示する (文字の画像を毎フレーム作らないように、30フレームごとに更新)"""
+        self.frame_count += 1
+        if self.frame_count % 30 == 1:
+            self.renderer.set_overlay(self.profiler.overlay_text())
 
     def run(self):
+        """入力と描画のループ。物理は PhysicsThread が別スレッドで進める
+
+        このループは Simulator に触れず、physics.frame を読んで描き、手玉を突く操作は physics.submit で渡す。
+        選択モードとゲーム終了の表示も、このループの中の状態として扱い、入力の処理を止めない。
+        """
         clock = pygame.time.Clock()
+        physics = physicsthread.PhysicsThread(self, time.perf_counter)
+        physics.start()
         start_pos = None
+        submitted_tick = -1  # 手玉を突く操作を渡したときの frame.tick (実行されるまではクリックを受け付けない)
+        game_over_deadline = None
         self.select_mode.is_active = False
         while True:
-            frames_per_second = 60
-            clock.tick(frames_per_second)
+            clock.tick(self.render_fps)
+            if physics.error is not None:
+                break  # 物理のスレッドが例外で止まった場合は、止まった画面を描き続けずに終了して例外を送出する
+            frame = physics.frame
             mouse_pos = pygame.mouse.get_pos()
+            self.can_accept_click = frame.balls_stopped and frame.tick > submitted_tick
 
             should_quit = False
             for event in pygame.event.get():
@@ -173,14 +259,20 @@ class AppMain:
                     if event.key == pygame.K_SPACE:
                         self.space_key_pressed = False
 
+                if game_over_deadline is not None:
+                    continue
+
                 if self.select_mode.is_active:
                     if event.type == pygame.MOUSEBUTTONDOWN:
                         click_pos = event.pos
                         if self.select_mode.check_click_inside(click_pos):
                             self.contact_point = self.select_mode.give_moment_arm(click_pos)
                             self.select_mode.is_active = False
-                            self.apply_force(self.contact_point)
-                    continue 
+                            self.renderer.invalidate()  # 選択モードの画面を閉じたら全体を描き直す
+                            physics.submit(functools.partial(self.apply_force, self.contact_point))
+                            submitted_tick = frame.tick
+                            self.can_accept_click = False
+                    continue
 
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if self.can_accept_click or self.space_key_pressed:
@@ -196,23 +288,40 @@ class AppMain:
 
             if should_quit:
                 break
-            
+
+            if game_over_deadline is not None:
+                # 終了の表示は一度描いたまま、入力だけを受け付けて待つ (ESC で先に終われる)
+                if time.perf_counter() >= game_over_deadline:
+                    break
+                continue
+
+            if self.profiler:
+                draw_start = self.profiler.clock()
+            # 選択モードの間も物理は進むので、テーブルを描いてからその上に選択の画面を描く
+            self.draw(mouse_pos, start_pos if start_pos else (0, 0), frame)
             if self.select_mode.is_active:
                 self.select_mode.draw()
                 pygame.display.update((0, 0, self.select_mode.width, self.select_mode.height))
-            else:
-                self.update()
-                self.draw(mouse_pos, start_pos if start_pos else (0, 0))
+            if self.profiler:
+                self.profiler.record("draw", draw_start, self.profiler.clock(), "frame")
 
-            if self.game_rule.game_over:
+            if frame.game_over:
                 self.end_game()
                 pygame.display.update()
-                time.sleep(5)
-                pygame.quit()
-                sys.exit()
+                game_over_deadline = time.perf_counter() + 5
 
+        physics.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.trace_path:
+            self.profiler.write_trace(self.trace_path)
+        if self.hint_worker:
+            self.hint_worker.close()
+        if self.telemetry:
+            self.telemetry.close()
         pygame.quit()
-
+        if physics.error is not None:
+            raise physics.error
 
 if __name__ == "__main__":
-    AppMain().run()
\ No newline at end of file
+    AppMain(table=sys.argv[1] if len(sys.argv) > 1 else None).run()  # python billiard_main.py nineball など
\ No newline at end of file
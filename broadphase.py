@@ -0,0 +1,84 @@
+"""球同士の衝突判定の候補を絞り込むためのモジュール (ブロードフェーズ)"""
+
+
+class SpatialHashGrid:
+    """pos_draw をもとに球を一様グリッドのセルに割り当て、近くにある球のペアだけを返すクラス
+
+    セルの一辺を2球の半径の和以上にしておけば、接触し得る2球は必ず同じセルか隣接するセルに入る。
+    球がセルをまたいだときだけ登録を更新するので、1tickあたりの更新は移動した球の数に比例する。
+    """
+    # 自分のセルと、右・左下・下・右下のセルだけを見れば、全ての隣接セルの組を1回ずつ調べられる
+    NEIGHBOR_OFFSETS = ((0, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+    def __init__(self, cell_size=None):
+        self.cell_size = cell_size
+        self.cells = {}  # (cx, cy) -> {球: None} (挿入順を保つ集合として使う)
+        self.cell_of = {}  # 球 -> (cx, cy)
+
+    def clear(self):
+        self.cells.clear()
+        self.cell_of.clear()
+
+    def cell_key(self, pos):
+        return (int(pos.x // self.cell_size), int(pos.y // self.cell_size))
+
+    def update(self, plist):
+        """球の位置に合わせてセルの登録を更新するメソッド"""
+        required = 2 * max((p.radius_for_draw for p in plist), default=0)
+        if self.cell_size is None or self.cell_size < required:
+            # より大きな球が現れた場合はセルの大きさを変えて作り直す
+            self.cell_size = required or 1
+            self.clear()
+
+        cell_of = self.cell_of
+        for p in plist:
+            key = self.cell_key(p.pos_draw)
+            old = cell_of.get(p)
+            if old == key:
+                continue
+            if old is not None:
+                del self.cells[old][p]
+                if not self.cells[old]:
+                    del self.cells[old]
+            self.cells.setdefault(key, {})[p] = None
+            cell_of[p] = key
+
+        if len(cell_of) != len(plist):
+            # ポケットに落ちるなどして居なくなった球を取り除く
+            present = set(plist)
+            for p in [p for p in cell_of if p not in present]:
+                self._remove(p)
+
+    def _remove(self, p):
+        key = self.cell_of.pop(p)
+        del self.cells[key][p]
+        if not self.cells[key]:
+            del self.cells[key]
+
+    def candidate_pairs(self, plist):
+        """衝突し得るペアを plist 上の添字 (i, j) (i < j) の昇順で返すメソッド
+
+        総当たりのループと同じ順序で力を与えるために、添字の昇順に並べ替えて返す。
+        """
+        self.update(plist)
+        index = {p: i for i, p in enumerate(plist)}
+        cells = self.cells
+        pairs = []
+        for (cx, cy), members in cells.items():
+            own = [index[p] for p in members]
+            for dx, dy in self.NEIGHBOR_OFFSETS:
+                if dx == 0 and dy == 0:
+                    for a in range(len(own)):
+                        for b in range(a + 1, len(own)):
+                            i, j = own[a], own[b]
+                            pairs.append((i, j) if i < j else (j, i))
+                    continue
+                neighbor = cells.get((cx + dx, cy + dy))
+                if neighbor is None:
+                    continue
+                for p in neighbor:
+                    j = index[p]
+                    for i in own:
+                        pairs.append((i, j) if i < j else (j, i))
+        pairs.sort()
+        return pairs
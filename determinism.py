@@ -0,0 +1,101 @@
+"""決定的モードのシミュレーションの状態を、正規化したバイト列とハッシュで比べるためのモジュール
+
+Simulator(deterministic=True) は、actor_list の並びによらず決まった順序で1tickを進め、
+ポケットに落ちた球を tick の最後にまとめて取り除く。そのうえで、tickごとに
+  ハッシュ[t] = blake2b(ハッシュ[t-1] + canonical_state(t))
+を計算するので、2つの実行 (クライアントとサーバーなど) はハッシュを比べるだけで
+その tick までの全ての状態が一致しているかを確かめられる。
+
+使い方 (ブレイクショットを各エンジンで実行し、ハッシュを比べる):
+    python determinism.py
+"""
+import hashlib
+import struct
+
+DIGEST_SIZE = 16
+
+# 球ごと: 番号, pos_real, vel_real, angle, angular_velocity, total_force, angular_acceleration
+BALL_STATE_FORMAT = struct.Struct("<i9d")
+# ポケットごと: 得点, 手玉が落ちたか, 手玉以外が全て落ちたか
+POCKET_STATE_FORMAT = struct.Struct("<iBB")
+TICK_FORMAT = struct.Struct("<Q")
+
+
+def canonical_state(sim):
+    """シミュレーションの状態を、比較に使う正規化したバイト列にする関数
+
+    球は番号の順に並べ、-0.0 は 0.0 にそろえる (x + 0.0)。ポケットは actor_list の順。
+    """
+    parts = [TICK_FORMAT.pack(sim.tick_count)]
+    for b in sorted(sim.balls(), key=lambda b: b.number):
+        pos, vel, force = b.pos_real, b.vel_real, b.total_force
+        parts.append(BALL_STATE_FORMAT.pack(
+            b.number, pos.x + 0.0, pos.y + 0.0, vel.x + 0.0, vel.y + 0.0, b.angle + 0.0,
+            b.angular_velocity + 0.0, force.x + 0.0, force.y + 0.0, b.angular_acceleration + 0.0))
+    for p in sim.pockets:
+        parts.append(POCKET_STATE_FORMAT.pack(p.score, p.cue_ball_fell, p.all_balls_fell_except_cue))
+    return b"".join(parts)
+
+
+def chain_hash(previous, state):
+    """直前の tick のハッシュと現在の状態から、現在の tick のハッシュを作る関数"""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    if previous is not None:
+        h.update(previous)
+    h.update(state)
+    return h.digest()
+
+
+def trajectory_hashes(snapshot, force, contact_point=None, ticks=None, **options):
+    """盤面にショットを1回行い、tickごとのハッシュのリストを返す関数 (先頭はショット前の盤面)
+
+    ticks を省略した場合は、球が止まるかゲームが終わるまで進める。options は Simulator に渡す。
+    """
+    import simulator
+    sim = simulator.Simulator(snapshot=snapshot, deterministic=True, **options)
+    sim.shoot(force, contact_point)
+    hashes = [sim.state_hash]
+    while True:
+        sim.step()
+        hashes.append(sim.state_hash)
+        if ticks is None:
+            if sim.game_rule.game_over or sim.are_balls_stopped():
+                break
+        elif sim.tick_count >= ticks:
+            break
+    return hashes
+
+
+def first_divergence(hashes, expected):
+    """2つのハッシュの列が最初に食い違う tick を返す関数 (長さだけが違う場合は短い方の長さ、一致すれば None)"""
+    for tick, (a, b) in enumerate(zip(hashes, expected)):
+        if a != b:
+            return tick
+    if len(hashes) != len(expected):
+        return min(len(hashes), len(expected))
+    return None
+
+
+def main():
+    import simulator
+    snapshot = simulator.Simulator().snapshot()
+    force = simulator.force_from_drag((300, 300), (0, 302))
+    reference = trajectory_hashes(snapshot, force, (0.01, 0))
+    print(f"object: {len(reference) - 1} ticks, final hash {reference[-1].hex()}")
+    runs = {
+        "object (again)": {},
+        "broadphase": {"broadphase": True},
+        "numpy": {"engine": "numpy"},
+    }
+    for name, options in runs.items():
+        try:
+            hashes = trajectory_hashes(snapshot, force, (0.01, 0), **options)
+        except ImportError as e:
+            print(f"{name}: skipped ({e})")
+            continue
+        tick = first_divergence(hashes, reference)
+        print(f"{name}: " + ("identical" if tick is None else f"diverges at tick {tick}"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""衝突の時刻を計算して、次の衝突まで一気に時間を進めるシミュレーション (イベント駆動) のモジュール
+
+World.dt ごとに進める方法では、めり込んでから衝突を検出するので、速いショットでは dt を小さくする必要がある。
+ここでは compute_friction による一定の減速のもとで球の位置を時刻の2次式として表し、
+球同士・球と壁・球とポケットが接する時刻を方程式を解いて求め、その時刻まで直接進める。
+予定されている衝突は優先度付きキューで管理し、運動が変わった球に関係する予定だけを無効にする。
+
+接触の判定は固定ステップの場合と同じく、ピクセル座標系の radius_for_draw と Boundary・Pocket の位置を使う。
+衝突の際の速度変化も compute_impact_force_between_points と Numbermass.receive_force_while_moving の
+力に dt をかけたもの (力積) を使う。
+
+使い方 (固定ステップの場合と結果・ステップ数を比べる):
+    python eventengine.py
+"""
+import heapq
+import math
+import time
+
+import pygame
+
+import batcheval
+import billiard
+import simulator
+import tableconfig
+
+PgVector = pygame.math.Vector2
+
+BALL = 0
+CUSHION = 1
+POCKET = 2
+
+
+def _poly_eval(c, x):
+    """係数が低次から並んだ多項式の値を求める関数"""
+    result = 0.0
+    for coefficient in reversed(c):
+        result = result * x + coefficient
+    return result
+
+
+def _real_roots(c, lo, hi):
+    """区間 [lo, hi] にある多項式の実数解を昇順で返す関数
+
+    導関数の解で区間を単調な部分に分け、符号が変わる部分を二分法で解く。
+    4次式までを想定している。
+    """
+    c = list(c)
+    while c and c[-1] == 0:
+        c.pop()
+    degree = len(c) - 1
+    if degree <= 0:
+        return []
+    if degree == 1:
+        root = -c[0] / c[1]
+        return [root] if lo <= root <= hi else []
+    derivative = [i * c[i] for i in range(1, len(c))]
+    points = [lo] + _real_roots(derivative, lo, hi) + [hi]
+    roots = []
+    for a, b in zip(points, points[1:]):
+        fa, fb = _poly_eval(c, a), _poly_eval(c, b)
+        if fa == 0:
+            if not roots or roots[-1] != a:
+                roots.append(a)
+            continue
+        if fa * fb > 0:
+            continue
+        for _ in range(100):
+            m = (a + b) / 2
+            if m == a or m == b:
+                break
+            fm = _poly_eval(c, m)
+            if fa * fm <= 0:
+                b = m
+            else:
+                a, fa = m, fm
+        roots.append(b)
+    return roots
+
+
+def _first_entry(c, hi):
+    """多項式が正から0以下に変わる最初の時刻 [0, hi] を返す関数 (無ければ None)"""
+    if _poly_eval(c, 0.0) <= 0 and (len(c) < 2 or c[1] < 0):
+        return 0.0
+    for root in _real_roots(c, 0.0, hi):
+        # 接している状態から離れていく場合は除き、値が減りながら0を通る時刻だけを採る
+        slope = _poly_eval([i * c[i] for i in range(1, len(c))], root)
+        if slope < 0 or (slope == 0 and _poly_eval(c, min(hi, root + 1e-9)) < 0):
+            return root
+    return None
+
+
+class BallMotion:
+    """摩擦による一定の減速のもとで直線上を動く球の運動を表すクラス
+
+    時刻 t_ref の位置・速度から、t_ref <= t <= t_stop の間は位置を時刻の2次式で表し、
+    t_stop 以降は止まっているものとする。長さの単位は Numbermass.pos_real と同じメートル。
+    """
+    def __init__(self, index, state, contact_radius, deceleration, world):
+        self.index = index
+        self.number = state.number
+        self.mass = state.mass
+        self.radius = state.radius
+        self.restitution = state.restitution
+        self.moment_of_inertia = (2 / 5) * self.mass * (self.radius ** 2)
+        self.angular_damping = 0.98
+        self.contact_radius = contact_radius
+        self.deceleration = deceleration
+        self.world = world
+        self.alive = True
+        self.version = 0
+        self.angle = state.angle
+        self.set_state(0.0, state.pos, state.vel, state.angular_velocity)
+
+    def set_state(self, t, pos, vel, angular_velocity):
+        self.t_ref = t
+        self.px, self.py = pos
+        self.vx, self.vy = vel
+        self.angular_velocity_ref = angular_velocity
+        speed = math.sqrt(self.vx * self.vx + self.vy * self.vy)
+        if speed > 0:
+            self.ux, self.uy = self.vx / speed, self.vy / speed
+            self.t_stop = t + speed / self.deceleration
+        else:
+            self.ux = self.uy = 0.0
+            self.t_stop = t
+        self.version += 1
+
+    def is_moving(self, t):
+        return t < self.t_stop
+
+    def coefficients(self, t):
+        """時刻 t からの経過時間 s について、位置を a + b*s + c*s^2 で表す係数を返すメソッド"""
+        tau = min(t, self.t_stop) - self.t_ref
+        half_a = self.deceleration / 2
+        x = self.px + self.vx * tau - half_a * self.ux * tau * tau
+        y = self.py + self.vy * tau - half_a * self.uy * tau * tau
+        if t >= self.t_stop:
+            return (x, y), (0.0, 0.0), (0.0, 0.0)
+        vx = self.vx - self.deceleration * self.ux * tau
+        vy = self.vy - self.deceleration * self.uy * tau
+        return (x, y), (vx, vy), (-half_a * self.ux, -half_a * self.uy)
+
+    def position(self, t):
+        return self.coefficients(t)[0]
+
+    def velocity(self, t):
+        return self.coefficients(t)[1]
+
+    def travel(self, t):
+        """時刻 t から止まるまでに進む距離"""
+        vx, vy = self.velocity(t)
+        return (vx * vx + vy * vy) / (2 * self.deceleration)
+
+    def angular_velocity(self, t):
+        """Numbermass.move と同じく、dt ごとに angular_damping 倍になるとした角速度"""
+        if t >= self.t_stop and self.t_stop > self.t_ref:
+            t = self.t_stop
+        return self.angular_velocity_ref * self.angular_damping ** ((t - self.t_ref) / self.world.dt)
+
+
+class EventSimulator:
+    """TableSnapshot の盤面から、衝突の時刻ごとに進めてショットをシミュレーションするクラス
+
+    壁の位置・球の接触の半径・縮尺は table (台の設定の名前か tableconfig.TableSpec。省略すると snapshot.table) から取る。
+    """
+    def __init__(self, snapshot, pockets_data=None, table=None):
+        if not isinstance(table, tableconfig.TableSpec):
+            table = tableconfig.load(table or snapshot.table)
+        table = tableconfig.for_size(table, tuple(snapshot.size))
+        self.world = billiard.World(snapshot.size, snapshot.dt, snapshot.friction, snapshot.grav_acc,
+                                    scale=table.scale)
+        scale = table.scale
+        radius = table.ball.draw_radius
+        deceleration = self.world.grav_acc.magnitude() * self.world.friction  # compute_friction の力 / 質量
+        # 接触の判定は固定ステップの場合と同じく radius_for_draw (ピクセル) を使う
+        self.balls = [BallMotion(i, state, radius / scale, deceleration, self.world)
+                      for i, state in enumerate(snapshot.balls)]
+
+        # 壁: 法線 n に対して n・pos_real がこの値に達したら接触する (Boundary.generate_force と同じ判定)
+        self.cushions = []
+        for cushion in table.cushions:
+            if cushion.skip:
+                continue
+            normal, point = cushion.normal, cushion.point
+            limit = (normal[0] * point[0] + normal[1] * point[1] - radius) / scale
+            self.cushions.append((normal, limit))
+
+        self.pockets = [((p.centerpos[0] / scale, p.centerpos[1] / scale), p.radius / scale) for p in snapshot.pockets]
+        self.pocket_scores = [p.score for p in snapshot.pockets]
+        self.cue_ball_fell = False
+        self.all_balls_fell_except_cue = False
+
+        self.time = 0.0
+        self.queue = []
+        self.sequence = 0
+        self.events_processed = 0
+        self.events_discarded = 0
+
+    def shoot(self, force, contact_point=None):
+        """AppMain.apply_force と同じく手玉に力を加える
+
+        固定ステップでは力は次の1tickの間だけ働くので、速度変化は force * dt / mass になる。
+        """
+        cue = self.balls[0]
+        dt = self.world.dt
+        force = PgVector(force)
+        vx, vy = cue.velocity(self.time)
+        vel = (vx + force.x / cue.mass * dt, vy + force.y / cue.mass * dt)
+        angular_velocity = cue.angular_velocity(self.time)
+        if contact_point:
+            torque = force.magnitude() * contact_point[0]
+            angular_velocity = (angular_velocity + torque / cue.moment_of_inertia * dt) * cue.angular_damping
+        cue.set_state(self.time, cue.position(self.time), vel, angular_velocity)
+
+    def schedule(self, t, kind, i, j=-1):
+        balls = self.balls
+        version_j = balls[j].version if kind == BALL else 0
+        heapq.heappush(self.queue, (t, self.sequence, kind, i, j, balls[i].version, version_j))
+        self.sequence += 1
+
+    def predict_ball_pair(self, b1, b2):
+        t0 = self.time
+        t_end = max(b1.t_stop, b2.t_stop)
+        if t_end <= t0:
+            return
+        distance_sum = b1.contact_radius + b2.contact_radius
+        (x1, y1), (x2, y2) = b1.position(t0), b2.position(t0)
+        if math.hypot(x2 - x1, y2 - y1) - b1.travel(t0) - b2.travel(t0) > distance_sum:
+            return
+        # 一方が止まる時刻で区間を分け、各区間で距離の2乗 - (半径の和)^2 を4次式として解く
+        bounds = sorted({t0, t_end, *(s for s in (b1.t_stop, b2.t_stop) if t0 < s < t_end)})
+        for lo, hi in zip(bounds, bounds[1:]):
+            (a1, v1, c1), (a2, v2, c2) = b1.coefficients(lo), b2.coefficients(lo)
+            da = (a2[0] - a1[0], a2[1] - a1[1])
+            db = (v2[0] - v1[0], v2[1] - v1[1])
+            dc = (c2[0] - c1[0], c2[1] - c1[1])
+            poly = [da[0] * da[0] + da[1] * da[1] - distance_sum * distance_sum,
+                    2 * (da[0] * db[0] + da[1] * db[1]),
+                    db[0] * db[0] + db[1] * db[1] + 2 * (da[0] * dc[0] + da[1] * dc[1]),
+                    2 * (db[0] * dc[0] + db[1] * dc[1]),
+                    dc[0] * dc[0] + dc[1] * dc[1]]
+            s = _first_entry(poly, hi - lo)
+            if s is not None:
+                self.schedule(lo + s, BALL, b1.index, b2.index)
+                return
+
+    def predict_cushions(self, ball):
+        t0 = self.time
+        if not ball.is_moving(t0):
+            return
+        a, v, c = ball.coefficients(t0)
+        duration = ball.t_stop - t0
+        best = None
+        for k, (normal, limit) in enumerate(self.cushions):
+            # 壁に向かって進みながら n・pos = limit となる時刻 (2次式)
+            poly = [limit - (normal[0] * a[0] + normal[1] * a[1]),
+                    -(normal[0] * v[0] + normal[1] * v[1]),
+                    -(normal[0] * c[0] + normal[1] * c[1])]
+            s = _first_entry(poly, duration)
+            if s is not None and (best is None or s < best[0]):
+                best = (s, k)
+        if best is not None:
+            self.schedule(t0 + best[0], CUSHION, ball.index, best[1])
+
+    def predict_pockets(self, ball):
+        t0 = self.time
+        if not ball.is_moving(t0):
+            return
+        a, v, c = ball.coefficients(t0)
+        duration = ball.t_stop - t0
+        reach = ball.travel(t0)
+        best = None
+        for k, ((cx, cy), radius) in enumerate(self.pockets):
+            da = (a[0] - cx, a[1] - cy)
+            if math.hypot(*da) - reach >= radius:
+                continue
+            poly = [da[0] * da[0] + da[1] * da[1] - radius * radius,
+                    2 * (da[0] * v[0] + da[1] * v[1]),
+                    v[0] * v[0] + v[1] * v[1] + 2 * (da[0] * c[0] + da[1] * c[1]),
+                    2 * (v[0] * c[0] + v[1] * c[1]),
+                    c[0] * c[0] + c[1] * c[1]]
+            s = _first_entry(poly, duration)
+            if s is not None and (best is None or s < best[0]):
+                best = (s, k)
+        if best is not None:
+            self.schedule(t0 + best[0], POCKET, ball.index, best[1])
+
+    def predict(self, ball, others=True):
+        """ball に関係する次の衝突を予定に加えるメソッド"""
+        self.predict_cushions(ball)
+        self.predict_pockets(ball)
+        if others:
+            for other in self.balls:
+                if other is not ball and other.alive:
+                    self.predict_ball_pair(*sorted((ball, other), key=lambda b: b.index))
+
+    def collide_balls(self, b1, b2):
+        """compute_impact_force_between_points と receive_force_while_moving の力積で速度を変えるメソッド"""
+        t, dt = self.time, self.world.dt
+        (x1, y1), (x2, y2) = b1.position(t), b2.position(t)
+        distance = math.hypot(x2 - x1, y2 - y1)
+        if distance == 0:
+            return False
+        normal = PgVector(x2 - x1, y2 - y1) / distance
+        vel1, vel2 = PgVector(b1.velocity(t)), PgVector(b2.velocity(t))
+        v1, v2 = vel1.dot(normal), vel2.dot(normal)
+        if v1 < v2:
+            return False
+        e = b1.restitution * b2.restitution
+        impulse = normal * (-(e + 1) * v1 + (e + 1) * v2) / (1 / b1.mass + 1 / b2.mass)  # f1 * dt
+        w1, w2 = b1.angular_velocity(t), b2.angular_velocity(t)
+        relative_angular_vel = w1 - w2
+        compare_value = 1 if w1 > w2 else -1
+        new_state = []
+        for ball, vel, w, j in ((b1, vel1, w1, impulse), (b2, vel2, w2, -impulse)):
+            vel = vel + j / ball.mass
+            friction_f_length = 5*ball.mass*ball.radius*abs(relative_angular_vel)/(7*(1-ball.restitution)*dt) * (3.14/180)
+            torque = -friction_f_length * ball.radius * compare_value
+            w = w + torque / ball.moment_of_inertia * dt
+            if not friction_f_length < 2.5 and j.length() > 0:
+                vel = vel - j.rotate(90).normalize() * friction_f_length * compare_value * dt / ball.mass
+            new_state.append((ball, vel, w))
+        for ball, vel, w in new_state:
+            ball.set_state(t, ball.position(t), (vel.x, vel.y), w)
+        return True
+
+    def bounce(self, ball, cushion):
+        """compute_impact_force_by_fixture の力積で、壁に垂直な速度を -restitution 倍にするメソッド"""
+        t = self.time
+        normal, _ = self.cushions[cushion]
+        vx, vy = ball.velocity(t)
+        v = normal[0] * vx + normal[1] * vy
+        if v <= 0:
+            return False
+        e = ball.restitution
+        vel = (vx - (e + 1) * v * normal[0], vy - (e + 1) * v * normal[1])
+        ball.set_state(t, ball.position(t), vel, ball.angular_velocity(t))
+        return True
+
+    def drop(self, ball, pocket):
+        """Pocket.drop_the_ball と同じ規則で得点と終了条件を管理するメソッド"""
+        ball.alive = False
+        ball.set_state(self.time, ball.position(self.time), (0.0, 0.0), 0.0)
+        remaining = [b for b in self.balls if b.alive]
+        if ball.index == 0:
+            self.cue_ball_fell = True
+        elif len(remaining) == 1 and remaining[0].index == 0:
+            self.pocket_scores[pocket] += ball.number
+            self.all_balls_fell_except_cue = True
+        else:
+            self.pocket_scores[pocket] += ball.number
+
+    def run(self, max_events=100000):
+        """予定が無くなるか、ゲームが終わるまで衝突を順に処理するメソッド。処理したイベント数を返す"""
+        for k, ball in enumerate(self.balls):
+            self.predict_cushions(ball)
+            self.predict_pockets(ball)
+            for other in self.balls[k + 1:]:
+                self.predict_ball_pair(ball, other)
+
+        balls = self.balls
+        while self.queue and self.events_processed < max_events:
+            t, _, kind, i, j, version_i, version_j = heapq.heappop(self.queue)
+            b1 = balls[i]
+            if not b1.alive or b1.version != version_i or (kind == BALL and (not balls[j].alive or balls[j].version != version_j)):
+                self.events_discarded += 1
+                continue
+            self.time = t
+            self.events_processed += 1
+            if kind == BALL:
+                b2 = balls[j]
+                if self.collide_balls(b1, b2):
+                    self.predict(b1)
+                    self.predict(b2)
+            elif kind == CUSHION:
+                if self.bounce(b1, j):
+                    self.predict(b1)
+            else:
+                self.drop(b1, j)
+                if self.cue_ball_fell or self.all_balls_fell_except_cue:
+                    break
+        self.time = max([self.time] + [b.t_stop for b in balls if b.alive])
+        return self.events_processed
+
+    def final_positions(self):
+        """止まった後の位置を (番号, x, y) のピクセル座標で返すメソッド"""
+        return tuple((b.number, *(c * self.world.scale for c in b.position(self.time))) for b in self.balls if b.alive)
+
+
+def simulate_shot(snapshot, candidate, max_events=100000):
+    """batcheval.simulate_shot のイベント駆動版。ShotResult.ticks には処理したイベント数が入る"""
+    sim = EventSimulator(snapshot)
+    force = PgVector(candidate.direction)
+    if force.length() > 0:
+        force.scale_to_length(candidate.magnitude)
+    sim.shoot(force, candidate.contact_point)
+    events = sim.run(max_events)
+    pocketed = tuple(sorted(b.number for b in sim.balls if not b.alive))
+    pocket_scores = tuple(score - p.score for score, p in zip(sim.pocket_scores, snapshot.pockets))
+    return batcheval.ShotResult(
+        candidate=candidate,
+        pocketed=pocketed,
+        pocket_scores=pocket_scores,
+        score=sum(pocket_scores),
+        cue_ball_fell=sim.cue_ball_fell,
+        final_positions=sim.final_positions(),
+        ticks=events,
+    )
+
+
+def compare(snapshot, candidate):
+    """同じショットを固定ステップとイベント駆動で計算し、ステップ数・時間・結果の違いを返す関数"""
+    start = time.perf_counter()
+    fixed = batcheval.simulate_shot(snapshot, candidate)
+    fixed_time = time.perf_counter() - start
+    start = time.perf_counter()
+    event = simulate_shot(snapshot, candidate)
+    event_time = time.perf_counter() - start
+
+    positions = {n: (x, y) for n, x, y in event.final_positions}
+    max_difference = max((math.hypot(x - positions[n][0], y - positions[n][1])
+                          for n, x, y in fixed.final_positions if n in positions), default=0.0)
+    return {
+        "fixed_steps": fixed.ticks,
+        "event_steps": event.ticks,
+        "fixed_time": fixed_time,
+        "event_time": event_time,
+        "same_pocketed": fixed.pocketed == event.pocketed,
+        "same_cue_ball_fell": fixed.cue_ball_fell == event.cue_ball_fell,
+        "max_position_difference": max_difference,  # ピクセル
+    }
+
+
+def main():
+    snapshot = simulator.Simulator().snapshot()
+    shots = [
+        batcheval.candidate_from_drag((300, 300), (0, 300)),     # 真っすぐブレイク
+        batcheval.candidate_from_drag((300, 300), (100, 250)),
+        batcheval.candidate_from_drag((300, 300), (300, 600)),   # 壁に向かって
+        batcheval.candidate_from_drag((300, 300), (600, 0)),
+        batcheval.candidate_from_drag((300, 300), (200, 300)),   # 弱いショット
+    ]
+    print(f"{'shot':>4} {'fixed steps':>11} {'events':>6} {'ratio':>6} {'fixed ms':>8} {'event ms':>8} "
+          f"{'same pocketed':>13} {'max diff px':>11}")
+    for n, candidate in enumerate(shots):
+        r = compare(snapshot, candidate)
+        ratio = r["fixed_steps"] / max(r["event_steps"], 1)
+        print(f"{n:>4} {r['fixed_steps']:>11} {r['event_steps']:>6} {ratio:>5.0f}x {r['fixed_time'] * 1e3:>8.1f} "
+              f"{r['event_time'] * 1e3:>8.1f} {str(r['same_pocketed'] and r['same_cue_ball_fell']):>13} "
+              f"{r['max_position_difference']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,24 @@
-import pygame
-
 class Gamerule:
     def __init__(self, pockets):
         self.pockets = pockets
         self.game_over = False
-        self.font = pygame.font.Font(None, 50)
-    
-    def update(self):
-        for pocket in self.pockets:
-            pocket.update()
-            if pocket.cue_ball_fell:
-                self.message = """Cue Ball Fell! Game Over!\nGame ends in 5 sec"""
-                self.game_over = True
-                return
-            elif pocket.all_balls_fell_except_cue:
-                self.message = """All Balls Fell! Good Job!\nGame ends in 5 sec"""
-                self.game_over = True
-                return
+        # ポケットを毎tick調べ直す代わりに、球が落ちたときに知らせてもらう
+        for pocket in pockets:
+            pocket.listeners.append(self.on_ball_dropped)
+
+    def on_ball_dropped(self, pocket, actor):
+        if self.game_over:
+            return  # 最初に決まった結果 (message と telemetry の game_end) を変えない
+        if pocket.cue_ball_fell:
+            self.message = """Cue Ball Fell! Game Over!\nGame ends in 5 sec"""
+        elif pocket.all_balls_fell_except_cue:
+            self.message = """All Balls Fell! Good Job!\nGame ends in 5 sec"""
+        else:
+            return
+        self.game_over = True
+        telemetry = pocket.world.telemetry
+        if telemetry is not None:
+            telemetry.game_end(self.message.split("\n")[0])
 
     def transmit_message(self):
-        return self.message
\ No newline at end of file
+        return self.message
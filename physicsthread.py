@@ -0,0 +1,111 @@
+"""物理の計算を描画と入力のループから切り離して、別スレッドで進めるためのモジュール
+
+PhysicsThread は AppMain.scheduler で実時間に合わせて物理を進め、進めるたびに描画に必要な情報を
+Frame (変更しない namedtuple) にまとめて frame 属性に入れ替える。描画のスレッドは frame を読むだけで、
+Simulator や actor_list には触れないので、ロックは使わない (属性の入れ替えは不可分に行われる)。
+入力による操作 (手玉を突くなど) は submit で関数として渡し、物理のスレッドが tick の合間に実行する。
+操作や tick の途中で例外が起きた場合は error に入れてスレッドを止める (AppMain.run はそれを見て終了し、例外を送出する)。
+"""
+import collections
+import queue
+import threading
+import time
+
+import renderer
+
+# tick: 最後に進めた tick。published: 作った時刻 (perf_counter)。alpha: その時点での補間の割合
+# sprites: 最後の tick の球 (BallSprite のタプル)。previous: その1つ前の tick の位置 {番号: (x, y)}
+# score: ポケットの得点の合計。balls_stopped: 全ての球が止まっているか。cue_pos: 手玉の位置 (無ければ None)
+Frame = collections.namedtuple("Frame", ["tick", "published", "alpha", "sprites", "previous", "score",
+                                         "balls_stopped", "cue_pos", "game_over", "message"])
+
+
+def interpolated_sprites(frame, now, dt_real):
+    """frame の球を、作られてから now までに進んだ分だけ補間した BallSprite のリストを返す関数
+
+    dt_real は1tickにあたる実時間 (World.dt / World.time_scale)。補間の割合は 1 を超えない。
+    """
+    alpha = min(frame.alpha + (now - frame.published) / dt_real, 1.0)
+    previous = frame.previous
+    sprites = []
+    for s in frame.sprites:
+        p = previous.get(s.number)
+        if p is not None:
+            s = s._replace(x=p[0] + (s.x - p[0]) * alpha, y=p[1] + (s.y - p[1]) * alpha)
+        sprites.append(s)
+    return sprites
+
+
+class PhysicsThread(threading.Thread):
+    """AppMain の物理を、描画と入力のループとは別に進めるスレッド
+
+    1回のループで、たまった操作を実行し、scheduler.advance で実時間の分だけ進め、Frame を作る。
+    処理が追いつかない場合でも scheduler の max_substeps で1回の量が決まっているので、
+    描画と入力のスレッドは長く待たされない。
+    """
+    def __init__(self, app, clock):
+        super().__init__(name="physics", daemon=True)
+        self.app = app
+        self.clock = clock
+        self.commands = queue.SimpleQueue()
+        self.running = True
+        self.error = None  # 物理のスレッドで起きた例外 (起きた場合はスレッドを止め、描画のスレッドが確かめる)
+        self.frame = None
+        self.publish()
+
+    def submit(self, command):
+        """物理のスレッドで実行する関数を渡すメソッド (次のループの最初に実行される)"""
+        self.commands.put(command)
+
+    def publish(self):
+        app = self.app
+        simulator = app.simulator
+        balls = simulator.balls()
+        self.frame = Frame(
+            tick=simulator.tick_count,
+            published=self.clock(),
+            alpha=app.scheduler.alpha,
+            sprites=tuple(renderer.sprite_states(balls)),
+            previous=app.scheduler.previous,
+            score=sum(p.score for p in simulator.pockets),
+            balls_stopped=simulator.are_balls_stopped(),
+            cue_pos=(balls[0].pos_draw.x, balls[0].pos_draw.y) if balls else None,
+            game_over=app.game_rule.game_over,
+            message=app.game_rule.message if app.game_rule.game_over else None,
+        )
+
+    def run(self):
+        try:
+            self.loop()
+        except Exception as error:
+            self.error = error
+            self.running = False
+
+    def loop(self):
+        app = self.app
+        world = app.world
+        last = self.clock()
+        while self.running:
+            while True:
+                try:
+                    command = self.commands.get_nowait()
+                except queue.Empty:
+                    break
+                command()
+            now = self.clock()
+            if not app.game_rule.game_over:
+                profiler = app.profiler
+                app.scheduler.advance(now - last)
+                if profiler:
+                    profiler.record("physics", now, self.clock(), "frame")
+                app.request_hint()
+            last = now
+            self.publish()
+            # 次の tick の時刻まで待つ (待つ間は描画のスレッドが動く)
+            wait = world.dt / world.time_scale - (self.clock() - now)
+            if wait > 0:
+                time.sleep(wait)
+
+    def stop(self):
+        self.running = False
+        self.join()
@@ -0,0 +1,250 @@
+"""1tickの各処理と描画の時間を計測するためのモジュール (使う場合だけ有効にする)
+
+Simulator.profiler が None の間は何もしない (step で1回 None かどうかを調べるだけ)。
+Profiler.attach(simulator) で有効にすると
+  - actor の種類 (Numbermass, CollisionResolver, ContactPhase など) ごとの1tickの時間
+  - CollisionResolver が調べた球のペアの数と、実際に衝突していたペアの数
+  - 1tickで確保したメモリ (track_allocations=True の場合。tracemalloc を使うので遅くなり、計測自体の確保も含む)
+を記録し、AppMain の描画の各段階の時間も lap で記録できる。
+値は直近 window 回分を RollingHistogram に保持する。trace=True の場合は、Chrome の trace viewer
+(chrome://tracing や Perfetto) で開ける JSON を write_trace で書き出せる。trace の区間は記録したスレッドごとの
+トラック (tid) に分ける (PhysicsThread を使う場合、物理のスレッドと描画のスレッドの両方が同じ Profiler に記録する)。
+"""
+import collections
+import json
+import threading
+import time
+import tracemalloc
+
+import billiard
+
+
+class RollingHistogram:
+    """直近 size 個の値を保持し、平均やパーセンタイルを求めるクラス"""
+    def __init__(self, size=600):
+        self.samples = collections.deque(maxlen=size)
+        self.count = 0  # これまでに加えた値の数 (捨てた値も含む)
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return 0.0
+        values = sorted(self.samples)
+        return values[min(len(values) - 1, int(fraction * len(values)))]
+
+    def summary(self):
+        if not self.samples:
+            return {"count": 0, "mean": 0.0, "p50": 0.0, "p99": 0.0, "max": 0.0}
+        values = sorted(self.samples)
+        n = len(values)
+        return {"count": n, "mean": sum(values) / n, "p50": values[n // 2],
+                "p99": values[min(n - 1, int(0.99 * n))], "max": values[-1]}
+
+    def bucket_counts(self, edges):
+        """edges で区切った区間ごとの値の数を返すメソッド (最後の要素は edges[-1] 以上の数)"""
+        counts = [0] * (len(edges) + 1)
+        for value in self.samples:
+            k = 0
+            while k < len(edges) and value >= edges[k]:
+                k += 1
+            counts[k] += 1
+        return counts
+
+
+class Profiler:
+    """Simulator と AppMain の処理時間を計測するクラス
+
+    時間の値は秒で記録する (表示では ms にする)。
+    """
+    clock = staticmethod(time.perf_counter)
+
+    def __init__(self, window=600, trace=False, max_trace_events=200000, track_allocations=False):
+        self.window = window
+        self.histograms = {}
+        self.origin = self.clock()
+        self.trace_events = collections.deque(maxlen=max_trace_events) if trace else None
+        self.trace_lock = threading.Lock()
+        self.thread_ids = {}  # threading.get_ident() -> trace の tid (0 から順に割り当てる)
+        self.thread_names = {}  # tid -> スレッドの名前
+        self.track_allocations = track_allocations
+        self.tick_totals = {}
+        self.tick_start = 0.0
+        self.lap_time = 0.0
+        self.pairs_tested = 0
+        self.pairs_hit = 0
+        self.memory_before = 0
+        self.ticks = 0
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = RollingHistogram(self.window)
+        return histogram
+
+    def attach(self, sim):
+        """sim の step で計測を行うようにするメソッド"""
+        sim.profiler = self
+        for a in sim.actor_list:
+            if isinstance(a, billiard.CollisionResolver):
+                self.count_pairs(a)
+        if self.track_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def detach(self, sim):
+        sim.profiler = None
+        for a in sim.actor_list:
+            if isinstance(a, billiard.CollisionResolver):
+                a.__dict__.pop("resolve_pair", None)
+
+    def count_pairs(self, resolver):
+        """resolver の resolve_pair を、調べたペアと衝突したペアを数えるものに差し替えるメソッド
+
+        インスタンスの属性として差し替えるので、計測しない resolver には何の負担もない。
+        """
+        resolve_pair = resolver.resolve_pair
+
+        def counted_resolve_pair(p1, p2):
+            self.pairs_tested += 1
+            if resolve_pair(p1, p2):
+                self.pairs_hit += 1
+                return True
+            return False
+        resolver.resolve_pair = counted_resolve_pair
+
+    def record(self, name, start, end, category="physics"):
+        """start から end までの時間を name として記録するメソッド"""
+        self.histogram(name).add(end - start)
+        if self.trace_events is not None:
+            self.trace({"name": name, "cat": category, "ph": "X", "pid": 0,
+                        "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+
+    def trace(self, event):
+        """event に呼び出したスレッドの tid を付けて trace_events に加えるメソッド"""
+        ident = threading.get_ident()
+        with self.trace_lock:
+            tid = self.thread_ids.get(ident)
+            if tid is None:
+                tid = self.thread_ids[ident] = len(self.thread_ids)
+                self.thread_names[tid] = threading.current_thread().name
+            event["tid"] = tid
+            self.trace_events.append(event)
+
+    def begin_tick(self):
+        self.tick_totals.clear()
+        self.pairs_tested = 0
+        self.pairs_hit = 0
+        if self.track_allocations:
+            self.memory_before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+        self.tick_start = self.clock()
+
+    def update_actors(self, actors):
+        """actors を順に更新し、種類ごとの時間を合計するメソッド (Simulator.update_actors から呼ばれる)
+
+        trace には、同じ種類の actor が続く区間を1つの区間として書く。
+        """
+        clock = self.clock
+        totals = self.tick_totals
+        run_name = None
+        run_start = 0.0
+        end = clock()
+        for a in actors:
+            name = type(a).__name__
+            if name != run_name:
+                if run_name is not None:
+                    self.trace_run(run_name, run_start, end)
+                run_name, run_start = name, end
+            start = end
+            a.update()
+            end = clock()
+            totals[name] = totals.get(name, 0.0) + (end - start)
+        if run_name is not None:
+            self.trace_run(run_name, run_start, end)
+
+    def trace_run(self, name, start, end):
+        if self.trace_events is not None:
+            self.trace({"name": name, "cat": "actors", "ph": "X", "pid": 0,
+                        "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6})
+
+    def end_tick(self):
+        end = self.clock()
+        if self.track_allocations:
+            # 記録のための確保を含めないように、先にメモリの量を調べる
+            current, peak = tracemalloc.get_traced_memory()
+        self.record("tick", self.tick_start, end)
+        for name, total in self.tick_totals.items():
+            self.histogram(name).add(total)
+        self.histogram("pairs_tested").add(self.pairs_tested)
+        self.histogram("pairs_hit").add(self.pairs_hit)
+        if self.track_allocations:
+            self.histogram("alloc_bytes").add(peak - self.memory_before)
+            self.histogram("growth_bytes").add(current - self.memory_before)
+        if self.trace_events is not None:
+            self.trace({"name": "pairs", "ph": "C", "pid": 0,
+                        "ts": (end - self.origin) * 1e6,
+                        "args": {"tested": self.pairs_tested, "hit": self.pairs_hit}})
+        self.ticks += 1
+
+    def lap_start(self):
+        self.lap_time = self.clock()
+
+    def lap(self, name, category="draw"):
+        """直前の lap_start または lap からの時間を name として記録するメソッド"""
+        now = self.clock()
+        self.record(name, self.lap_time, now, category)
+        self.lap_time = now
+
+    def summary(self):
+        return {name: histogram.summary() for name, histogram in list(self.histograms.items())}
+
+    def overlay_text(self):
+        """画面に表示する1行の要約 (時間は直近の平均と p99、ms)"""
+        parts = []
+        for name in ("tick", "Numbermass", "CollisionResolver", "ContactPhase", "BallTable", "draw"):
+            histogram = self.histograms.get(name)
+            if histogram is not None and histogram.samples:
+                s = histogram.summary()
+                parts.append(f"{name} {s['mean'] * 1e3:.2f}/{s['p99'] * 1e3:.2f}")
+        tested, hit = self.histograms.get("pairs_tested"), self.histograms.get("pairs_hit")
+        if tested is not None and tested.samples:
+            parts.append(f"pairs {tested.samples[-1]}/{hit.samples[-1]}")
+        return "  ".join(parts)
+
+    def write_trace(self, path):
+        """記録した区間を Chrome の trace event 形式の JSON として書き出すメソッド"""
+        with self.trace_lock:
+            events = list(self.trace_events or ())
+            thread_names = dict(self.thread_names)
+        events.append({"name": "process_name", "ph": "M", "pid": 0, "args": {"name": "billiard"}})
+        for tid, name in thread_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 0, "tid": tid, "args": {"name": name}})
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def main():
+    """ブレイクショットを計測し、要約を表示して trace を書き出す"""
+    import os
+    import tempfile
+
+    import simulator
+
+    sim = simulator.Simulator()
+    profiler = Profiler(trace=True, track_allocations=True)
+    profiler.attach(sim)
+    sim.shoot(simulator.force_from_drag((300, 300), (0, 302)), (0.01, 0))
+    sim.run_until_stopped()
+    print(f"{'name':<20} {'mean':>10} {'p50':>10} {'p99':>10} {'max':>10}")
+    for name, s in sorted(profiler.summary().items()):
+        scale, unit = (1e3, "ms") if name not in ("pairs_tested", "pairs_hit", "alloc_bytes", "growth_bytes") else (1, "")
+        print(f"{name:<20} " + " ".join(f"{s[k] * scale:8.3f}{unit:>2}" for k in ("mean", "p50", "p99", "max")))
+    path = os.path.join(tempfile.gettempdir(), "billiard_trace.json")
+    profiler.write_trace(path)
+    print(f"trace: {path} ({len(profiler.trace_events)} events)")
+
+
+if __name__ == "__main__":
+    main()
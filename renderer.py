@@ -0,0 +1,245 @@
+"""AppMain の描画を、変化した部分だけ描き直して行うモジュール
+
+テーブルの背景は1回だけ作っておき、毎フレームは動いた球とキューの線の周りだけを
+背景で消して描き直し、その矩形だけを pygame.display.update に渡す。
+回転した番号の画像は角度を量子化して LRU キャッシュに保持し、得点の画像は得点が変わったときだけ作る。
+"""
+import collections
+
+import pygame
+
+import assets
+import billiard
+
+# 描画に必要な球の情報 (番号, 色, x, y, 角度, 半径)。座標はピクセル
+BallSprite = collections.namedtuple("BallSprite", ["number", "color", "x", "y", "angle", "radius"])
+
+
+def sprite_states(actor_list, previous=None, alpha=1.0):
+    """actor_list の球から BallSprite のリストを作る関数
+
+    previous ({番号: (x, y)}) が与えられた場合は、その位置と現在の位置を alpha の割合で補間する。
+    """
+    sprites = []
+    for a in actor_list:
+        if not billiard.is_number_mass(a):
+            continue
+        x, y = a.pos_draw.x, a.pos_draw.y
+        if previous and a.number in previous:
+            px, py = previous[a.number]
+            x, y = px + (x - px) * alpha, py + (y - py) * alpha
+        sprites.append(BallSprite(a.number, a.color, x, y, a.angle, a.radius_for_draw))
+    return sprites
+
+
+def ball_positions(actor_list):
+    """補間に使う球の位置を {番号: (x, y)} で返す関数"""
+    return {a.number: (a.pos_draw.x, a.pos_draw.y) for a in actor_list if billiard.is_number_mass(a)}
+
+
+class LabelCache:
+    """番号の画像を、量子化した角度ごとに回転させて保持する LRU キャッシュ"""
+    def __init__(self, font, angle_step=6, max_size=512, baked=None):
+        self.font = font
+        self.angle_step = angle_step
+        self.max_size = max_size
+        self.text_surfaces = {}
+        self.rotated = collections.OrderedDict()
+        self.baked = baked or {}  # assets.table_atlas で作っておいた画像 ((番号, 角度の番号) -> Surface、捨てない)
+        self.hits = 0
+        self.misses = 0
+
+    def bucket(self, angle):
+        return int(round(angle / self.angle_step)) % int(360 / self.angle_step)
+
+    def get(self, number, angle):
+        key = (number, self.bucket(angle))
+        surface = self.baked.get(key)
+        if surface is not None:
+            self.hits += 1
+            return surface
+        surface = self.rotated.get(key)
+        if surface is not None:
+            self.rotated.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        text_surface = self.text_surfaces.get(number)
+        if text_surface is None:
+            text_surface = self.font.render(f"{number}", True, pygame.Color("Black"))
+            self.text_surfaces[number] = text_surface
+        surface = pygame.transform.rotate(text_surface, key[1] * self.angle_step)
+        self.rotated[key] = surface
+        if len(self.rotated) > self.max_size:
+            self.rotated.popitem(last=False)
+        return surface
+
+
+class TextLabel:
+    """文字列が変わったときだけ画像を作り直す、画面上の1行の文字"""
+    def __init__(self, font, position, color="White"):
+        self.font = font
+        self.position = position
+        self.color = pygame.Color(color)
+        self.text = None
+        self.surface = None
+        self.rect = pygame.Rect(position, (0, 0))
+        self.changed = False
+
+    def set_text(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        self.surface = self.font.render(text, True, self.color)
+        old_rect = self.rect
+        self.rect = self.surface.get_rect(topleft=self.position)
+        self.rect.union_ip(old_rect)  # 前の文字の方が長い場合も消えるように
+        self.changed = True
+
+    def draw(self, screen, background, restored, full_redraw):
+        """描き直す必要があれば描き、更新した矩形を返すメソッド"""
+        if self.surface is None or not (self.changed or full_redraw or self.rect.collidelist(restored) >= 0):
+            return None
+        screen.blit(background, self.rect, self.rect)
+        screen.blit(self.surface, self.position)
+        self.changed = False
+        return self.rect
+
+
+class TableRenderer:
+    """テーブルの背景をキャッシュし、変化した矩形だけを描き直すクラス
+
+    background (画面と同じ大きさ) と baked_labels を渡した場合は、table_image から背景を作らずにそれを使う
+    (assets.Assets.table_atlas で作ったもの)。ball_radius は予測した手玉の位置を描く円の半径 (ピクセル)。
+    """
+    def __init__(self, screen, table_image=None, font=None, score_font=None, angle_step=6, label_cache_size=512,
+                 background=None, baked_labels=None, ball_radius=14):
+        self.screen = screen
+        self.ball_radius = ball_radius
+        if background is None:
+            background = pygame.Surface(screen.get_size()).convert()
+            background.fill((0, 0, 0))
+            image_width, image_height = table_image.get_width(), table_image.get_height()
+            screen_center = (screen.get_width() // 2, screen.get_height() // 2)
+            background.blit(table_image, (screen_center[0] - image_width // 2, screen_center[1] - image_height // 2))
+        self.background = background
+
+        shared = assets.shared()
+        self.labels = LabelCache(font or shared.font(30), angle_step, label_cache_size, baked_labels)
+        self.score_label = TextLabel(score_font or shared.font(36), (200, 10))
+        self.score = None
+        self.overlay_label = None  # set_overlay を呼んだときに作る (profiler の表示など)
+
+        self.drawn = {}  # 番号 -> (BallSprite, 描画した矩形)
+        self.cue_line_rect = None
+        self.guide_rects = []  # 前のフレームで描いた予測の線の矩形
+        self.full_redraw = True
+
+    def invalidate(self):
+        """次のフレームで画面全体を描き直すようにするメソッド (選択モードの画面を閉じたときなど)"""
+        self.full_redraw = True
+
+    def set_score(self, score):
+        """得点が変わったときだけ得点の画像を作り直すメソッド"""
+        if score == self.score:
+            return
+        self.score = score
+        self.score_label.set_text(f"Total Score: {score}")
+
+    def set_overlay(self, text, font=None):
+        """得点の横に表示する文字列を設定するメソッド。文字列が変わったときだけ描き直す"""
+        if self.overlay_label is None:
+            self.overlay_label = TextLabel(font or assets.shared().font(24), (450, 16), "Yellow")
+        self.overlay_label.set_text(text)
+
+    def needs_redraw(self, old, new):
+        """画面上の見た目が変わるか (整数に丸めた位置・量子化した角度・色) を判定するメソッド"""
+        return ((int(old.x), int(old.y)) != (int(new.x), int(new.y))
+                or self.labels.bucket(old.angle) != self.labels.bucket(new.angle)
+                or old.color != new.color)
+
+    def draw_ball(self, sprite):
+        center = (int(sprite.x), int(sprite.y))
+        rect = pygame.draw.circle(self.screen, sprite.color, center, sprite.radius, 0)
+        label = self.labels.get(sprite.number, sprite.angle)
+        label_rect = label.get_rect(center=center)
+        self.screen.blit(label, label_rect.topleft)
+        return rect.union(label_rect)
+
+    def draw_guide(self, guide):
+        """予測した手玉の道筋・当たるときの手玉の位置・的球の向きを描き、描いた矩形のリストを返すメソッド"""
+        screen = self.screen
+        rects = []
+        if len(guide.path) >= 2:
+            rects.append(pygame.draw.lines(screen, pygame.Color("white"), False, guide.path, 1).inflate(4, 4))
+        if guide.contact is not None:
+            center = (int(guide.contact[0]), int(guide.contact[1]))
+            rects.append(pygame.draw.circle(screen, pygame.Color("white"), center, self.ball_radius, 1).inflate(4, 4))
+        if len(guide.object_path) >= 2:
+            rects.append(pygame.draw.lines(screen, pygame.Color("yellow"), False, guide.object_path, 1).inflate(4, 4))
+        return rects
+
+    def draw(self, balls, cue_line=None, guide=None):
+        """球 (BallSprite のリスト) とキューの線を描き、変化した矩形だけ画面に反映するメソッド
+
+        cue_line は (始点, 終点) か None。guide は aimguide.AimPrediction か None。戻り値は更新した矩形のリスト。
+        """
+        screen = self.screen
+        background = self.background
+        if self.full_redraw:
+            screen.blit(background, (0, 0))
+            self.drawn.clear()
+            self.cue_line_rect = None
+            self.guide_rects = []
+
+        # 動いた球・消えた球・前のフレームのキューの線の跡を背景で消す
+        restored = []
+        moved = set()
+        current = set()
+        for sprite in balls:
+            current.add(sprite.number)
+            previous = self.drawn.get(sprite.number)
+            if previous is None:
+                moved.add(sprite.number)
+            elif self.needs_redraw(previous[0], sprite):
+                moved.add(sprite.number)
+                restored.append(previous[1])
+        for number in [n for n in self.drawn if n not in current]:
+            restored.append(self.drawn.pop(number)[1])
+        if self.cue_line_rect is not None:
+            restored.append(self.cue_line_rect)
+            self.cue_line_rect = None
+        restored.extend(self.guide_rects)
+        self.guide_rects = []
+        for rect in restored:
+            screen.blit(background, rect, rect)
+
+        # 動いた球と、消した矩形に重なる球を actor_list の順に描き直す
+        dirty = list(restored)
+        for sprite in balls:
+            if sprite.number not in moved and self.drawn[sprite.number][1].collidelist(restored) < 0:
+                continue
+            rect = self.draw_ball(sprite)
+            self.drawn[sprite.number] = (sprite, rect)
+            dirty.append(rect)
+
+        if cue_line is not None:
+            self.cue_line_rect = pygame.draw.line(screen, pygame.Color("blue"), cue_line[0], cue_line[1], 3).inflate(4, 4)
+            dirty.append(self.cue_line_rect)
+        if guide is not None:
+            self.guide_rects = self.draw_guide(guide)
+            dirty.extend(self.guide_rects)
+
+        for label in (self.score_label, self.overlay_label):
+            if label is not None:
+                rect = label.draw(screen, background, restored, self.full_redraw)
+                if rect is not None:
+                    dirty.append(rect)
+
+        if self.full_redraw:
+            self.full_redraw = False
+            pygame.display.update()
+            return [screen.get_rect()]
+        if dirty:
+            pygame.display.update(dirty)
+        return dirty
@@ -0,0 +1,47 @@
+"""物理の更新と描画の頻度を切り離すためのモジュール"""
+
+
+class FixedStepScheduler:
+    """実際に経過した時間をためておき、World.dt ごとに物理を進めるクラス
+
+    1フレームで進める時間は 経過時間 * World.time_scale で、これを dt ごとの物理の更新 (substep) に分ける。
+    描画が遅れても物理の時間は遅れないが、1フレームの substep は max_substeps までとし、
+    それを超えた分は捨てる (処理が追いつかずに更新が増え続けるのを防ぐ)。
+    描画では、最後の substep の前後の位置を alpha (0 から 1) で補間して使う。
+    """
+    def __init__(self, world, step, capture, max_substeps=8):
+        self.world = world
+        self.step = step  # 物理を dt だけ進める関数
+        self.capture = capture  # 補間に使う位置を {番号: (x, y)} で返す関数
+        self.max_substeps = max_substeps
+        self.accumulator = 0.0
+        self.previous = {}
+        self.dropped_time = 0.0  # 処理が追いつかずに捨てたシミュレーション時間
+        self.substeps = 0  # 直前のフレームで行った substep の数
+
+    @property
+    def alpha(self):
+        """最後の substep の前後の位置を補間する割合"""
+        return min(self.accumulator / self.world.dt, 1.0)
+
+    def reset(self):
+        self.accumulator = 0.0
+        self.previous = {}
+
+    def advance(self, elapsed):
+        """実時間で elapsed 秒経過した分だけ物理を進め、行った substep の数を返すメソッド"""
+        world = self.world
+        self.accumulator += elapsed * world.time_scale
+        steps = 0
+        while self.accumulator >= world.dt:
+            dt = world.dt  # AdaptiveTimestep を使う場合は tick ごとに変わる
+            if steps == self.max_substeps:
+                self.dropped_time += self.accumulator
+                self.accumulator = 0.0
+                break
+            self.previous = self.capture()
+            self.step()
+            self.accumulator -= dt
+            steps += 1
+        self.substeps = steps
+        return steps
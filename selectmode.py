@@ -1,6 +1,8 @@
 # selectmode.py
 import pygame
 
+import assets
+
 class Point_selectmode:
     """回転を能動的に与えるためのモードを示すクラス"""
     def __init__(self, screen, width, height):
@@ -22,8 +24,7 @@ class Point_selectmode:
         self.draw_label("bottom", (self.width // 2, self.ball_pos[1] + self.ball_radius + 10))
 
     def draw_label(self, text, position):
-        font = pygame.font.Font(None, 25)
-        text_surface = font.render(text, True, pygame.Color("black"))
+        text_surface = assets.shared().text(text, 25, "black")  # 文字の画像は毎フレーム作らずに使い回す
         text_rect = text_surface.get_rect(center=position)
         self.screen.blit(text_surface, text_rect)
     
@@ -48,12 +49,3 @@ class Point_selectmode:
     def exit(self):
         """選択モードを終了するメソッド"""
         self.is_active = False
-
-def compute_conservation_of_momentum(force, mass, dt):
-    """
-    力、質量、時間変化量を元に速度変化を計算する関数。
-    運動量保存則に基づく。
-    """
-    delta_p = force * dt
-    delta_v = delta_p / mass
-    return delta_v
\ No newline at end of file
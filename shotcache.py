@@ -0,0 +1,225 @@
+"""ショットの結果を、量子化した盤面とショットの入力をキーにして保持するキャッシュのモジュール
+
+同じ盤面 (またはほとんど同じ盤面) から同じショットを何度も試す場合に、2回目からはシミュレーションを行わずに
+結果を返す。キーは
+  - 残っている球の番号・半径・質量・反発係数・位置・速度・角速度・角加速度・まだ加えられていない力 (番号の順)
+  - ポケットの位置・半径・得点
+  - World の設定 (大きさ・dt・摩擦・重力加速度)
+  - ショットの力と打撃点
+をそれぞれの刻み (step) で丸めた整数にし、blake2b で16バイトにしたもの。
+刻みより小さい差しかない盤面やショットは同じキーになり、保存してある結果が返る。
+
+メモリ上は件数とバイト数の上限つきの LRU で保持し、path を指定すると sqlite に書き出して再起動後も使える。
+
+使い方 (同じ候補を2回評価して、2回目の時間を表示する):
+    python shotcache.py
+"""
+import collections
+import hashlib
+import json
+import sqlite3
+import struct
+import sys
+import time
+
+import batcheval
+
+# 量子化の刻みの既定値。位置・速度・力・打撃点の単位は Numbermass と同じ (m, m/s, N, m)
+# pocket はポケットの位置と半径の刻みで、単位は Pocket.centerpos と同じ描画の座標 (px)
+DEFAULT_STEPS = {
+    "position": 1e-4,
+    "velocity": 1e-3,
+    "angular_velocity": 1e-2,
+    "angular_acceleration": 1e-2,
+    "force": 1e-2,
+    "contact_point": 1e-5,
+    "pocket": 1e-3,
+}
+
+
+def quantize(value, step):
+    return int(round(value / step))
+
+
+def encode_result(result):
+    """ShotResult を JSON のバイト列にする関数"""
+    return json.dumps([list(result.candidate), result.pocketed, result.pocket_scores, result.score,
+                       result.cue_ball_fell, result.final_positions, result.ticks]).encode("utf-8")
+
+
+def decode_result(data):
+    candidate, pocketed, pocket_scores, score, cue_ball_fell, final_positions, ticks = json.loads(data)
+    direction, magnitude, contact_point = candidate
+    return batcheval.ShotResult(
+        candidate=batcheval.ShotCandidate(tuple(direction), magnitude, tuple(contact_point)),
+        pocketed=tuple(pocketed),
+        pocket_scores=tuple(pocket_scores),
+        score=score,
+        cue_ball_fell=cue_ball_fell,
+        final_positions=tuple(tuple(p) for p in final_positions),
+        ticks=ticks,
+    )
+
+
+class ShotCache:
+    """ShotResult を保持する、件数とバイト数の上限つきの LRU キャッシュ
+
+    バイト数は結果を JSON にしたときの大きさで数える。
+    """
+    def __init__(self, max_entries=4096, max_bytes=16 * 1024 * 1024, steps=None, path=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.steps = dict(DEFAULT_STEPS, **(steps or {}))
+        self.entries = collections.OrderedDict()  # キー -> (結果, バイト数)
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.db = None
+        if path is not None:
+            self.db = sqlite3.connect(path)
+            self.db.execute("CREATE TABLE IF NOT EXISTS shots (key BLOB PRIMARY KEY, result BLOB NOT NULL)")
+            self.db.commit()
+
+    def key(self, snapshot, candidate, max_ticks=100000, engine="object"):
+        """盤面 (TableSnapshot) とショット (ShotCandidate) からキーを作るメソッド
+
+        ショットは力のベクトル (direction を magnitude の長さにしたもの) で丸めるので、
+        向きと強さの表し方が違っても同じ力なら同じキーになる。台の設定の名前 (snapshot.table) もキーに含める。
+        max_ticks と engine も含めるので、途中で打ち切った結果や別のエンジンの結果を返すことはない
+        (batcheval.simulate_shot に渡す値と同じものを渡す)。
+        """
+        steps = self.steps
+        q_pos, q_vel, q_w, q_force = steps["position"], steps["velocity"], steps["angular_velocity"], steps["force"]
+        q_alpha, q_pocket = steps["angular_acceleration"], steps["pocket"]
+        values = [max_ticks, len(snapshot.balls), len(snapshot.pockets),
+                  quantize(snapshot.dt, 1e-9), quantize(snapshot.friction, 1e-6),
+                  quantize(snapshot.grav_acc[0], 1e-6), quantize(snapshot.grav_acc[1], 1e-6),
+                  quantize(snapshot.size[0], 1), quantize(snapshot.size[1], 1)]
+        for b in sorted(snapshot.balls, key=lambda b: b.number):
+            values.extend((b.number,
+                           quantize(b.radius, 1e-6), quantize(b.mass, 1e-6), quantize(b.restitution, 1e-6),
+                           quantize(b.pos[0], q_pos), quantize(b.pos[1], q_pos),
+                           quantize(b.vel[0], q_vel), quantize(b.vel[1], q_vel),
+                           quantize(b.angular_velocity, q_w), quantize(b.angular_acceleration, q_alpha),
+                           quantize(b.force[0], q_force), quantize(b.force[1], q_force)))
+        for p in snapshot.pockets:
+            values.extend((quantize(p.centerpos[0], q_pocket), quantize(p.centerpos[1], q_pocket),
+                           quantize(p.radius, q_pocket), p.score))
+
+        fx, fy = candidate.direction
+        length = (fx * fx + fy * fy) ** 0.5
+        if length > 0:
+            fx, fy = fx / length * candidate.magnitude, fy / length * candidate.magnitude
+        cx, cy = candidate.contact_point
+        q_contact = steps["contact_point"]
+        values.extend((quantize(fx, q_force), quantize(fy, q_force), quantize(cx, q_contact), quantize(cy, q_contact)))
+        packed = f"{snapshot.table}\0{engine}\0".encode("utf-8") + struct.pack(f"<{len(values)}q", *values)
+        return hashlib.blake2b(packed, digest_size=16).digest()
+
+    def get(self, key):
+        """キーの結果を返すメソッド。無ければ None"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        if self.db is not None:
+            row = self.db.execute("SELECT result FROM shots WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.disk_hits += 1
+                result = decode_result(row[0])
+                self.store(key, result, len(row[0]))
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key, result):
+        data = encode_result(result)
+        self.store(key, result, len(data))
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO shots (key, result) VALUES (?, ?)", (key, data))
+            self.db.commit()
+
+    def store(self, key, result, size):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (result, size)
+        self.bytes += size
+        while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def simulate(self, snapshot, candidate, max_ticks=100000, engine="object"):
+        """キャッシュにあればその結果を、無ければシミュレーションして保存した結果を返すメソッド
+
+        返す結果の candidate は、問い合わせた candidate に置き換える。
+        """
+        key = self.key(snapshot, candidate, max_ticks, engine)
+        result = self.get(key)
+        if result is None:
+            result = batcheval.simulate_shot(snapshot, candidate, max_ticks, engine)
+            self.put(key, result)
+        return result._replace(candidate=candidate)
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+
+def main():
+    import simulator
+
+    snapshot = simulator.Simulator().snapshot()
+    cache = ShotCache()
+    candidates = batcheval.sweep_candidates(angles=8, magnitudes=(120,))
+    start = time.perf_counter()
+    for candidate in candidates:
+        cache.simulate(snapshot, candidate)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for candidate in candidates:
+        # 刻みより小さいだけ違う候補も同じ結果になる
+        nudged = candidate._replace(magnitude=candidate.magnitude + 1e-4)
+        cache.simulate(snapshot, nudged)
+    second = time.perf_counter() - start
+    print(f"simulated: {first / len(candidates) * 1e3:.2f} ms/shot, cached: {second / len(candidates) * 1e6:.1f} us/shot")
+    print(cache.stats())
+
+    # 盤面の既定値を上書きする値 (重力加速度・ポケットの位置と半径・角加速度) だけが違う盤面は、別のキーになる
+    candidate = candidates[0]
+    pocket = snapshot.pockets[0]
+    cue_ball = snapshot.balls[0]
+    variants = {
+        "grav_acc": snapshot._replace(grav_acc=(snapshot.grav_acc[0], snapshot.grav_acc[1] + 0.5)),
+        "pocket centerpos": snapshot._replace(pockets=(pocket._replace(centerpos=(pocket.centerpos[0] + 1, pocket.centerpos[1])),)
+                                              + snapshot.pockets[1:]),
+        "pocket radius": snapshot._replace(pockets=(pocket._replace(radius=pocket.radius + 1),) + snapshot.pockets[1:]),
+        "angular_acceleration": snapshot._replace(balls=(cue_ball._replace(angular_acceleration=cue_ball.angular_acceleration + 1),)
+                                                  + snapshot.balls[1:]),
+    }
+    base_key = cache.key(snapshot, candidate)
+    failed = [name for name, variant in variants.items() if cache.key(variant, candidate) == base_key]
+    for name in failed:
+        print(f"{name}: same key as the original snapshot")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""ショットを記録・再生するためのバイナリ形式のモジュール
+
+記録するもの
+  - 最初の盤面 (World の設定・球・ポケット。倍精度で保存するので Simulator で同じ盤面を作り直せる)
+  - ショットの入力 (手玉に加えた力と Point_selectmode.give_moment_arm の打撃点)
+  - tickごとの全ての球の状態 (任意。球1つにつき float32 が5つの固定長のレコード)
+
+ファイルの構成 (リトルエンディアン)
+  ヘッダ   : MAGIC, 版, フラグ, dt, 画面の大きさ, 摩擦, 重力加速度, 球の数, ポケットの数
+  台       : TABLE_NAME_FORMAT (名前のバイト数) と UTF-8 の台の設定の名前 (版 2 から。版 1 のファイルは標準の台)
+  盤面     : 球ごとに BALL_FORMAT、ポケットごとに POCKET_FORMAT
+  レコード : 1バイトのタグに続く
+               b"S" ショット (SHOT_FORMAT)
+               b"C" tickの塊 (CHUNK_FORMAT + 中身)。連続した tick のフレームをまとめたもの
+               b"X" 索引 (閉じるときに1回だけ書く。INDEX_HEADER_FORMAT に続けて、塊ごとに INDEX_ENTRY_FORMAT
+                    (最初の tick, tick の数, 位置)、ショットごとに SHOT_FORMAT。版 3 から)
+  末尾     : FOOTER_FORMAT (索引の位置と END_MAGIC)
+
+フレームは、球の並び (最初の盤面の順) ごとに pos_real.x, pos_real.y, vel_real.x, vel_real.y, angle を並べたもの。
+ポケットに落ちた球は NaN で埋める。塊の中では、直前のフレームとの XOR をとってから zlib で圧縮する
+(動いていない球は 0 になるので、よく縮む)。前の tick から変化のないフレームは書かない。
+ShotReplay はファイルを mmap し、末尾に索引があれば索引から、無ければ (close されなかったファイルや版 2 までのファイル)
+レコードの見出しだけをたどって塊の位置を集め、目的の tick を含む塊だけを展開する。
+"""
+import bisect
+import math
+import mmap
+import struct
+import zlib
+
+import simulator
+
+MAGIC = b"BSRC"
+END_MAGIC = b"BEND"
+VERSION = 3
+
+FLAG_DELTA = 1  # 塊の中のフレームを直前のフレームとの XOR で保存する
+FLAG_ZLIB = 2  # 塊を zlib で圧縮する
+FLAG_TRAJECTORY = 4  # tickごとのフレームを記録する
+
+HEADER_FORMAT = struct.Struct("<4sHHddddddII")
+BALL_FORMAT = struct.Struct("<i4Bdddddddddddd")
+POCKET_FORMAT = struct.Struct("<dddi")
+SHOT_FORMAT = struct.Struct("<Idddd")
+TABLE_NAME_FORMAT = struct.Struct("<H")
+CHUNK_FORMAT = struct.Struct("<IIII")  # 最初の tick, tick の数, 展開後の長さ, 中身の長さ
+INDEX_HEADER_FORMAT = struct.Struct("<II")  # 塊の数, ショットの数
+INDEX_ENTRY_FORMAT = struct.Struct("<IIQ")
+FOOTER_FORMAT = struct.Struct("<Q4s")
+
+FIELDS_PER_BALL = 5
+NAN_BALL = (math.nan,) * FIELDS_PER_BALL
+
+
+def xor_bytes(a, b):
+    """同じ長さのバイト列の XOR をとる関数"""
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(len(a), "little")
+
+
+class ShotRecorder:
+    """Simulator の盤面・ショット・tickごとの状態をファイルに書き出していくクラス
+
+    フレームは chunk_ticks 個ずつまとめて書くので、記録中のファイルの大きさは一定の割合で増える。
+    close を呼ぶと残りのフレームと索引を書く (close されなかったファイルも、索引なしで再生できる)。
+    """
+    def __init__(self, path, sim, chunk_ticks=256, delta=True, compress=True, trajectory=True, level=6):
+        self.sim = sim
+        self.chunk_ticks = chunk_ticks
+        self.level = level
+        self.flags = (FLAG_DELTA if delta else 0) | (FLAG_ZLIB if compress else 0) | (FLAG_TRAJECTORY if trajectory else 0)
+        self.file = open(path, "wb")
+        self.index = []
+        self.shots = []
+        self.frames = []
+        self.first_tick = None
+        self.last_tick = None
+        self.last_frame = None
+
+        rack = sim.snapshot()
+        self.slots = [b.number for b in rack.balls]
+        self.frame_format = struct.Struct(f"<{FIELDS_PER_BALL * len(self.slots)}f")
+        self.write_rack(rack)
+
+    def write_rack(self, rack):
+        self.file.write(HEADER_FORMAT.pack(MAGIC, VERSION, self.flags, rack.dt, rack.size[0], rack.size[1],
+                                           rack.friction, rack.grav_acc[0], rack.grav_acc[1],
+                                           len(rack.balls), len(rack.pockets)))
+        name = rack.table.encode("utf-8")
+        self.file.write(TABLE_NAME_FORMAT.pack(len(name)) + name)
+        for b in rack.balls:
+            color = tuple(b.color) + (255,) * (4 - len(b.color))
+            self.file.write(BALL_FORMAT.pack(b.number, *color, b.radius, b.mass, b.restitution, *b.pos, *b.vel,
+                                             b.angle, b.angular_velocity, *b.force, b.angular_acceleration))
+        for p in rack.pockets:
+            self.file.write(POCKET_FORMAT.pack(p.centerpos[0], p.centerpos[1], p.radius, p.score))
+
+    def record_shot(self, force, contact_point=None):
+        """手玉に加えた力を記録するメソッド (Simulator.shoot の直後に呼ぶ)"""
+        cx, cy = (math.nan, math.nan) if contact_point is None else (contact_point[0], contact_point[1])
+        self.flush()  # ショットより前のフレームを先に書いておく
+        shot = (self.sim.tick_count, force[0], force[1], cx, cy)
+        self.shots.append(shot)
+        self.file.write(b"S" + SHOT_FORMAT.pack(*shot))
+
+    def capture(self):
+        """現在の球の状態を1つのフレームにするメソッド"""
+        states = {b.number: (b.pos_real.x, b.pos_real.y, b.vel_real.x, b.vel_real.y, b.angle) for b in self.sim.balls()}
+        values = []
+        for number in self.slots:
+            values.extend(states.get(number, NAN_BALL))
+        return self.frame_format.pack(*values)
+
+    def record_tick(self):
+        """Simulator.step の直後に呼び、変化があれば現在の tick のフレームを記録するメソッド"""
+        if not self.flags & FLAG_TRAJECTORY:
+            return
+        frame = self.capture()
+        if frame == self.last_frame:
+            return
+        tick = self.sim.tick_count
+        if self.frames and (tick != self.last_tick + 1 or len(self.frames) >= self.chunk_ticks):
+            self.flush()
+        if not self.frames:
+            self.first_tick = tick
+        self.frames.append(frame)
+        self.last_tick = tick
+        self.last_frame = frame
+
+    def flush(self):
+        """ためているフレームを1つの塊として書くメソッド"""
+        if not self.frames:
+            return
+        frames = self.frames
+        if self.flags & FLAG_DELTA:
+            frames = [frames[0]] + [xor_bytes(a, b) for a, b in zip(frames, frames[1:])]
+        raw = b"".join(frames)
+        payload = zlib.compress(raw, self.level) if self.flags & FLAG_ZLIB else raw
+        self.index.append((self.first_tick, len(self.frames), self.file.tell()))
+        self.file.write(b"C" + CHUNK_FORMAT.pack(self.first_tick, len(self.frames), len(raw), len(payload)))
+        self.file.write(payload)
+        self.frames = []
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        index_offset = self.file.tell()
+        self.file.write(b"X" + INDEX_HEADER_FORMAT.pack(len(self.index), len(self.shots)))
+        for entry in self.index:
+            self.file.write(INDEX_ENTRY_FORMAT.pack(*entry))
+        for shot in self.shots:
+            self.file.write(SHOT_FORMAT.pack(*shot))
+        self.file.write(FOOTER_FORMAT.pack(index_offset, END_MAGIC))
+        self.file.close()
+
+
+class ShotReplay:
+    """記録したファイルを mmap し、任意の tick の状態を取り出すクラス
+
+    frame(tick) は tick を含む塊だけを展開する (直前に展開した塊は保持しておく)。
+    記録していない tick は、その前に記録したフレームから変化がなかったことを意味する。
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = self.buffer
+        (magic, version, self.flags, dt, width, height, friction, gx, gy,
+         ball_count, pocket_count) = HEADER_FORMAT.unpack_from(buffer, 0)
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            raise ValueError("not a shot record file")
+        self.version = version
+        offset = HEADER_FORMAT.size
+        table = simulator.TableSnapshot._field_defaults["table"]
+        if version >= 2:
+            (length,) = TABLE_NAME_FORMAT.unpack_from(buffer, offset)
+            offset += TABLE_NAME_FORMAT.size
+            table = bytes(buffer[offset:offset + length]).decode("utf-8")
+            offset += length
+
+        balls = []
+        for _ in range(ball_count):
+            values = BALL_FORMAT.unpack_from(buffer, offset)
+            offset += BALL_FORMAT.size
+            balls.append(simulator.BallState(values[0], values[1:5], values[5], values[6], values[7],
+                                             values[8:10], values[10:12], values[12], values[13],
+                                             values[14:16], values[16]))
+        pockets = []
+        for _ in range(pocket_count):
+            cx, cy, radius, score = POCKET_FORMAT.unpack_from(buffer, offset)
+            offset += POCKET_FORMAT.size
+            pockets.append(simulator.PocketState((cx, cy), radius, score))
+        self.rack = simulator.TableSnapshot((width, height), dt, friction, (gx, gy), tuple(balls), tuple(pockets), table)
+        self.slots = [b.number for b in balls]
+        self.frame_format = struct.Struct(f"<{FIELDS_PER_BALL * ball_count}f")
+        self.body_offset = offset
+
+        self.shots = []  # (tick, 力, 打撃点)
+        self.chunks = []  # (最初の tick, tick の数, 塊の位置)
+        self.complete = self.read_index()
+        if not self.complete:
+            self.scan()
+        self.chunk_ticks = [c[0] for c in self.chunks]
+        self.cached_chunk = None
+        self.cached_frames = None
+
+    def add_shot(self, tick, fx, fy, cx, cy):
+        contact_point = None if math.isnan(cx) else (cx, cy)
+        self.shots.append((tick, (fx, fy), contact_point))
+
+    def read_index(self):
+        """末尾の FOOTER_FORMAT が指す索引からショットと塊の位置を集めるメソッド
+
+        索引を読めた場合は True を返す。版 2 までのファイル (索引にショットが無い) や、
+        close されなかったファイル・末尾が壊れたファイルでは何もせずに False を返す。
+        """
+        buffer = self.buffer
+        end = len(buffer)
+        if self.version < 3 or end < self.body_offset + FOOTER_FORMAT.size:
+            return False
+        index_offset, end_magic = FOOTER_FORMAT.unpack_from(buffer, end - FOOTER_FORMAT.size)
+        if end_magic != END_MAGIC or not self.body_offset <= index_offset <= end - FOOTER_FORMAT.size - 1 - INDEX_HEADER_FORMAT.size:
+            return False
+        if buffer[index_offset:index_offset + 1] != b"X":
+            return False
+        chunk_count, shot_count = INDEX_HEADER_FORMAT.unpack_from(buffer, index_offset + 1)
+        offset = index_offset + 1 + INDEX_HEADER_FORMAT.size
+        if offset + chunk_count * INDEX_ENTRY_FORMAT.size + shot_count * SHOT_FORMAT.size != end - FOOTER_FORMAT.size:
+            return False
+        self.chunks = list(INDEX_ENTRY_FORMAT.iter_unpack(buffer[offset:offset + chunk_count * INDEX_ENTRY_FORMAT.size]))
+        offset += chunk_count * INDEX_ENTRY_FORMAT.size
+        for shot in SHOT_FORMAT.iter_unpack(buffer[offset:offset + shot_count * SHOT_FORMAT.size]):
+            self.add_shot(*shot)
+        return True
+
+    def scan(self):
+        """レコードの見出しだけをたどってショットと塊の位置を集めるメソッド (塊の中身は展開しない)
+
+        索引を使えない場合に使う。途中で途切れたファイル (close されなかった記録) は、読める所までを使う。
+        """
+        buffer = self.buffer
+        offset = self.body_offset
+        end = len(buffer)
+        while offset < end:
+            tag = buffer[offset:offset + 1]
+            if tag == b"S":
+                if offset + 1 + SHOT_FORMAT.size > end:
+                    break
+                self.add_shot(*SHOT_FORMAT.unpack_from(buffer, offset + 1))
+                offset += 1 + SHOT_FORMAT.size
+            elif tag == b"C":
+                if offset + 1 + CHUNK_FORMAT.size > end:
+                    break
+                first_tick, count, raw_length, payload_length = CHUNK_FORMAT.unpack_from(buffer, offset + 1)
+                if offset + 1 + CHUNK_FORMAT.size + payload_length > end:
+                    break  # 書きかけの塊
+                self.chunks.append((first_tick, count, offset))
+                offset += 1 + CHUNK_FORMAT.size + payload_length
+            else:
+                break  # 索引か、途中で途切れたレコード
+        # 版 2 までのファイルは、索引にショットが無いので使わないが、末尾まで書かれていれば complete とする
+        self.complete = (self.version < 3 and end >= FOOTER_FORMAT.size
+                         and FOOTER_FORMAT.unpack_from(buffer, end - FOOTER_FORMAT.size)[1] == END_MAGIC)
+
+    @property
+    def first_tick(self):
+        return self.chunks[0][0] if self.chunks else None
+
+    @property
+    def last_tick(self):
+        if not self.chunks:
+            return None
+        first_tick, count, _ = self.chunks[-1]
+        return first_tick + count - 1
+
+    def decode_chunk(self, k):
+        if self.cached_chunk == k:
+            return self.cached_frames
+        _, count, offset = self.chunks[k]
+        _, _, raw_length, payload_length = CHUNK_FORMAT.unpack_from(self.buffer, offset + 1)
+        start = offset + 1 + CHUNK_FORMAT.size
+        payload = self.buffer[start:start + payload_length]
+        raw = zlib.decompress(payload) if self.flags & FLAG_ZLIB else payload
+        size = self.frame_format.size
+        frames = [raw[i * size:(i + 1) * size] for i in range(count)]
+        if self.flags & FLAG_DELTA:
+            for i in range(1, count):
+                frames[i] = xor_bytes(frames[i - 1], frames[i])
+        self.cached_chunk = k
+        self.cached_frames = frames
+        return frames
+
+    def raw_frame(self, tick):
+        k = bisect.bisect_right(self.chunk_ticks, tick) - 1
+        if k < 0:
+            return None
+        first_tick, count, _ = self.chunks[k]
+        return self.decode_chunk(k)[min(tick - first_tick, count - 1)]
+
+    def frame(self, tick):
+        """tick の後の球の状態を {番号: (x, y, vx, vy, angle)} で返すメソッド (落ちた球は含まない)
+
+        最初に記録した tick より前の場合は None を返す。
+        """
+        raw = self.raw_frame(tick)
+        if raw is None:
+            return None
+        values = self.frame_format.unpack(raw)
+        states = {}
+        for slot, number in enumerate(self.slots):
+            state = values[slot * FIELDS_PER_BALL:(slot + 1) * FIELDS_PER_BALL]
+            if not math.isnan(state[0]):
+                states[number] = state
+        return states
+
+    def create_simulator(self, engine="object"):
+        """最初の盤面から Simulator を作り直すメソッド (replay_shots と組み合わせて再計算に使う)"""
+        return simulator.Simulator(snapshot=self.rack, engine=engine)
+
+    def replay_shots(self, sim, until_tick):
+        """記録したショットを同じ tick で加えながら sim を until_tick まで進めるメソッド"""
+        shots = iter(self.shots)
+        shot = next(shots, None)
+        while sim.tick_count < until_tick and not sim.game_rule.game_over:
+            while shot is not None and shot[0] == sim.tick_count:
+                sim.shoot(shot[1], shot[2])
+                shot = next(shots, None)
+            sim.step()
+        return sim
+
+    def close(self):
+        self.buffer.close()
+
+
+def main():
+    """ブレイクショットを記録し、大きさと再生の結果を表示する"""
+    import os
+    import tempfile
+    import time
+
+    sim = simulator.Simulator()
+    path = os.path.join(tempfile.gettempdir(), "break_shot.bsrc")
+    recorder = ShotRecorder(path, sim)
+    force = simulator.force_from_drag((300, 300), (0, 302))
+    sim.shoot(force, (0.01, 0))
+    recorder.record_shot(force, (0.01, 0))
+    while True:
+        sim.step()
+        recorder.record_tick()
+        if sim.are_balls_stopped() or sim.game_rule.game_over:
+            break
+    recorder.close()
+
+    replay = ShotReplay(path)
+    ticks = replay.last_tick - replay.first_tick + 1
+    raw_size = ticks * replay.frame_format.size
+    print(f"{ticks} ticks, {len(replay.slots)} balls: {os.path.getsize(path)} bytes "
+          f"(raw float32 frames {raw_size} bytes)")
+    start = time.perf_counter()
+    final = replay.frame(replay.last_tick)
+    middle = replay.frame((replay.first_tick + replay.last_tick) // 2)
+    print(f"seek to 2 ticks: {(time.perf_counter() - start) * 1000:.2f} ms, {len(middle)} balls mid-shot")
+    for b in sim.balls():
+        x, y = final[b.number][:2]
+        assert (x, y) == struct.unpack("<2f", struct.pack("<2f", b.pos_real.x, b.pos_real.y))
+    print("final frame matches the simulator")
+    replay.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+"""コンピュータの対戦相手とヒントのために、得点の高いショットを探すモジュール
+
+探すのは AppMain と同じ入力
+  - 手玉を突く方向
+  - 強さ (give_force_by_user の 50 + ドラッグ距離/7.5)
+  - 打撃点 (Point_selectmode.give_moment_arm で得られる、円の中心からのずれ)
+で、評価は ポケットの得点の増加 (手玉が落ちた場合は CUE_BALL_PENALTY を引く)。
+
+探し方は粗いものから細かいものへ
+  1. 等間隔の方向と的球やポケットを狙った方向を並べ、手玉がどの球にも当たらない方向を除く (first_contact)
+  2. 残った候補を eventengine (速いが近似) で評価する
+  3. 評価の高い beam_width 個の周りで、方向と強さの間隔を半分にして評価し直すことを繰り返す
+  4. 最後に上位の候補を固定ステップの Simulator で確かめ直す
+どの段階でも、budget 秒を過ぎたらその時点で最も良いショットを返す。
+評価は ProcessPoolExecutor で全てのCPUコアに分ける。HintWorker はこれを別スレッドで行うので、
+AppMain の描画のループは止まらない。ワーカーのプロセスは、描画や物理のスレッドが動いている最中に
+別スレッドから作られることがあるので、fork ではなく spawn で作る (create_executor)。
+
+使い方 (既定の配置で探し、結果を表示する):
+    python shotsearch.py
+"""
+import collections
+import concurrent.futures
+import functools
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+import batcheval
+import tableconfig
+
+CUE_BALL_PENALTY = 100
+POWER_RANGE = (50, 130)  # give_force_by_user で、ドラッグ距離が 0 から 600px の場合の強さ
+SPIN_RADIUS = 0.028  # Point_selectmode の円の縁をクリックした場合の打撃点のずれ (m)
+DEFAULT_CONTACT_POINTS = ((0.0, 0.0), (0.0, SPIN_RADIUS / 2), (0.0, -SPIN_RADIUS / 2),
+                          (SPIN_RADIUS / 2, 0.0), (-SPIN_RADIUS / 2, 0.0))
+
+SearchResult = collections.namedtuple("SearchResult", ["best", "value", "evaluated", "pruned", "elapsed", "complete"])
+
+
+def power_from_drag(distance):
+    """ドラッグ距離 (px) から強さを求める関数 (give_force_by_user と同じ)"""
+    return 50 + distance / 7.5
+
+
+def shot_value(result):
+    """ShotResult の評価。手玉が落ちた場合は大きく下げ、同じ得点なら落とした球の多い方を選ぶ"""
+    value = result.score + 0.01 * len(result.pocketed)
+    if result.cue_ball_fell:
+        value -= CUE_BALL_PENALTY
+    return value
+
+
+def first_contact(snapshot, direction):
+    """手玉を direction に転がしたときに最初に当たる球の番号を返す関数 (どれにも当たらなければ None)
+
+    回転や壁での反射は考えず、手玉の中心の直線が、半径の和だけ離れた範囲に入るかで判定する。
+    手玉は snapshot の最初の球とする (actor_list の先頭と同じ)。
+    """
+    cue = snapshot.balls[0]
+    dx, dy = direction
+    length = math.hypot(dx, dy)
+    if length == 0:
+        return None
+    dx, dy = dx / length, dy / length
+    nearest, nearest_t = None, math.inf
+    for ball in snapshot.balls[1:]:
+        rx, ry = ball.pos[0] - cue.pos[0], ball.pos[1] - cue.pos[1]
+        t = rx * dx + ry * dy  # 直線上で最も近づく位置までの距離
+        if t <= 0:
+            continue
+        reach = cue.radius + ball.radius
+        miss2 = rx * rx + ry * ry - t * t
+        if miss2 >= reach * reach:
+            continue
+        t_hit = t - math.sqrt(reach * reach - miss2)
+        if t_hit < nearest_t:
+            nearest, nearest_t = ball.number, t_hit
+    return nearest
+
+
+def candidate(angle, power, contact_point):
+    return batcheval.ShotCandidate((math.cos(angle), math.sin(angle)), power, tuple(contact_point))
+
+
+def create_executor(max_workers):
+    """ショットを評価する ProcessPoolExecutor を作る関数
+
+    プロセスは最初の評価のとき (HintWorker では別スレッド) に作られる。他のスレッドが動いている
+    プロセスを fork すると、ロックなどの状態を写したまま子プロセスが始まるので、spawn で作る。
+    """
+    return concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class ShotSearch:
+    """1つの盤面について、時間の上限つきでショットを探すクラス
+
+    executor を渡した場合はそれを使い (HintWorker のように使い回す場合)、渡さない場合は
+    max_workers 個のプロセスを作る。in_process=True の場合は、このスレッドで順に評価する。
+    """
+    def __init__(self, snapshot, budget=0.8, max_workers=None, executor=None, in_process=False,
+                 engine="event", verify_engine="object", cache=None, angles=48, powers=(60, 80, 105, 130),
+                 contact_points=DEFAULT_CONTACT_POINTS, beam_width=4, refinements=3, max_ticks=20000):
+        self.snapshot = snapshot
+        self.budget = budget
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.executor = executor
+        self.in_process = in_process
+        self.engine = engine
+        self.verify_engine = verify_engine
+        self.cache = cache  # verify_engine の結果だけを保存する (近似の結果と混ざらないように)
+        self.angles = angles
+        self.powers = powers
+        self.contact_points = contact_points
+        self.beam_width = beam_width
+        self.refinements = refinements
+        self.max_ticks = max_ticks
+        self.deadline = 0.0
+        self.evaluated = 0
+        self.pruned = 0
+        self.seen = set()
+
+    def time_left(self):
+        return self.deadline - time.perf_counter()
+
+    def evaluate(self, candidates, engine):
+        """候補を少しずつまとめて評価し、(評価, ShotResult) のリストを返すメソッド
+
+        まとまりごとに時間を確かめ、budget を過ぎたら残りの候補は評価しない。
+        executor は盤面ごとに作り直さずに使い回すことがあるので、盤面はワーカーの起動時 (batcheval._init_worker)
+        ではなく simulate と一緒に送る。chunksize でまとまりをワーカーの数に分け、盤面を送るのはワーカーごとに1回にする。
+        """
+        scored = []
+        per_worker = 2
+        batch_size = self.max_workers * per_worker
+        simulate = functools.partial(batcheval.simulate_shot, self.snapshot, max_ticks=self.max_ticks, engine=engine)
+        for start in range(0, len(candidates), batch_size):
+            if self.time_left() <= 0:
+                break
+            batch = candidates[start:start + batch_size]
+            if self.in_process:
+                results = [simulate(c) for c in batch]
+            else:
+                results = list(self.executor.map(simulate, batch, chunksize=per_worker))
+            self.evaluated += len(results)
+            scored.extend((shot_value(r), r) for r in results)
+        return scored
+
+    def aim_angles(self):
+        """的球を直接狙う方向と、的球をポケットの方向へ押し出す方向 (的球の手前に手玉を当てる方向) を求めるメソッド
+
+        球が少なくなると、等間隔の方向だけではどの球にも当たらないことがあるので、これも候補に加える。
+        """
+        cue = self.snapshot.balls[0]
+        scale = tableconfig.load(self.snapshot.table).scale  # ポケットの位置 (ピクセル) を球の位置 (m) に合わせる
+        angles = []
+        for ball in self.snapshot.balls[1:]:
+            for pocket in self.snapshot.pockets:
+                px, py = pocket.centerpos[0] / scale, pocket.centerpos[1] / scale
+                distance = math.hypot(px - ball.pos[0], py - ball.pos[1])
+                if distance == 0:
+                    continue
+                reach = cue.radius + ball.radius
+                gx = ball.pos[0] - (px - ball.pos[0]) / distance * reach
+                gy = ball.pos[1] - (py - ball.pos[1]) / distance * reach
+                angles.append(math.atan2(gy - cue.pos[1], gx - cue.pos[0]))
+        for ball in self.snapshot.balls[1:]:
+            angles.append(math.atan2(ball.pos[1] - cue.pos[1], ball.pos[0] - cue.pos[0]))
+        return angles
+
+    def coarse_candidates(self):
+        """狙った方向と等間隔の方向のうち、最初に何かの球に当たる方向だけを残すメソッド
+
+        時間切れになっても見込みの高い候補が評価されているように、狙った方向を先に並べる。
+        """
+        candidates = []
+        angles = self.aim_angles() + [2 * math.pi * k / self.angles for k in range(self.angles)]
+        for angle in angles:
+            if first_contact(self.snapshot, (math.cos(angle), math.sin(angle))) is None:
+                self.pruned += 1
+                continue
+            for power in self.powers:
+                candidates.append(candidate(angle, power, (0.0, 0.0)))
+        return candidates
+
+    def refine_candidates(self, beam, angle_step, power_step):
+        """beam の各候補の周りの方向・強さ・打撃点の候補を作るメソッド (評価済みのものは除く)"""
+        candidates = []
+        for _, result in beam:
+            c = result.candidate
+            base_angle = math.atan2(c.direction[1], c.direction[0])
+            for da in (-angle_step, 0.0, angle_step):
+                angle = base_angle + da
+                if first_contact(self.snapshot, (math.cos(angle), math.sin(angle))) is None:
+                    self.pruned += 1
+                    continue
+                for dp in (-power_step, 0.0, power_step):
+                    power = min(max(c.magnitude + dp, POWER_RANGE[0]), POWER_RANGE[1])
+                    for contact_point in self.contact_points:
+                        key = (round(angle, 9), round(power, 6), contact_point)
+                        if key in self.seen:
+                            continue
+                        self.seen.add(key)
+                        candidates.append(candidate(angle, power, contact_point))
+        return candidates
+
+    def verify(self, beam):
+        """上位の候補を verify_engine で評価し直すメソッド (cache があれば使う)"""
+        candidates = [result.candidate for _, result in beam]
+        if self.cache is not None:
+            keys = [self.cache.key(self.snapshot, c, self.max_ticks, self.verify_engine) for c in candidates]
+            cached = [self.cache.get(key) for key in keys]
+            missing = [c for c, r in zip(candidates, cached) if r is None]
+            fresh = iter(self.evaluate(missing, self.verify_engine))
+            verified = []
+            for key, r in zip(keys, cached):
+                if r is None:
+                    item = next(fresh, None)
+                    if item is None:
+                        continue  # 時間切れで評価できなかった
+                    self.cache.put(key, item[1])
+                    verified.append(item)
+                else:
+                    verified.append((shot_value(r), r))
+            return verified
+        return self.evaluate(candidates, self.verify_engine)
+
+    def run(self):
+        start = time.perf_counter()
+        self.deadline = start + self.budget
+        own_executor = None
+        if not self.in_process and self.executor is None:
+            own_executor = self.executor = create_executor(self.max_workers)
+        try:
+            scored = self.evaluate(self.coarse_candidates(), self.engine)
+            for c in (r.candidate for _, r in scored):
+                self.seen.add((round(math.atan2(c.direction[1], c.direction[0]), 9), round(c.magnitude, 6), c.contact_point))
+            angle_step = math.pi / self.angles
+            power_step = (self.powers[-1] - self.powers[0]) / max(1, 2 * (len(self.powers) - 1))
+            for _ in range(self.refinements):
+                if self.time_left() <= 0 or not scored:
+                    break
+                beam = sorted(scored, key=lambda item: item[0], reverse=True)[:self.beam_width]
+                scored.extend(self.evaluate(self.refine_candidates(beam, angle_step, power_step), self.engine))
+                angle_step /= 2
+                power_step /= 2
+            complete = self.time_left() > 0
+            beam = sorted(scored, key=lambda item: item[0], reverse=True)[:self.beam_width]
+            if self.verify_engine is not None and self.verify_engine != self.engine and beam:
+                verified = self.verify(beam)
+                if verified:
+                    beam = verified
+                else:
+                    complete = False
+            best_value, best = max(beam, key=lambda item: item[0]) if beam else (None, None)
+        finally:
+            if own_executor is not None:
+                own_executor.shutdown()
+                self.executor = None
+        return SearchResult(best, best_value, self.evaluated, self.pruned, time.perf_counter() - start,
+                            complete and self.time_left() > 0)
+
+
+class HintWorker:
+    """別スレッドでショットを探し、結果を保持しておくクラス
+
+    request(snapshot) は待たずに戻る。探している間に新しい盤面が来た場合は、古い盤面の要求は捨てる。
+    評価は使い回すプロセスで行うので、描画のループとは GIL を取り合わない。
+    """
+    def __init__(self, budget=0.8, max_workers=None, cache=None, **options):
+        self.budget = budget
+        self.cache = cache
+        self.options = options
+        self.executor = create_executor(max_workers or os.cpu_count() or 1)
+        self.max_workers = max_workers
+        self.requests = queue.Queue(maxsize=1)
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.result = None  # (generation, SearchResult)
+        self.thread = threading.Thread(target=self.loop, name="hint-worker", daemon=True)
+        self.thread.start()
+
+    def request(self, snapshot):
+        """盤面を渡してショットを探させ、その要求の番号を返すメソッド"""
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        try:
+            self.requests.get_nowait()  # まだ始まっていない古い要求は捨てる
+        except queue.Empty:
+            pass
+        self.requests.put((generation, snapshot))
+        return generation
+
+    def latest(self, generation=None):
+        """最後に見つかった SearchResult を返すメソッド。generation を指定した場合は、その要求の結果だけを返す"""
+        with self.lock:
+            if self.result is None or (generation is not None and self.result[0] != generation):
+                return None
+            return self.result[1]
+
+    def loop(self):
+        while True:
+            item = self.requests.get()
+            if item is None:
+                return
+            generation, snapshot = item
+            search = ShotSearch(snapshot, self.budget, self.max_workers, executor=self.executor,
+                                cache=self.cache, **self.options)
+            result = search.run()
+            with self.lock:
+                if generation == self.generation:
+                    self.result = (generation, result)
+
+    def close(self):
+        try:
+            self.requests.get_nowait()
+        except queue.Empty:
+            pass
+        self.requests.put(None)
+        self.thread.join()
+        self.executor.shutdown()
+
+
+def main():
+    import simulator
+
+    snapshot = simulator.Simulator().snapshot()
+    result = ShotSearch(snapshot).run()
+    print(f"evaluated {result.evaluated} shots, pruned {result.pruned} directions in {result.elapsed:.2f} s "
+          f"({os.cpu_count()} cores, complete: {result.complete})")
+    if result.best is not None:
+        c = result.best.candidate
+        angle = math.degrees(math.atan2(c.direction[1], c.direction[0]))
+        print(f"best: angle {angle:.1f} power {c.magnitude:.1f} contact {c.contact_point} -> "
+              f"score {result.best.score}, pocketed {list(result.best.pocketed)}, cue fell {result.best.cue_ball_fell}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""画面を使わずにビリヤードのシミュレーションを進めるためのモジュール
+
+AppMain からディスプレイ・フォント・フレームレート制限を取り除いたもので、
+ショットの一括評価などで CPU の許す限りの速さでシミュレーションを進めるために使う。
+
+使い方 (既定の配置でブレイクショットを1回行い、速度を表示する):
+    python simulator.py
+"""
+import collections
+import time
+
+import pygame
+
+import billiard
+import determinism
+import gamerule
+import tableconfig
+
+PgVector = pygame.math.Vector2
+
+
+class ActorFactory:
+    """台の設定 (tableconfig.TableSpec) から球・壁・ポケットなどを作るクラス
+
+    table は台の名前か TableSpec (省略すると tableconfig.DEFAULT_TABLE)。壁の位置は World.size に合わせる。
+    """
+    def __init__(self, world, actor_list, table=None):
+        self.world = world
+        self.actor_list = actor_list
+        if not isinstance(table, tableconfig.TableSpec):
+            table = tableconfig.load(table or tableconfig.DEFAULT_TABLE)
+        self.table = tableconfig.for_size(table, tuple(world.size))
+
+    def create_ball(self, number, color, pos_draw, **options):
+        ball = self.table.ball
+        options.setdefault("restitution", ball.restitution)
+        options.setdefault("mass", ball.mass)
+        return billiard.Numbermass(number, color, ball.radius, pos_draw, self.world,
+                                   radius_for_draw=ball.draw_radius, scale=self.world.scale, **options)
+
+    def create_rack(self):
+        """手玉と的球を、台の設定の rack の位置に並べて作るメソッド"""
+        return [self.create_ball(b.number, pygame.Color(b.color), b.pos) for b in self.table.rack]
+
+    def create_boundary(self, name):
+        for cushion in self.table.cushions:
+            if cushion.name == name:
+                return billiard.Boundary(cushion.normal, cushion.point, self.world, self.actor_list,
+                                         hit_flag=cushion.hit_flag, skip=cushion.skip)
+        raise KeyError(f"table {self.table.name!r} has no cushion {name!r}")
+
+    def create_boundaries(self):
+        """台の設定の全ての壁を、設定に書かれた順に作るメソッド"""
+        return [self.create_boundary(cushion.name) for cushion in self.table.cushions]
+
+    def create_collision_resolver(self, broadphase=False, live_balls=None):
+        if broadphase:
+            import broadphase as bp
+            return billiard.CollisionResolver(self.world, self.actor_list, broadphase=bp.SpatialHashGrid(),
+                                              live_balls=live_balls)
+        return billiard.CollisionResolver(self.world, self.actor_list, live_balls=live_balls)
+
+    def create_contact_phase(self, live_balls, boundaries, pockets):
+        return billiard.ContactPhase(self.world, live_balls, boundaries, pockets)
+
+    def create_adaptive_timestep(self, live_balls, boundaries):
+        return billiard.AdaptiveTimestep(self.world, live_balls, boundaries)
+
+    def create_balls(self, ball_states):
+        """スナップショットの BallState から球を作り直すメソッド"""
+        balls = []
+        table = self.table
+        for state in ball_states:
+            ball = billiard.Numbermass(state.number, pygame.Color(*state.color), state.radius, (0, 0), self.world,
+                                       restitution=state.restitution, mass=state.mass,
+                                       radius_for_draw=table.ball.draw_radius, scale=self.world.scale)
+            ball.pos_real = PgVector(state.pos)
+            ball.pos_draw = ball.pos_real * self.world.scale
+            ball.vel_real = PgVector(state.vel)
+            ball.angle = state.angle
+            ball.angular_velocity = state.angular_velocity
+            ball.total_force = PgVector(state.force)  # 前のtickで計算され、まだ加えられていない力
+            ball.angular_acceleration = state.angular_acceleration
+            balls.append(ball)
+        return balls
+
+    def create_pockets(self, pocket_data=None):
+        if pocket_data is None:
+            pocket_data = [{"centerpos": p.centerpos, "radius": p.radius} for p in self.table.pockets]
+        pockets = []
+        for data in pocket_data:
+            pocket = billiard.Pocket(
+                self.world,
+                data["centerpos"],
+                data["radius"],
+                self.actor_list
+            )
+            pockets.append(pocket)
+        return pockets
+
+
+# プロセス間で受け渡しできるように、pygame のオブジェクトを含まない形で盤面を表す
+# table は台の設定の名前 (tableconfig.TableSpec.source)。壁・球の大きさ・縮尺は tableconfig.load(table) から読み直す
+TableSnapshot = collections.namedtuple("TableSnapshot", ["size", "dt", "friction", "grav_acc", "balls", "pockets", "table"],
+                                       defaults=(tableconfig.DEFAULT_TABLE,))
+BallState = collections.namedtuple("BallState", ["number", "color", "radius", "mass", "restitution",
+                                                 "pos", "vel", "angle", "angular_velocity",
+                                                 "force", "angular_acceleration"])
+PocketState = collections.namedtuple("PocketState", ["centerpos", "radius", "score"])
+
+
+def create_world(size=None, table=None):
+    """台の設定 (table は名前か TableSpec) の dt・摩擦・重力・縮尺で World を作る関数 (size を省略すると台の大きさ)"""
+    if not isinstance(table, tableconfig.TableSpec):
+        table = tableconfig.load(table or tableconfig.DEFAULT_TABLE)
+    return billiard.World(size or table.size, table.dt, table.friction, table.grav_acc, scale=table.scale)
+
+
+def force_from_drag(start_pos, end_pos):
+    """マウスのドラッグの始点と終点から、手玉に与える力を計算する関数 (AppMain.give_force_by_user と同じ)"""
+    force_magnitude = 50 + (PgVector(end_pos)-PgVector(start_pos)).magnitude() /7.5
+    direction = PgVector(end_pos) - PgVector(start_pos)
+    direction = direction.normalize()  # 方向のみを取得
+    return -direction * force_magnitude
+
+
+class Simulator:
+    """ディスプレイなしで World・Numbermass・Boundary・CollisionResolver・Pocket・Gamerule を動かすクラス
+
+    1回の step が AppMain.update の1回分にあたる。フォントも作らないので pygame.init() も不要。
+    壁とポケットは ContactPhase がまとめて調べ、落ちた球は tick の最後に actor_list から取り除く。
+    deterministic=True の場合は決まった順序で更新し、tickごとに状態のハッシュ (state_hash) を計算する (determinism)。
+    adaptive=True の場合は、球の速さと近さから tick ごとに World.dt を変える (AdaptiveTimestep。engine="object" のみ)。
+    ccd=True の場合は World.ccd を設定し、壁とポケットを tick の間の移動の線分で調べる (ContactPhase.update_swept)。
+    table は台の設定の名前か tableconfig.TableSpec (壁・球の並べ方・縮尺など)。snapshot から作り直す場合は、
+    table を省略すると snapshot.table の台を使う。
+    """
+    def __init__(self, world=None, engine="object", broadphase=False, snapshot=None, deterministic=False,
+                 adaptive=False, ccd=False, table=None):
+        if table is None and snapshot is not None:
+            table = snapshot.table
+        if not isinstance(table, tableconfig.TableSpec):
+            table = tableconfig.load(table or tableconfig.DEFAULT_TABLE)
+        if snapshot is not None:
+            world = billiard.World(snapshot.size, snapshot.dt, snapshot.friction, snapshot.grav_acc, scale=table.scale)
+        self.world = world or create_world(table=table)
+        if ccd:
+            self.world.ccd = True
+        self.actor_list = []
+        self.factory = ActorFactory(self.world, self.actor_list, table)
+        if snapshot is None:
+            self.actor_list.extend(self.factory.create_rack())
+        else:
+            self.actor_list.extend(self.factory.create_balls(snapshot.balls))
+        self.live_balls = billiard.LiveBalls(self.actor_list)
+        boundaries = self.factory.create_boundaries()
+        if adaptive:
+            if engine != "object":
+                raise ValueError("adaptive timestep requires engine='object'")
+            self.actor_list.append(self.factory.create_adaptive_timestep(self.live_balls, boundaries))
+        self.actor_list.append(self.factory.create_collision_resolver(broadphase, self.live_balls))
+        if snapshot is None:
+            self.pockets = self.factory.create_pockets()
+        else:
+            self.pockets = self.factory.create_pockets([{"centerpos": p.centerpos, "radius": p.radius} for p in snapshot.pockets])
+            for pocket, state in zip(self.pockets, snapshot.pockets):
+                pocket.score = state.score
+        self.actor_list.append(self.factory.create_contact_phase(self.live_balls, boundaries, self.pockets))
+        self.ball_table = None
+        if engine == "numpy":
+            # 球の数が多い場合は、全ての球の物理計算を配列でまとめて行う
+            import balltable
+            self.ball_table = balltable.BallTable.replace_actors(self.world, self.actor_list)
+        self.game_rule = gamerule.Gamerule(self.pockets)
+        self.tick_count = 0
+        self.simulated_time = 0.0
+        self.deterministic = deterministic
+        self.state_hash = None
+        self.profiler = None  # profiler.Profiler.attach で設定する
+        self.telemetry = None  # telemetry.Telemetry.attach で設定する
+        if deterministic:
+            self.world.pending_removals = []
+            self.state_hash = determinism.chain_hash(None, determinism.canonical_state(self))
+
+    def balls(self):
+        return list(self.live_balls)
+
+    def snapshot(self):
+        """現在の盤面を TableSnapshot として返すメソッド (球の順序は actor_list の順序を保つ)"""
+        balls = tuple(
+            BallState(b.number, tuple(b.color), b.radius, b.mass, b.restitution,
+                      (b.pos_real.x, b.pos_real.y), (b.vel_real.x, b.vel_real.y), b.angle, b.angular_velocity,
+                      (b.total_force.x, b.total_force.y), b.angular_acceleration)
+            for b in self.balls())
+        pockets = tuple(PocketState((p.centerpos.x, p.centerpos.y), p.radius, p.score) for p in self.pockets)
+        world = self.world
+        return TableSnapshot(tuple(world.size), world.dt, world.friction, (world.grav_acc.x, world.grav_acc.y), balls, pockets,
+                             self.factory.table.source)
+
+    def shoot(self, force, contact_point=None):
+        """手玉に力を加えるメソッド (AppMain.apply_force と同じ)
+
+        キューの力は base_dt の1tickだけ加わるものなので、dt が変わっている場合は同じ力積になるように換算する。
+        """
+        force = PgVector(force)
+        if self.telemetry is not None:
+            self.telemetry.shot(force, contact_point, self.actor_list[0])
+        world = self.world
+        if world.dt != world.base_dt:
+            force *= world.base_dt / world.dt
+        self.actor_list[0].receive_force(force, contact_point)
+
+    def step(self):
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.begin_tick()
+        dt = self.world.dt  # 球はこの dt で動く (AdaptiveTimestep が次の tick の dt に変えることがある)
+        if self.deterministic:
+            self.step_in_phases()
+        else:
+            self.update_actors(self.actor_list)
+        self.live_balls.compact(self.actor_list)
+        self.tick_count += 1
+        self.simulated_time += dt
+        if self.deterministic:
+            self.state_hash = determinism.chain_hash(self.state_hash, determinism.canonical_state(self))
+        if self.telemetry is not None:
+            self.telemetry.end_tick(self)
+        if profiler is not None:
+            profiler.end_tick()
+
+    def update_actors(self, actors):
+        if self.profiler is None:
+            for a in actors:
+                a.update()
+        else:
+            self.profiler.update_actors(actors)
+
+    def phases(self):
+        """actor_list を 球・球同士の力 (CollisionResolver など)・壁 (ContactPhase を含む)・ポケット に分けるメソッド
+
+        各組の中は actor_list の順。
+        """
+        balls, forces, boundaries, pockets = [], [], [], []
+        for a in self.actor_list:
+            if billiard.is_number_mass(a):
+                balls.append(a)
+            elif isinstance(a, (billiard.Boundary, billiard.ContactPhase)):
+                boundaries.append(a)
+            elif billiard.is_pocket(a):
+                pockets.append(a)
+            else:
+                forces.append(a)
+        return balls, forces, boundaries, pockets
+
+    def step_in_phases(self):
+        """決定的モードの1tick
+
+        actor_list の並びによらず 球→球同士の力→壁→ポケット の順に更新する。
+        ポケットに落ちた球は、更新中の actor_list を変えないように tick の最後にまとめて取り除く
+        (通常のモードでは、取り除いた球の次の actor の更新が飛ばされることがある)。
+        """
+        for phase in self.phases():
+            self.update_actors(phase)
+        self.remove_pending()
+
+    def remove_pending(self):
+        pending = self.world.pending_removals
+        for actor in pending:
+            self.actor_list.remove(actor)
+        pending.clear()
+
+    def are_balls_stopped(self):
+        """すべてのボールが停止しているかを確認するメソッド"""
+        for actor in self.live_balls:
+            if actor.vel_real.magnitude() > 0.1:
+                return False
+        return True
+
+    def run_until_stopped(self, max_ticks=100000):
+        """全ての球が止まるか、ゲームが終わるまでシミュレーションを進めるメソッド
+
+        ショットの直後はまだ速度が0なので、少なくとも1回は進めてから停止判定を行う。
+        戻り値は進めたtick数。
+        """
+        ticks = 0
+        while ticks < max_ticks:
+            self.step()
+            ticks += 1
+            if self.game_rule.game_over or self.are_balls_stopped():
+                break
+        return ticks
+
+
+def main():
+    simulator = Simulator()
+    simulator.shoot(force_from_drag((300, 300), (0, 302)), (0, 0))
+    start = time.perf_counter()
+    ticks = simulator.run_until_stopped()
+    elapsed = time.perf_counter() - start
+    print(f"ticks: {ticks}")
+    print(f"simulated time: {simulator.simulated_time:.3f} s")
+    print(f"wall time: {elapsed * 1e3:.1f} ms ({ticks / elapsed:.0f} ticks/s)")
+    print(f"real-time factor: {simulator.simulated_time / elapsed:.0f}x (simulated time)")
+    print(f"speed vs AppMain.run: {ticks / elapsed / 60:.0f}x (60 ticks/s)")
+    print(f"score: {sum(p.score for p in simulator.pockets)}")
+
+
+if __name__ == "__main__":
+    main()
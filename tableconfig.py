@@ -0,0 +1,202 @@
+"""台の大きさ・壁・ポケット・球の並べ方を、tables/ の JSON ファイルから読み込むモジュール
+
+load(name) は tables/<name>.json (または JSON ファイルのパス) を読み、値を確かめてから TableSpec に変換する。
+変換では、壁の法線を正規化し、壁ごとの当たったことを表すフラグ (billiard.FLOOR_HIT など) を決め、
+球の並べ方 (rows の三角形・ひし形など) をピクセル座標の位置の列にしておく。
+変換した TableSpec はプロセスの中でキャッシュするので、同じ台の Simulator を何回作っても JSON は1回しか読まない。
+
+壁の点 (point) の座標が負の場合は、台の右端・下端からの距離を表す (-80 は height - 80)。
+World の大きさが TableSpec.size と違う場合は for_size でその大きさに合わせた壁の位置を求める
+(ポケットの位置はそのまま)。
+
+使い方 (tables/ の全ての台を確かめ、読み込みと Simulator の作成の時間を表示する):
+    python tableconfig.py
+"""
+import collections
+import functools
+import json
+import math
+import os
+import time
+
+import assets
+import billiard
+
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables")
+DEFAULT_TABLE = "standard"
+
+# source は load に渡した名前 (または JSON のパス)。TableSnapshot.table に入れ、load(source) で同じ台を読み直す
+TableSpec = collections.namedtuple("TableSpec", ["name", "size", "scale", "image", "dt", "friction", "grav_acc",
+                                                 "ball", "cushions", "pockets", "rack", "source"])
+BallSpec = collections.namedtuple("BallSpec", ["radius", "mass", "restitution", "draw_radius"])
+# anchor は JSON に書かれた点 (負の座標は右端・下端から)。point は size に合わせて求めたピクセル座標
+# skip が true の壁は球に力を加えない (以前の x が 570〜630 の壁の扱い)
+CushionSpec = collections.namedtuple("CushionSpec", ["name", "normal", "anchor", "point", "hit_flag", "skip"])
+PocketSpec = collections.namedtuple("PocketSpec", ["centerpos", "radius"])
+RackBall = collections.namedtuple("RackBall", ["number", "color", "pos"])
+
+
+def table_path(name):
+    """台の名前 (tables/ のファイル名) か JSON ファイルのパスから、ファイルのパスを返す関数"""
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(TABLE_DIR, name + ".json")
+
+
+def available():
+    """tables/ にある台の名前のリストを返す関数"""
+    return sorted(f[:-5] for f in os.listdir(TABLE_DIR) if f.endswith(".json"))
+
+
+@functools.lru_cache(maxsize=None)
+def load(name=DEFAULT_TABLE):
+    """台を読み込み、確かめて TableSpec にして返す関数 (同じ name ではキャッシュしたものを返す)"""
+    path = table_path(name)
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return compile_table(data, path)._replace(source=name)
+
+
+def resolve(anchor, size):
+    """負の座標を、右端・下端からの距離として size の中の座標にする関数"""
+    return tuple(float(c + s if c < 0 else c) for c, s in zip(anchor, size))
+
+
+@functools.lru_cache(maxsize=64)
+def for_size(spec, size):
+    """壁の位置を、大きさ size の World に合わせた TableSpec を返す関数 (size が同じなら spec をそのまま返す)"""
+    size = tuple(size)
+    if size == spec.size:
+        return spec
+    cushions = tuple(c._replace(point=resolve(c.anchor, size)) for c in spec.cushions)
+    return spec._replace(size=size, cushions=cushions)
+
+
+def check_number(value, name, source, positive=True):
+    """value が (positive なら正の) 有限の数であることを確かめる関数。違う場合は ValueError"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ValueError(f"{source}: {name} must be a number")
+    if positive and value <= 0:
+        raise ValueError(f"{source}: {name} must be positive")
+    return value
+
+
+def check_pair(value, name, source):
+    """value が2つの数の組であることを確かめ、tuple にして返す関数"""
+    if not isinstance(value, (list, tuple)) or len(value) != 2:
+        raise ValueError(f"{source}: {name} must be a pair of numbers")
+    return tuple(check_number(v, name, source, positive=False) for v in value)
+
+
+def compile_table(data, source="<table>"):
+    """JSON の内容を確かめて TableSpec に変換する関数。正しくない場合は ValueError"""
+    for key in ("name", "size", "scale", "dt", "friction", "grav_acc", "ball", "cushions", "pockets", "rack"):
+        if key not in data:
+            raise ValueError(f"{source}: missing {key!r}")
+    size = tuple(int(check_number(v, "size", source)) for v in check_pair(data["size"], "size", source))
+    image = data.get("image")
+    if image is not None and not os.path.exists(os.path.join(assets.IMAGE_DIR, image)):
+        raise ValueError(f"{source}: image {image!r} not found")
+
+    ball_data = data["ball"]
+    ball = BallSpec(*(check_number(ball_data.get(key), f"ball.{key}", source) for key in BallSpec._fields))
+
+    cushions = []
+    for n, cushion in enumerate(data["cushions"]):
+        nx, ny = check_pair(cushion.get("normal"), f"cushions[{n}].normal", source)
+        length = math.hypot(nx, ny)
+        if length == 0:
+            raise ValueError(f"{source}: cushions[{n}].normal must not be zero")
+        normal = (nx / length, ny / length)
+        anchor = check_pair(cushion.get("point"), f"cushions[{n}].point", source)
+        cushions.append(CushionSpec(cushion.get("name", str(n)), normal, anchor, resolve(anchor, size),
+                                    billiard.NORMAL_HIT_FLAGS.get(normal, 0), bool(cushion.get("skip", False))))
+    if len({c.name for c in cushions}) != len(cushions):
+        raise ValueError(f"{source}: cushion names must be unique")
+
+    pockets = tuple(PocketSpec(check_pair(p.get("centerpos"), f"pockets[{n}].centerpos", source),
+                               check_number(p.get("radius"), f"pockets[{n}].radius", source))
+                    for n, p in enumerate(data["pockets"]))
+
+    rack = compile_rack(data["rack"], source)
+    numbers = [b.number for b in rack]
+    if len(set(numbers)) != len(numbers):
+        raise ValueError(f"{source}: ball numbers must be unique")
+    for b in rack:
+        for c in cushions:
+            if c.normal[0] * (b.pos[0] - c.point[0]) + c.normal[1] * (b.pos[1] - c.point[1]) + ball.draw_radius > 0:
+                raise ValueError(f"{source}: ball {b.number} overlaps cushion {c.name!r}")
+        for p in pockets:
+            if math.dist(b.pos, p.centerpos) < p.radius:
+                raise ValueError(f"{source}: ball {b.number} is inside a pocket")
+    for i, a in enumerate(rack):
+        for b in rack[i + 1:]:
+            if math.dist(a.pos, b.pos) < 2 * ball.draw_radius:
+                raise ValueError(f"{source}: balls {a.number} and {b.number} overlap")
+
+    return TableSpec(str(data["name"]), size, check_number(data["scale"], "scale", source), image,
+                     check_number(data["dt"], "dt", source),
+                     check_number(data["friction"], "friction", source, positive=False),
+                     check_pair(data["grav_acc"], "grav_acc", source), ball, tuple(cushions), pockets, tuple(rack),
+                     source)
+
+
+def compile_rack(data, source):
+    """手玉 (番号 0) と、rows (1列目から counts の数ずつ並べた的球) と balls (位置を直接書いた球) を並べる関数"""
+    if "cue" not in data:
+        raise ValueError(f"{source}: rack needs a cue ball")
+    cue = data["cue"]
+    rack = [RackBall(0, cue.get("color", "Black"), check_pair(cue.get("pos"), "rack.cue.pos", source))]
+    rows = data.get("rows")
+    if rows is not None:
+        apex_x, apex_y = check_pair(rows.get("apex"), "rack.rows.apex", source)
+        dx, dy = check_pair(rows.get("spacing"), "rack.rows.spacing", source)
+        color = rows.get("color", "white")
+        for n, count in enumerate(rows.get("counts", ())):
+            for k in range(count):
+                # 列の中では、下 (y が大きい方) から dy ずつ並べる (以前の create_rack と同じ順)
+                rack.append(RackBall(len(rack), color, (apex_x + dx * n, apex_y + dy * ((count - 1) / 2 - k))))
+    for n, b in enumerate(data.get("balls", ())):
+        pos = check_pair(b.get("pos"), f"rack.balls[{n}].pos", source)
+        rack.append(RackBall(b.get("number", len(rack)), b.get("color", "white"), pos))
+    return rack
+
+
+def render_table(spec):
+    """画像を使わない台 (image が null) の背景を、壁とポケットの位置から描いて返す関数
+
+    壁に囲まれた範囲を緑に、ポケットの円 (球が落ちる範囲) を黒に塗る。
+    """
+    import pygame
+    surface = pygame.Surface(spec.size)
+    surface.fill((90, 50, 20))
+    width, height = spec.size
+    left = min((c.point[0] for c in spec.cushions if c.normal == (-1.0, 0.0)), default=0)
+    right = max((c.point[0] for c in spec.cushions if c.normal == (1.0, 0.0)), default=width)
+    top = min((c.point[1] for c in spec.cushions if c.normal == (0.0, -1.0)), default=0)
+    bottom = max((c.point[1] for c in spec.cushions if c.normal == (0.0, 1.0)), default=height)
+    pygame.draw.rect(surface, (20, 110, 50), pygame.Rect(left, top, right - left, bottom - top))
+    for pocket in spec.pockets:
+        pygame.draw.circle(surface, (10, 10, 10), pocket.centerpos, pocket.radius)
+    return surface
+
+
+def main():
+    import simulator
+    for name in available():
+        start = time.perf_counter()
+        load.cache_clear()
+        spec = load(name)
+        loaded = time.perf_counter()
+        load(name)
+        cached = time.perf_counter()
+        for _ in range(100):
+            simulator.Simulator(table=name)
+        created = time.perf_counter()
+        print(f"{name:>10}: {len(spec.rack):>2} balls, {len(spec.pockets)} pockets, scale {spec.scale:g}  "
+              f"load {(loaded - start) * 1e3:.2f} ms, cached {(cached - loaded) * 1e6:.1f} us, "
+              f"Simulator {(created - cached) * 1e3 / 100:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
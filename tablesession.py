@@ -0,0 +1,191 @@
+"""1つのプロセスで多数の台 (ゲーム) を同時に進めるためのモジュール
+
+TableSession は1つの台の Simulator (World・球・壁・ポケット・CollisionResolver・Gamerule) をまとめたもので、
+ディスプレイやフォントを使わない。SessionScheduler は多数の TableSession を持ち、
+tick ごとに「動いている台」だけを進める。全ての球が静止した台 (速度・角速度・まだ加えられていない力が
+すべて 0) は、進めても状態が変わらないので動いている台の集合から外し、次に shoot されるまで何もしない。
+そのため、止まっている台が何百あっても1tickの時間には影響しない。
+
+台ごとに1tickの時間を RollingHistogram に記録し、stats で p50/p99 を返す。
+
+使い方 (300台のうち30台でブレイクショットを打ち、1tickの時間を表示する):
+    python tablesession.py
+"""
+import time
+
+import pygame
+
+import profiler
+import simulator
+
+PgVector = pygame.math.Vector2
+
+
+def is_resting(sim):
+    """sim の全ての球が静止しているか (進めても球の状態が変わらないか) を返す関数
+
+    Simulator.are_balls_stopped の 0.1 m/s より厳しく、速度・角速度・力がすべてちょうど 0 の場合だけ True。
+    """
+    for ball in sim.live_balls:
+        if (ball.vel_real.x or ball.vel_real.y or ball.angular_velocity
+                or ball.total_force.x or ball.total_force.y or ball.angular_acceleration):
+            return False
+    return True
+
+
+class TableSession:
+    """1つの台のシミュレーションと、その台の1tickの時間の記録をまとめたクラス
+
+    simulator_options は Simulator にそのまま渡す (engine・broadphase・snapshot・deterministic)。
+    """
+    def __init__(self, session_id, window=600, **simulator_options):
+        self.session_id = session_id
+        self.simulator = simulator.Simulator(**simulator_options)
+        self.latency = profiler.RollingHistogram(window)
+        self.shots = 0
+
+    @property
+    def game_over(self):
+        return self.simulator.game_rule.game_over
+
+    @property
+    def score(self):
+        return sum(pocket.score for pocket in self.simulator.pockets)
+
+    def shoot(self, force, contact_point=None):
+        self.simulator.shoot(PgVector(force), contact_point)
+        self.shots += 1
+
+    def is_idle(self):
+        """進める必要がないか (ゲームが終わったか、全ての球が静止しているか) を返すメソッド"""
+        return self.game_over or is_resting(self.simulator)
+
+    def step(self, clock=time.perf_counter):
+        """1tick進め、かかった時間を記録するメソッド"""
+        start = clock()
+        self.simulator.step()
+        self.latency.add(clock() - start)
+
+
+class SessionScheduler:
+    """多数の TableSession を持ち、動いている台だけを1tickずつ進めるクラス
+
+    動いている台は active に session_id を入れて管理する (追加した順に進める)。
+    advance(elapsed) は FixedStepScheduler と同じく、実時間を World.dt / time_scale ごとの tick に換算して進める。
+    """
+    def __init__(self, dt=0.005, time_scale=1.0, max_substeps=8, window=600, clock=time.perf_counter):
+        self.sessions = {}
+        self.active = {}  # session_id -> TableSession (dict は追加した順を保つ)
+        self.dt = dt
+        self.time_scale = time_scale
+        self.max_substeps = max_substeps
+        self.window = window
+        self.clock = clock
+        self.accumulator = 0.0
+        self.dropped_time = 0.0
+        self.tick_latency = profiler.RollingHistogram(window)  # 動いている全ての台を1tick進める時間
+        self.ticks = 0
+        self.session_ticks = 0  # 台ごとの tick の合計
+
+    def add(self, session_id, **simulator_options):
+        """台を作って加えるメソッド。作ったばかりの台は球が止まっているので active には入れない"""
+        if session_id in self.sessions:
+            raise ValueError(f"session {session_id!r} already exists")
+        session = TableSession(session_id, self.window, **simulator_options)
+        self.sessions[session_id] = session
+        if not session.is_idle():
+            self.active[session_id] = session
+        return session
+
+    def remove(self, session_id):
+        self.active.pop(session_id, None)
+        return self.sessions.pop(session_id)
+
+    def shoot(self, session_id, force, contact_point=None):
+        """台の手玉を突き、その台を動いている台にするメソッド"""
+        session = self.sessions[session_id]
+        session.shoot(force, contact_point)
+        if not session.is_idle():
+            self.active[session_id] = session
+
+    def tick(self):
+        """動いている台をそれぞれ1tick進め、止まった台を active から外すメソッド。戻り値は進めた台の数"""
+        clock = self.clock
+        start = clock()
+        stopped = []
+        for session_id, session in self.active.items():
+            session.step(clock)
+            if session.is_idle():
+                stopped.append(session_id)
+        count = len(self.active)
+        for session_id in stopped:
+            del self.active[session_id]
+        self.tick_latency.add(clock() - start)
+        self.ticks += 1
+        self.session_ticks += count
+        return count
+
+    def advance(self, elapsed):
+        """実時間 elapsed 秒の分だけ tick を進めるメソッド。戻り値は進めた tick 数
+
+        1回に進める tick は max_substeps までで、追いつけない分は dropped_time に加えて捨てる。
+        """
+        self.accumulator += elapsed * self.time_scale
+        substeps = 0
+        while self.accumulator >= self.dt:
+            if substeps >= self.max_substeps:
+                self.dropped_time += self.accumulator
+                self.accumulator = 0.0
+                break
+            self.tick()
+            self.accumulator -= self.dt
+            substeps += 1
+        return substeps
+
+    def run_until_idle(self, max_ticks=100000):
+        """全ての台が止まるまで (または max_ticks まで) 実時間によらず進めるメソッド。戻り値は進めた tick 数"""
+        ticks = 0
+        while self.active and ticks < max_ticks:
+            self.tick()
+            ticks += 1
+        return ticks
+
+    def stats(self):
+        """台ごとの1tickの時間 (秒) の要約と、全体の要約を返すメソッド"""
+        return {
+            "sessions": len(self.sessions),
+            "active": len(self.active),
+            "ticks": self.ticks,
+            "session_ticks": self.session_ticks,
+            "dropped_time": self.dropped_time,
+            "tick": self.tick_latency.summary(),
+            "per_session": {session_id: dict(session.latency.summary(), shots=session.shots, score=session.score,
+                                             game_over=session.game_over)
+                            for session_id, session in self.sessions.items()},
+        }
+
+
+def main():
+    scheduler = SessionScheduler()
+    for n in range(300):
+        scheduler.add(n)
+    start = time.perf_counter()
+    for _ in range(100):
+        scheduler.tick()  # 全ての台が止まっている間は何も進めない
+    idle = (time.perf_counter() - start) / 100
+    for n in range(0, 300, 10):
+        scheduler.shoot(n, simulator.force_from_drag((300, 300), (0, 302)), (0.01, 0))
+    start = time.perf_counter()
+    ticks = scheduler.run_until_idle()
+    elapsed = time.perf_counter() - start
+    stats = scheduler.stats()
+    print(f"idle tick: {idle * 1e6:.1f} us for {stats['sessions']} sessions")
+    print(f"{ticks} ticks, {stats['session_ticks']} session ticks in {elapsed:.2f} s "
+          f"({stats['session_ticks'] / elapsed:.0f} session ticks/s)")
+    print(f"scheduler tick: p50 {stats['tick']['p50'] * 1e3:.2f} ms, p99 {stats['tick']['p99'] * 1e3:.2f} ms")
+    worst = max(stats["per_session"].items(), key=lambda item: item[1]["p99"])
+    print(f"slowest session {worst[0]}: p50 {worst[1]['p50'] * 1e6:.0f} us, p99 {worst[1]['p99'] * 1e6:.0f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""ゲームの出来事 (イベント) とショットごとの統計を、物理の tick を止めずに書き出すためのモジュール
+
+World.telemetry が None の間は何もしない (出来事の起きた場所で1回 None かどうかを調べるだけで、結果は変わらない)。
+Telemetry.attach(simulator) で有効にすると、次の出来事をイベントとして記録する。
+    shot        手玉を突いた (Simulator.shoot / AppMain.apply_force)。力と打撃点
+    contact     球同士が衝突した (CollisionResolver.resolve_pair・BallTable)。2つの球の番号・位置・近づく速さ
+    cushion     球が壁に当たった (Numbermass.receive_cushion_hit・BallTable)。球の番号・壁・位置・速さ
+    pocket      球がポケットに落ちた (Pocket.receive_ball)。球の番号・ポケットの位置
+    game_end    ゲームが終わった (Gamerule)。メッセージ
+    shot_end    ショットの後に全ての球が止まった (またはゲームが終わった)。止まるまでの時間・tick 数・
+                球ごとの最大の速さ・衝突と壁とポケットの数
+イベントは (種類, tick, シミュレーション時間, 値の辞書) のタプルとして EventRing (上限のあるリングバッファ) に
+入れるだけで、JSON への変換とファイルやソケットへの書き込みは TelemetryWriter のスレッドが行う。
+書き込みが追いつかずリングバッファがいっぱいの場合は、新しいイベントを捨てて dropped に数える
+(tick は待たない)。捨てた数は stats() で返し、書き出すデータにも dropped のイベントとして残す。
+
+書き出し先 (open_sink で指定する)
+    ファイルのパス            1行に1つの JSON (NDJSON)。max_bytes を超えたら path.1, path.2, ... に回して新しく書く
+    tcp://host:port         そのアドレスに接続して NDJSON を送る (切れた場合は次の書き込みでつなぎ直す)
+    unix:///path/to/socket  Unix ドメインソケットに送る
+
+使い方 (ブレイクショットのイベントを一時ディレクトリの telemetry.ndjson に書き出して、種類ごとの数を表示する):
+    python telemetry.py
+"""
+import collections
+import json
+import math
+import os
+import socket
+import threading
+import time
+
+import billiard
+
+# 壁のフラグ (billiard.FLOOR_HIT など) からイベントに書く壁の名前
+CUSHION_NAMES = {flag: name[:-len("_hit")] for name, flag in billiard.MESSAGE_FLAGS.items()}
+
+
+class EventRing:
+    """上限 capacity 個のイベントを保持するリングバッファ
+
+    put は物理のスレッド、drain は書き出しのスレッドから呼ぶ。collections.deque の append と popleft は
+    スレッドの間で不可分なので、ロックは使わない。いっぱいの場合は新しいイベントを捨てて dropped に数える。
+    """
+    def __init__(self, capacity=8192):
+        self.capacity = capacity
+        self.events = collections.deque()
+        self.dropped = 0  # いっぱいで捨てたイベントの数 (put のスレッドだけが増やす)
+        self.accepted = 0
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, event):
+        if len(self.events) >= self.capacity:
+            self.dropped += 1
+            return False
+        self.events.append(event)
+        self.accepted += 1
+        return True
+
+    def drain(self, limit=None):
+        """先頭からイベントを取り出してリストで返すメソッド (limit を指定するとその数まで)"""
+        events = self.events
+        n = len(events) if limit is None else min(limit, len(events))
+        return [events.popleft() for _ in range(n)]
+
+
+class RotatingFileSink:
+    """NDJSON をファイルに書き、max_bytes を超えたら古いファイルを path.1 ... path.backups に回すクラス"""
+    def __init__(self, path, max_bytes=16 * 1024 * 1024, backups=3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "ab")
+        self.size = self.file.tell()
+
+    def write(self, data):
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+
+    def rotate(self):
+        self.file.close()
+        for n in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{n}"):
+                os.replace(f"{self.path}.{n}", f"{self.path}.{n + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "wb")
+        self.size = 0
+
+    def close(self):
+        self.file.close()
+
+
+class SocketSink:
+    """NDJSON を TCP (address が (host, port)) か Unix ドメインソケット (address が str) に送るクラス
+
+    接続できない・切れた場合は OSError を送出し (TelemetryWriter がそのまとまりを捨てて数える)、
+    次の write でつなぎ直す。つなぎ直すのは retry 秒に1回まで。
+    """
+    def __init__(self, address, timeout=1.0, retry=1.0):
+        self.address = address
+        self.timeout = timeout
+        self.retry = retry
+        self.sock = None
+        self.next_attempt = 0.0
+
+    def connect(self):
+        now = time.monotonic()
+        if now < self.next_attempt:
+            raise OSError(f"telemetry sink {self.address!r} is not connected")
+        self.next_attempt = now + self.retry
+        if isinstance(self.address, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(self.address)
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+        self.sock = sock
+
+    def write(self, data):
+        if self.sock is None:
+            self.connect()
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def open_sink(target, **options):
+    """target (ファイルのパス・tcp://host:port・unix:///path) から書き出し先を作る関数"""
+    if target.startswith("tcp://"):
+        host, _, port = target[len("tcp://"):].rpartition(":")
+        return SocketSink((host, int(port)), **options)
+    if target.startswith("unix://"):
+        return SocketSink(target[len("unix://"):], **options)
+    return RotatingFileSink(target, **options)
+
+
+def encode(event):
+    """(種類, tick, 時間, 値の辞書) のイベントを JSON の1行にする関数"""
+    kind, tick, t, fields = event
+    record = {"event": kind, "tick": tick, "t": round(t, 6)}
+    record.update(fields)
+    return json.dumps(record, separators=(",", ":"))
+
+
+class TelemetryWriter(threading.Thread):
+    """EventRing のイベントを interval 秒ごとにまとめて取り出し、sink に書き出すスレッド
+
+    書き込みに失敗したまとまりは捨てて sink_errors と lost に数える (物理のスレッドには伝えない)。
+    """
+    def __init__(self, ring, sink, interval=0.05, batch=4096):
+        super().__init__(name="telemetry-writer", daemon=True)
+        self.ring = ring
+        self.sink = sink
+        self.interval = interval
+        self.batch = batch
+        self.stopping = threading.Event()
+        self.written = 0  # 書き出したイベントの数
+        self.lost = 0  # 書き込みに失敗して捨てたイベントの数
+        self.sink_errors = 0
+        self.reported_dropped = 0  # dropped のイベントとして書き出した、リングバッファで捨てた数
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        """リングバッファが空になるまで書き出すメソッド"""
+        while True:
+            lines = [encode(event) for event in self.ring.drain(self.batch)]
+            dropped = self.ring.dropped
+            if dropped != self.reported_dropped:
+                # 捨てたイベントがあったことを、読む側が分かるように書き出しの中にも残す
+                lines.append(json.dumps({"event": "dropped", "count": dropped - self.reported_dropped,
+                                         "total": dropped}, separators=(",", ":")))
+                self.reported_dropped = dropped
+            if not lines:
+                return
+            try:
+                self.sink.write(("\n".join(lines) + "\n").encode("utf-8"))
+                self.written += len(lines)
+            except OSError:
+                self.sink_errors += 1
+                self.lost += len(lines)
+            if len(self.ring) == 0:
+                return
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+class Telemetry:
+    """物理の中から呼ばれてイベントを EventRing に入れ、ショットごとの統計をまとめるクラス
+
+    各メソッドは物理のスレッドで呼ばれ、リングバッファに入れる以外のことはしない。
+    sink を指定すると TelemetryWriter を起動して書き出す (None の場合は drain で取り出す)。
+    """
+    def __init__(self, sink=None, capacity=8192, interval=0.05):
+        self.ring = EventRing(capacity)
+        self.sink = sink
+        self.writer = None
+        if sink is not None:
+            self.writer = TelemetryWriter(self.ring, sink, interval)
+            self.writer.start()
+        self.tick = 0
+        self.time = 0.0
+        self.shot_state = None  # ショットの後、球が止まるまでの統計
+
+    def attach(self, sim):
+        """sim の球・壁・ポケット・ショットのイベントを記録するようにするメソッド"""
+        sim.telemetry = self
+        sim.world.telemetry = self
+        self.tick = sim.tick_count
+        self.time = sim.simulated_time
+
+    def detach(self, sim):
+        sim.telemetry = None
+        sim.world.telemetry = None
+
+    def emit(self, kind, fields):
+        self.ring.put((kind, self.tick, self.time, fields))
+
+    def shot(self, force, contact_point, cue_ball):
+        pos = cue_ball.pos_draw
+        self.emit("shot", {"force": [force[0], force[1]],
+                           "contact_point": None if contact_point is None else list(contact_point),
+                           "x": pos.x, "y": pos.y})
+        self.shot_state = {"tick": self.tick, "time": self.time, "peak_squared_speeds": {}, "contacts": 0,
+                           "cushions": 0, "pocketed": []}
+
+    def contact(self, p1, p2):
+        v1, v2 = p1.vel_real, p2.vel_real
+        self.emit("contact", {"a": p1.number, "b": p2.number,
+                              "x": (p1.pos_draw.x + p2.pos_draw.x) / 2, "y": (p1.pos_draw.y + p2.pos_draw.y) / 2,
+                              "speed": (v1 - v2).magnitude()})
+        if self.shot_state is not None:
+            self.shot_state["contacts"] += 1
+
+    def cushion(self, ball, flag):
+        self.emit("cushion", {"ball": ball.number, "cushion": CUSHION_NAMES.get(flag, flag),
+                              "x": ball.pos_draw.x, "y": ball.pos_draw.y, "speed": ball.vel_real.magnitude()})
+        if self.shot_state is not None:
+            self.shot_state["cushions"] += 1
+
+    def pocket(self, pocket, ball, is_cue_ball):
+        self.emit("pocket", {"ball": ball.number, "cue_ball": is_cue_ball,
+                             "pocket": [pocket.centerpos.x, pocket.centerpos.y]})
+        if self.shot_state is not None:
+            self.shot_state["pocketed"].append(ball.number)
+
+    def game_end(self, message):
+        self.emit("game_end", {"message": message})
+
+    def end_tick(self, sim):
+        """sim の1tickの後に呼ばれ、球の最大の速さを更新し、全ての球が止まったらショットの統計を書き出すメソッド
+
+        止まったかどうかは Simulator.are_balls_stopped と同じ 0.1 m/s で判定する。
+        毎tick全ての球を見るので、止まっている (asleep の) 球は飛ばし、平方根を求めずに速さの2乗で比べる。
+        """
+        self.tick = sim.tick_count
+        self.time = sim.simulated_time
+        state = self.shot_state
+        if state is None:
+            return
+        peaks = state["peak_squared_speeds"]
+        moving = False
+        for ball in sim.live_balls:
+            if ball.asleep:
+                continue
+            vel = ball.vel_real
+            squared = vel.x * vel.x + vel.y * vel.y
+            if squared > 0.01:  # 0.1 m/s
+                moving = True
+            if squared > peaks.get(ball.number, 0.0):
+                peaks[ball.number] = squared
+        if moving and not sim.game_rule.game_over:
+            return
+        peak_speeds = {n: math.sqrt(v) for n, v in peaks.items()}
+        self.emit("shot_end", {"ticks": self.tick - state["tick"], "time_to_rest": self.time - state["time"],
+                               "peak_speed": max(peak_speeds.values(), default=0.0),
+                               "peak_speeds": {str(n): v for n, v in sorted(peak_speeds.items())},
+                               "contacts": state["contacts"], "cushions": state["cushions"],
+                               "pocketed": state["pocketed"], "game_over": sim.game_rule.game_over})
+        self.shot_state = None
+
+    def drain(self):
+        """sink を使わない場合に、たまったイベントを JSON にできる辞書のリストとして取り出すメソッド"""
+        return [json.loads(encode(event)) for event in self.ring.drain()]
+
+    def stats(self):
+        """記録したイベントの数・リングバッファで捨てた数・書き出した数などを返すメソッド"""
+        writer = self.writer
+        return {"accepted": self.ring.accepted, "dropped": self.ring.dropped, "queued": len(self.ring),
+                "written": writer.written if writer else 0, "lost": writer.lost if writer else 0,
+                "sink_errors": writer.sink_errors if writer else 0}
+
+    def close(self):
+        """残りのイベントを書き出して、書き出しのスレッドと sink を閉じるメソッド"""
+        if self.writer is not None and self.writer.is_alive():
+            self.writer.stop()
+            self.sink.close()
+
+
+def main():
+    import tempfile
+
+    import simulator
+    path = os.path.join(tempfile.gettempdir(), "telemetry.ndjson")
+    if os.path.exists(path):
+        os.remove(path)
+    sim = simulator.Simulator()
+    telemetry = Telemetry(open_sink(path))
+    telemetry.attach(sim)
+    sim.shoot(simulator.force_from_drag((300, 300), (0, 302)), (0, 0))
+    start = time.perf_counter()
+    ticks = sim.run_until_stopped()
+    elapsed = time.perf_counter() - start
+    telemetry.close()
+    counts = collections.Counter()
+    summary = None  # 書き出し先のエラーなどで shot_end が書かれなかった場合は None のまま
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            counts[record["event"]] += 1
+            if record["event"] == "shot_end":
+                summary = record
+    print(f"{ticks} ticks in {elapsed * 1e3:.1f} ms, events written to {path}")
+    for kind, count in sorted(counts.items()):
+        print(f"{kind:>10}: {count}")
+    if summary is None:
+        print("no shot_end event was written")
+    else:
+        print(f"time to rest: {summary['time_to_rest']:.3f} s, peak speed: {summary['peak_speed']:.2f} m/s")
+    print(f"stats: {telemetry.stats()}")
+
+
+if __name__ == "__main__":
+    main()